@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк: пропускная способность конкурентных апдейтов
+с синхронным и асинхронным слоем доступа к БД.
+
+Каждый "апдейт" делает то же, что обработчик карточки: считает рейтинг
+карточки (AVG/COUNT по ratings) и ждет ответа Telegram API (sleep).
+Сетевая задержка до Postgres моделируется на уровне драйвера: синхронный
+драйвер блокирует поток, асинхронный уступает event loop.
+
+Usage: python benchmarks/bench_async_db.py [updates] [ratings] [db_latency_ms]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_async_db.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+from sqlalchemy import event, func, insert  # noqa: E402
+from sqlalchemy.util import await_only  # noqa: E402
+from database.database import (  # noqa: E402
+    engine, async_engine, init_db, get_session, dispose_async_engine
+)
+from database.models import Card, User, Rating  # noqa: E402
+from utils.helpers import get_card_rating  # noqa: E402
+
+CARDS = 50
+USERS = 1000
+API_LATENCY = 0.02  # simulated Telegram API round trip
+
+
+def seed(ratings: int):
+    """Fill the database with cards, users and ratings"""
+    init_db()
+    # One rating per (user, card): enough users for distinct pairs
+    users = max(USERS, -(-ratings // CARDS))
+    pairs = random.sample(range(users * CARDS), ratings)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': i} for i in range(1, users + 1)])
+        conn.execute(insert(Card), [
+            {'card_number': i, 'groups': ['A'], 'original_link': 'https://t.me/x/1'}
+            for i in range(1, CARDS + 1)
+        ])
+        conn.execute(insert(Rating), [
+            {'user_id': pair // CARDS + 1, 'card_id': pair % CARDS + 1,
+             'rating': random.randint(1, 10)}
+            for pair in pairs
+        ])
+
+
+def install_db_latency(latency: float):
+    """Simulate the network round trip to a remote database for every statement"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def blocking_wait(*args):
+        time.sleep(latency)
+
+    @event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+    def async_wait(*args):
+        await_only(asyncio.sleep(latency))
+
+
+def sync_get_card_rating(card_id: int):
+    """The pre-async helper: blocks the event loop while the query runs"""
+    session = get_session()
+    try:
+        result = session.query(
+            func.avg(Rating.rating),
+            func.count(Rating.id)
+        ).filter(Rating.card_id == card_id).first()
+        return (float(result[0] or 0.0), int(result[1] or 0))
+    finally:
+        session.close()
+
+
+async def sync_update(card_id: int):
+    sync_get_card_rating(card_id)
+    await asyncio.sleep(API_LATENCY)
+
+
+async def async_update(card_id: int):
+    await get_card_rating(card_id)
+    await asyncio.sleep(API_LATENCY)
+
+
+async def run(handler, updates: int):
+    latencies = []
+
+    async def timed(card_id):
+        started = time.perf_counter()
+        await handler(card_id)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(random.randint(1, CARDS)) for _ in range(updates)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'throughput': updates / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    ratings = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    db_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+
+    seed(ratings)
+    install_db_latency(db_latency)
+    print(
+        f"Concurrent updates: {updates}, ratings rows: {ratings}, "
+        f"DB latency: {db_latency * 1000:.1f} ms"
+    )
+
+    for name, handler in (('sync (before)', sync_update), ('async (after)', async_update)):
+        result = await run(handler, updates)
+        print(
+            f"{name:14} {result['throughput']:8.1f} updates/s  "
+            f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms"
+        )
+
+    await dispose_async_engine()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выдачи номера карточки при публикации: случайный подбор с SELECT
+на каждую попытку (старый generate_unique_card_number) против пула свободных
+номеров (utils/card_numbers.py) при заполненности 10%, 90% и 99%.
+
+Публикация = получить номер + INSERT карточки + COMMIT. Сетевая задержка
+до БД моделируется на каждый запрос (по умолчанию 1 мс).
+
+Usage: python benchmarks/bench_card_numbers.py [max_number] [publishes] [db_latency_ms]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_card_numbers.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+from sqlalchemy import event, select, delete, insert  # noqa: E402
+from sqlalchemy.util import await_only  # noqa: E402
+from database.database import engine, async_engine, init_db, get_async_session, dispose_async_engine  # noqa: E402
+from database.models import Card, CardNumberPool  # noqa: E402
+from utils.card_numbers import sync_card_number_pool, reserve_card_number  # noqa: E402
+
+statements = 0
+
+
+def install_db_latency(latency: float):
+    @event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+    def count_and_wait(*args):
+        global statements
+        statements += 1
+        if latency:
+            await_only(asyncio.sleep(latency))
+
+
+def fill(max_number: int, occupancy: float):
+    """Cards with a random occupancy share of the numbers"""
+    taken = random.Random(1).sample(range(1, max_number + 1), int(max_number * occupancy))
+    with engine.begin() as conn:
+        conn.execute(delete(CardNumberPool))
+        conn.execute(delete(Card))
+        conn.execute(insert(Card), [
+            {'card_number': number, 'groups': ['A'], 'original_link': 'https://t.me/x/1'}
+            for number in taken
+        ])
+
+
+async def sampled_number(session, max_number: int) -> int:
+    """The old approach: random number, one SELECT per attempt"""
+    while True:
+        number = random.randint(1, max_number)
+        if not await session.scalar(select(Card.id).where(Card.card_number == number)):
+            return number
+
+
+async def publish(allocate) -> float:
+    started = time.perf_counter()
+    async with get_async_session() as session:
+        number = await allocate(session)
+        session.add(Card(card_number=number, groups=['A'], original_link='https://t.me/x/1'))
+        await session.commit()
+    return (time.perf_counter() - started) * 1000
+
+
+async def run(max_number: int, publishes: int, occupancy: float, allocate):
+    global statements
+    latencies = []
+    statements = 0
+    for _ in range(publishes):
+        latencies.append(await publish(allocate))
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], statements / publishes
+
+
+async def main():
+    max_number = int(sys.argv[1]) if len(sys.argv) > 1 else 9999
+    publishes = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    init_db()
+    install_db_latency(latency_ms / 1000)
+    print(f"Numbers: 1-{max_number}, publishes per run: {publishes}, DB latency: {latency_ms} ms")
+    print(f"{'occupancy':>9} {'method':>8} {'p50':>9} {'p95':>9} {'queries':>8}")
+
+    for occupancy in (0.10, 0.90, 0.99):
+        # Both methods run out of numbers once the free ones are used up
+        # (sampling would loop forever, the pool raises CardNumbersExhausted)
+        free = max_number - int(max_number * occupancy)
+        count = min(publishes, free)
+        if count < publishes:
+            print(f"{occupancy:>9.0%} only {free} free numbers: {count} publishes per run")
+        if not count:
+            continue
+
+        fill(max_number, occupancy)
+        p50, p95, queries = await run(
+            max_number, count, occupancy,
+            lambda session: sampled_number(session, max_number)
+        )
+        print(f"{occupancy:>9.0%} {'sampling':>8} {p50:7.2f}ms {p95:7.2f}ms {queries:8.1f}")
+
+        fill(max_number, occupancy)
+        started = time.perf_counter()
+        await sync_card_number_pool(max_number)
+        sync_ms = (time.perf_counter() - started) * 1000
+        p50, p95, queries = await run(max_number, count, occupancy, reserve_card_number)
+        print(f"{occupancy:>9.0%} {'pool':>8} {p50:7.2f}ms {p95:7.2f}ms {queries:8.1f}   (pool sync {sync_ms:.0f} ms)")
+
+    await dispose_async_engine()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рассылки уведомлений подписчикам (utils/fanout.py) на временной
+SQLite-базе: по умолчанию 100 000 подписчиков района и категории (треть
+подписана на оба - каждый должен получить одно сообщение).
+
+Bot API заменен заглушкой с задержкой --api-latency; запросы идут через
+настоящий OutboundScheduler. Лимит рассылок поднят (RATE_LIMIT_BULK_PER_SECOND,
+по умолчанию 2000/с), чтобы измерить накладные расходы самого движка: с
+лимитом Telegram 100 000 сообщений заняли бы больше часа.
+
+Измеряется:
+- скорость рассылки и время на пачку;
+- задержка ответов пользователям (20 запросов/с в полосе INTERACTIVE)
+  без рассылки и во время нее, задержка цикла событий;
+- перезапуск: на 40% (посреди пачки) воркер останавливается и запускается
+  заново - рассылка продолжается с контрольной точки; считаются повторы
+  (не больше пачки) и пропуски.
+
+Usage: python benchmarks/bench_fanout.py [subscribers] [--api-latency MS]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
+import statistics
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_fanout.db')}")
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+os.environ.setdefault('RATE_LIMIT_BULK_PER_SECOND', '2000')
+os.environ.setdefault('RATE_LIMIT_GLOBAL_PER_SECOND', '2500')
+
+from sqlalchemy import insert  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+from database.database import engine, init_db, get_async_session  # noqa: E402
+from database.models import Card, User, DistrictSubscription, CategorySubscription, FanoutJob  # noqa: E402
+from utils.fanout import FanoutWorker, enqueue  # noqa: E402
+from utils.rate_limiter import OutboundScheduler  # noqa: E402
+import config  # noqa: E402
+
+DISTRICT = 'Pest'
+CATEGORY = 'Барбер'
+PROBE_CHAT = 10 ** 9  # interactive replies go to chats above this
+probe_chats = itertools.count(PROBE_CHAT)
+PROBE_RATE = 20  # interactive requests per second
+RESTART_AT = 0.4  # share of subscribers notified before the restart...
+
+
+class StubRequest(BaseRequest):
+    """Bot API stand-in: counts messages per chat"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.received = Counter()
+        self.notifications = 0
+        self.message_id = 0
+        self.restart_at = None
+        self.restart = asyncio.Event()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        else:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            chat_id = params['chat_id']
+            self.received[chat_id] += 1
+            self.notifications += chat_id < PROBE_CHAT
+            if self.notifications == self.restart_at:
+                self.restart.set()
+            self.message_id += 1
+            result = {'message_id': self.message_id, 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': 'ok'}
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def seed(subscribers: int) -> int:
+    """Users 1..N: a third subscribed to the district, a third to the category, a third to both"""
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{'id': user_id} for user_id in range(1, subscribers + 1)])
+        conn.execute(insert(DistrictSubscription), [
+            {'user_id': user_id, 'district': DISTRICT}
+            for user_id in range(1, subscribers + 1) if user_id % 3 != 2
+        ])
+        conn.execute(insert(CategorySubscription), [
+            {'user_id': user_id, 'category': CATEGORY}
+            for user_id in range(1, subscribers + 1) if user_id % 3 != 1
+        ])
+    return subscribers
+
+
+async def publish() -> int:
+    async with get_async_session() as session:
+        card = Card(card_number=1, groups=['A'], district=DISTRICT, category=CATEGORY,
+                    original_link='https://t.me/c/1/1', description='Бенчмарк',
+                    media_type='photo', media_file_id='AgACAgIAAxk')
+        session.add(card)
+        job = await enqueue(session, card)
+        await session.commit()
+        return job.id
+
+
+async def job_state(job_id: int):
+    async with get_async_session() as session:
+        job = await session.get(FanoutJob, job_id)
+        return job.status, job.last_user_id, job.sent
+
+
+async def probe(bot, stop: asyncio.Event, latencies: list):
+    """Interactive replies at PROBE_RATE per second, each to a new chat"""
+    while not stop.is_set():
+        chat_id = next(probe_chats)
+        started = time.perf_counter()
+        await bot.send_message(chat_id=chat_id, text='reply')
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(1 / PROBE_RATE)
+
+
+async def loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    p99 = values[max(0, int(len(values) * 0.99) - 1)]
+    return f"p50 {statistics.median(values):6.2f} ms  p99 {p99:7.2f} ms  (n={len(values)})"
+
+
+async def run(args):
+    request = StubRequest(args.api_latency / 1000)
+    application = (
+        Application.builder().token(config.BOT_TOKEN)
+        .request(request).get_updates_request(StubRequest(0)).updater(None)
+        .rate_limiter(OutboundScheduler())
+        .build()
+    )
+    await application.initialize()
+    bot = application.bot
+
+    # Baseline: interactive traffic alone
+    stop = asyncio.Event()
+    baseline, baseline_lag = [], []
+    tasks = [asyncio.create_task(probe(bot, stop, baseline)), asyncio.create_task(loop_lag(stop, baseline_lag))]
+    await asyncio.sleep(3)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    job_id = await publish()
+    stop = asyncio.Event()
+    during, during_lag = [], []
+    tasks = [asyncio.create_task(probe(bot, stop, during)), asyncio.create_task(loop_lag(stop, during_lag))]
+
+    started = time.perf_counter()
+    worker = FanoutWorker()
+    worker.start(bot)
+    worker.wake()
+    # ...plus half a batch, so the restart interrupts a batch in flight
+    request.restart_at = int(RESTART_AT * args.subscribers) + config.FANOUT_BATCH_SIZE // 2
+    await request.restart.wait()
+    await worker.stop()
+    _, checkpoint, _ = await job_state(job_id)
+    stopped_at = request.notifications
+    batches = worker.batches
+
+    # "Restart": a new worker picks the job up from the database
+    worker = FanoutWorker()
+    worker.start(bot)
+    while (await job_state(job_id))[0] != 'done':
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+    await worker.stop()
+    stop.set()
+    await asyncio.gather(*tasks)
+    await application.shutdown()
+
+    status, _, sent = await job_state(job_id)
+    received = {chat_id: count for chat_id, count in request.received.items() if chat_id < PROBE_CHAT}
+    duplicates = sum(count - 1 for count in received.values() if count > 1)
+    missing = args.subscribers - len(received)
+    print(f"{args.subscribers:,} subscribers, API latency {args.api_latency:.0f} ms, "
+          f"bulk limit {config.RATE_LIMIT_BULK_PER_SECOND:.0f}/s, batch {config.FANOUT_BATCH_SIZE}")
+    print(f"Fan-out: {elapsed:.1f} s, {sum(received.values()) / elapsed:,.0f} messages/s, "
+          f"{batches + worker.batches} batches, last batch {worker.last_batch_ms:.0f} ms")
+    print(f"Restart after {stopped_at:,} messages: resumed after user {checkpoint:,}; "
+          f"duplicates {duplicates}, missing {missing}, job {status}, sent {sent:,}")
+    print(f"Interactive reply, alone:       {percentiles(baseline)}")
+    print(f"Interactive reply, during:      {percentiles(during)}")
+    print(f"Event loop lag, alone:          {percentiles(baseline_lag)}")
+    print(f"Event loop lag, during:         {percentiles(during_lag)}")
+    print(f"Rate limiter: {bot.rate_limiter.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('subscribers', type=int, nargs='?', default=100_000)
+    parser.add_argument('--api-latency', type=float, default=20.0, help='simulated Bot API latency, ms')
+    args = parser.parse_args()
+    init_db()
+    seed(args.subscribers)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
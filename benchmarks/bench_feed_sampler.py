@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выборки карточек ленты на 1k, 100k и 1M карточек (SQLite):
+
+- rows+shuffle - все строки набора в Python, random.shuffle, первые k
+  (как get_cards_for_user до индекса каталога);
+- memory       - индекс каталога в памяти процесса (FEED_SAMPLER=memory),
+  отдельно время загрузки и объем;
+- database     - поиск по диапазону random_key (FEED_SAMPLER=database)
+  для нового пользователя и для видевшего 90% набора.
+
+Для маленького каталога - еще и равномерность: коэффициент вариации числа
+выпадений карточки (у идеальной выборки ~ 1/sqrt(среднее)).
+
+Usage: python benchmarks/bench_feed_sampler.py [sizes] [samples]
+       python benchmarks/bench_feed_sampler.py 1000,100000,1000000 200
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import statistics
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_feed_sampler.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+
+from sqlalchemy import event, insert, select  # noqa: E402
+from database.database import engine, async_engine, init_db, get_async_session, dispose_async_engine  # noqa: E402
+from database.models import Card, random_sort_key  # noqa: E402
+from utils.card_groups import groups_mask, groups_filter, mask_groups, CARD_SET_MASKS  # noqa: E402
+from utils.catalog_index import CatalogIndex  # noqa: E402
+from utils.feed_sampler import sample_card_ids  # noqa: E402
+import config  # noqa: E402
+
+K = 5
+SET_INDEX = 1  # A + B
+GROUP_CHOICES = [['A'], ['B'], ['C'], ['D'], ['E'], ['A', 'D'], ['B', 'E'], ['G'], ['H']]
+
+statements = 0
+
+
+@event.listens_for(async_engine.sync_engine, 'before_cursor_execute')
+def count_statement(*args):
+    global statements
+    statements += 1
+
+
+def grow_catalog(current: int, size: int):
+    """Insert cards current+1..size"""
+    rnd = random.Random(current)
+    with engine.begin() as conn:
+        for start in range(current + 1, size + 1, 50_000):
+            rows = []
+            for number in range(start, min(start + 50_000, size + 1)):
+                groups = rnd.choice(GROUP_CHOICES)
+                rows.append({
+                    'card_number': number,
+                    'groups': groups,
+                    'groups_mask': groups_mask(groups),
+                    'random_key': random_sort_key(),
+                    'original_link': f'https://t.me/x/{number}',
+                    'description': 'Мастер с опытом работы, быстро и качественно, рядом с метро',
+                })
+            conn.execute(insert(Card), rows)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[max(0, int(len(latencies) * 0.95) - 1)]
+
+
+async def timed(sample, runs: int):
+    global statements
+    statements = 0
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await sample()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return (*percentiles(latencies), statements / runs)
+
+
+async def rows_and_shuffle(mask: int):
+    async with get_async_session() as session:
+        rows = (await session.execute(select(Card.__table__).where(groups_filter(mask)))).all()
+    random.shuffle(rows)
+    return [row.id for row in rows[:K]]
+
+
+async def database_sample(mask: int, exclude=None):
+    async with get_async_session() as session:
+        return await sample_card_ids(session, mask, K, exclude=exclude)
+
+
+def report(label, p50, p95, queries, note=''):
+    print(f"  {label:<24} p50 {p50:9.2f} ms   p95 {p95:9.2f} ms   {queries:5.1f} queries/sample  {note}")
+
+
+async def uniformity(mask: int, in_set, draws: int):
+    """Coefficient of variation of per-card pick counts"""
+    index = CatalogIndex()
+    await index.ensure_loaded()
+    groups = mask_groups(mask)
+    memory_counts, database_counts = Counter(), Counter()
+    for _ in range(draws):
+        memory_counts.update(index.sample(groups, K))
+        database_counts.update(await database_sample(mask))
+
+    def variation(counts):
+        values = [counts[card_id] for card_id in in_set]
+        return statistics.pstdev(values) / statistics.mean(values)
+
+    ideal = (len(in_set) / (draws * K)) ** 0.5
+    print(f"  uniformity, {draws} draws: CV memory {variation(memory_counts):.3f}, "
+          f"database {variation(database_counts):.3f} (ideal ~{ideal:.3f})")
+
+
+async def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else '1000,100000,1000000').split(',')]
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    mask = CARD_SET_MASKS[SET_INDEX]
+
+    init_db()
+    print(f"Card set {config.CARD_SETS[SET_INDEX]}, k={K}, {samples} samples per method")
+
+    current = 0
+    for size in sorted(sizes):
+        grow_catalog(current, size)
+        current = size
+        async with get_async_session() as session:
+            in_set = list(await session.scalars(select(Card.id).where(groups_filter(mask))))
+        print(f"\n{size:,} cards, {len(in_set):,} in the set")
+
+        # Full materialization gets slow: fewer runs on big catalogs
+        report('rows+shuffle', *await timed(lambda: rows_and_shuffle(mask), max(3, min(samples, 200_000 // size))))
+
+        index = CatalogIndex()
+        started = time.perf_counter()
+        await index.ensure_loaded()
+        load_ms = (time.perf_counter() - started) * 1000
+        tracemalloc.start()
+        measured = CatalogIndex()
+        await measured.ensure_loaded()
+        index_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del measured
+        groups = mask_groups(mask)
+
+        async def memory_sample():
+            return index.sample(groups, K)
+
+        report('memory', *await timed(memory_sample, samples),
+               note=f"(load {load_ms:.0f} ms, ~{index_mb:.0f} MB per process)")
+        del index
+
+        report('database', *await timed(lambda: database_sample(mask), samples))
+        seen = set(random.Random(7).sample(in_set, int(len(in_set) * 0.9)))
+        report('database, 90% seen', *await timed(lambda: database_sample(mask, seen), samples))
+
+        if size <= 10_000:
+            await uniformity(mask, in_set, 20_000)
+    await dispose_async_engine()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк ранжирования ленты (utils/ranking.py) на синтетическом каталоге
+(по умолчанию 100 000 карточек, набор A, B, D, E):
+
+- время построения alias-таблиц;
+- задержка выборки 5 карточек: новый пользователь и видевший 90% набора;
+- доля показов на карточку по группам относительно группы A
+  (ожидается ~ FEED_GROUP_WEIGHTS), свежих и высоко оцененных карточек;
+- ограничение частоты рекламы: показы группы E на пользователя.
+
+Usage: python benchmarks/bench_ranking.py [cards] [draws]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_ranking.db')}")
+
+from utils.card_groups import groups_mask  # noqa: E402
+from utils.ranking import FeedRanking  # noqa: E402
+import config  # noqa: E402
+
+K = 5
+SET_INDEX = 3  # A, B, D, E
+GROUP_CHOICES = [['A'], ['A'], ['B'], ['B'], ['C'], ['D'], ['E'], ['A', 'D'], ['H']]
+
+
+def make_rows(count: int, now: datetime):
+    """(id, groups_mask, created_at, rating_sum, rating_count): a month of cards, some rated"""
+    rnd = random.Random(42)
+    for card_id in range(1, count + 1):
+        created_at = now - timedelta(hours=rnd.uniform(0, 24 * 30))
+        votes = rnd.choice([0, 0, 0, 2, 10, 40])
+        rating_sum = round(votes * rnd.uniform(config.MIN_RATING, config.MAX_RATING))
+        yield card_id, groups_mask(rnd.choice(GROUP_CHOICES)), created_at, rating_sum, votes
+
+
+def timed(draw, runs: int):
+    latencies = []
+    for user_id in range(runs):
+        started = time.perf_counter()
+        draw(user_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    draws = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    groups = config.CARD_SETS[SET_INDEX]
+    now = datetime.utcnow()
+    rows = list(make_rows(count, now))
+
+    ranking = FeedRanking()
+    ranking.load(rows, now)
+    print(f"{count:,} cards, set {groups}, k={K}, weights {config.FEED_GROUP_WEIGHTS}")
+    print(f"Build: {ranking.build_ms:.0f} ms")
+
+    in_set = [row[0] for row in rows if row[1] & groups_mask(groups)]
+    seen = set(random.Random(7).sample(in_set, int(len(in_set) * 0.9)))
+    # Fresh users each time, so the ad cap doesn't kick in
+    p50, p99 = timed(lambda user_id: ranking.sample(user_id, groups, K), draws)
+    print(f"Draw of {K}, new user:     p50 {p50 * 1000:7.1f} us   p99 {p99 * 1000:7.1f} us")
+    p50, p99 = timed(lambda user_id: ranking.sample(10_000_000 + user_id, groups, K, exclude=seen), 200)
+    print(f"Draw of {K}, 90% seen:     p50 {p50 * 1000:7.1f} us   p99 {p99 * 1000:7.1f} us")
+
+    # Exposure per card, relative to plain group A cards
+    picks = Counter()
+    for user_id in range(draws):
+        picks.update(ranking.sample(20_000_000 + user_id, groups, K).card_ids)
+    by_card = {row[0]: row for row in rows}
+    classes = {
+        'A': lambda row: row[1] == groups_mask(['A']),
+        'B': lambda row: row[1] == groups_mask(['B']),
+        'D (priority)': lambda row: row[1] == groups_mask(['D']),
+        'E (ads)': lambda row: row[1] == groups_mask(['E']),
+        'A, < 24h old': lambda row: row[1] == groups_mask(['A']) and now - row[2] < timedelta(hours=24),
+        'A, avg >= 9 (40 votes)': lambda row: (
+            row[1] == groups_mask(['A']) and row[4] == 40 and row[3] / row[4] >= 9
+        ),
+        'A, avg <= 2 (40 votes)': lambda row: (
+            row[1] == groups_mask(['A']) and row[4] == 40 and row[3] / row[4] <= 2
+        ),
+    }
+    rates = {}
+    for label, matches in classes.items():
+        members = [card_id for card_id, row in by_card.items() if matches(row)]
+        rates[label] = sum(picks[card_id] for card_id in members) / max(len(members), 1)
+    print("Picks per card, relative to group A:")
+    for label, rate in rates.items():
+        print(f"  {label:<24} {rate / rates['A']:5.2f}x")
+
+    # One user opening /cards 50 times in a row: ads limited by the bucket
+    ads = sum(
+        1 for _ in range(50)
+        for card_id in ranking.sample(-1, groups, K).card_ids
+        if by_card[card_id][1] & groups_mask(config.AD_GROUPS)
+    )
+    print(f"Ads for one user over 50 feeds in a burst: {ads} "
+          f"(AD_MAX_PER_FEED={config.AD_MAX_PER_FEED}, AD_BURST={config.AD_BURST})")
+    print(f"Stats: {ranking.stats()}")
+
+
+if __name__ == '__main__':
+    main()
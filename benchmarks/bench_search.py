@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк поиска: инвертированный индекс против линейного просмотра
+на синтетическом каталоге (по умолчанию 100 000 карточек).
+
+Usage: python benchmarks/bench_search.py [cards]
+"""
+import os
+import sys
+import time
+import random
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.search_index import SearchIndex, fold  # noqa: E402
+
+DISTRICTS = [
+    'Будапешт 5', 'Будапешт 13', 'Újpest', 'Óbuda', 'Pest', 'Буда', 'Kőbánya',
+    'Erzsébetváros', 'Józsefváros', 'Ferencváros', 'Центр', 'Zugló',
+]
+CATEGORIES = [
+    'Барбер', 'Массаж', 'Ресторан', 'Ремонт', 'Маникюр', 'Фотограф', 'Юрист',
+    'Fodrász', 'Masszázs', 'Étterem', 'Репетитор', 'Клининг', 'Переводчик',
+]
+HASHTAGS = [
+    'будапешт', 'недорого', 'русскоговорящий', 'срочно', 'качественно',
+    'budapest', 'olcsó', 'доставка', 'скидка', 'выезд', 'тату', 'стрижка',
+]
+WORDS = (
+    'мастер опыт работы быстро цена консультация запись салон услуги '
+    'профессиональный центр рядом метро удобно качество гарантия отзывы '
+    'szolgáltatás gyors minőség olcsó közel'
+).split()
+
+QUERIES = {
+    'exact': ['барбер', 'массаж', 'újpest', 'недорого', 'fodrász'],
+    'folded': ['ujpest', 'obuda', 'kobanya', 'fodrasz', 'etterem'],
+    'prefix': ['барб', 'масс', 'ремо', 'фото', 'репет'],
+    'fuzzy': ['масаж', 'барбр', 'ресторн', 'манекюр', 'фотограв'],
+    'multi': ['барбер будапешт', 'массаж недорого', 'ремонт срочно', 'юрист центр'],
+}
+
+
+def make_cards(count: int):
+    rnd = random.Random(42)
+    for card_id in range(1, count + 1):
+        yield (
+            card_id,
+            rnd.choice(DISTRICTS),
+            rnd.choice(CATEGORIES),
+            rnd.sample(HASHTAGS, 3),
+            ' '.join(rnd.choices(WORDS, k=12)),
+        )
+
+
+def linear_search(cards, query: str, limit: int = 10):
+    """Equivalent of the old ILIKE '%q%' scan over district/category/hashtags"""
+    q = query.lower().strip()
+    found = []
+    for card_id, district, category, hashtags, _ in cards:
+        if q in district.lower() or q in category.lower() or q in hashtags:
+            found.append(card_id)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def timed(fn, queries, repeat: int = 20):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            fn(query)
+            samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    cards = list(make_cards(count))
+
+    index = SearchIndex()
+    started = time.perf_counter()
+    index.load(cards)
+    build_s = time.perf_counter() - started
+    print(f"Cards: {count}, terms: {len(index._postings)}, index build: {build_s:.2f} s")
+
+    print(f"{'query kind':12} {'index p50':>10} {'index p95':>10} {'scan p50':>10}")
+    for kind, queries in QUERIES.items():
+        p50, p95 = timed(lambda q: index.search(q, 10), queries)
+        # The old scan only matches exact substrings; a miss walks the whole catalog
+        scan_p50, _ = timed(lambda q: linear_search(cards, q), queries, repeat=3)
+        print(f"{kind:12} {p50:8.2f}ms {p95:8.2f}ms {scan_p50:8.2f}ms")
+
+    started = time.perf_counter()
+    for card_id in range(1, 1001):
+        index.remove(card_id)
+    for card in cards[:1000]:
+        index.add(*card)
+    print(f"Incremental update: {(time.perf_counter() - started) / 2000 * 1000:.3f} ms per card")
+
+    sample = index.search_scored('масаж ujpest', 3)
+    print(f"Sample 'масаж ujpest' -> {[(card_id, round(score, 2)) for card_id, score in sample]}")
+    print(f"fold('Kőbánya Ёлка') = {fold('Kőbánya Ёлка')!r}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,15 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+
+def _positive(name: str, default: str, cast=float):
+    """Setting that must be above zero (token-bucket rates and burst sizes)"""
+    value = cast(os.getenv(name, default))
+    if value <= 0:
+        raise ValueError(f"{name} must be positive, got {value}")
+    return value
+
+
 # Bot configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS_STR = os.getenv('ADMIN_IDS', '')
@@ -27,7 +36,17 @@ logger.info(f"   MODERATION_GROUP_ID: {MODERATION_GROUP_ID}")
 # Database configuration
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bot_database.db')
 
-# Card groups
+# Update delivery: 'polling' (getUpdates) or 'webhook' (embedded HTTP server)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public base URL, e.g. https://bot.up.railway.app
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # required in webhook mode: 1-256 of A-Z, a-z, 0-9, _ and -
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))  # pending updates before 503
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Card groups (position = bit in cards.groups_mask: only append, never reorder)
 CARD_GROUPS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
 
 # Card sets for users (which groups to show)
@@ -42,6 +61,15 @@ CARD_SETS = [
 # Cooldowns (in seconds)
 COOLDOWN_TEXT_FORM = 8 * 3600  # 8 hours for submitting forms
 COOLDOWN_RATING = 60  # 1 minute between ratings
+# Only cooldowns at least this long are written to the database (survive restarts)
+COOLDOWN_PERSIST_MIN_SECONDS = int(os.getenv('COOLDOWN_PERSIST_MIN_SECONDS', '3600'))
+
+# Token-bucket limit for /search: tokens per minute and burst size
+SEARCH_RATE_PER_MINUTE = _positive('SEARCH_RATE_PER_MINUTE', '10')
+SEARCH_RATE_BURST = _positive('SEARCH_RATE_BURST', '5', int)
+
+# Card numbers are drawn at random from 1..CARD_NUMBER_MAX
+CARD_NUMBER_MAX = int(os.getenv('CARD_NUMBER_MAX', '9999'))
 
 # Card deletion time for group F
 GROUP_F_DELETE_TIME = 24 * 3600  # 24 hours
@@ -49,6 +77,70 @@ GROUP_F_DELETE_TIME = 24 * 3600  # 24 hours
 # Cards per page
 CARDS_PER_PAGE = 5
 
+# ◀️/▶️/🪞 navigation: 'edit' (edit the card message in place) or 'send' (new message per step)
+CARD_NAVIGATION_MODE = os.getenv('CARD_NAVIGATION_MODE', 'edit')
+
 # Rating (UPDATED: 1-10 вместо 1-5)
 MIN_RATING = 1
 MAX_RATING = 10
+
+# Search backend: 'index' (in-memory inverted index) or 'database'
+# (Postgres tsvector/pg_trgm or SQLite FTS5, chosen by DATABASE_URL dialect)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'index')
+
+# Feed sampler: 'ranked' (weighted draw, see utils/ranking.py), 'memory'
+# (uniform, catalog index of all card IDs in process memory) or 'database'
+# (uniform, range seek on the indexed cards.random_key, nothing kept in memory)
+FEED_SAMPLER = os.getenv('FEED_SAMPLER', 'ranked')
+
+# Feed ranking (FEED_SAMPLER=ranked)
+FEED_GROUP_WEIGHTS = {'D': 3.0, 'E': 2.0}  # other groups weigh 1.0; 0 keeps a group out of the feed
+FRESH_BOOST = float(os.getenv('FRESH_BOOST', '1.0'))  # a new card weighs 1 + FRESH_BOOST times more...
+FRESH_HALF_LIFE_HOURS = float(os.getenv('FRESH_HALF_LIFE_HOURS', '24'))  # ...and the boost halves every N hours
+RATING_BOOST = float(os.getenv('RATING_BOOST', '0.5'))  # weight x (1 - boost) for the worst rated, x (1 + boost) for the best
+AD_GROUPS = ['E']  # advertising: frequency-capped per user
+AD_MAX_PER_FEED = int(os.getenv('AD_MAX_PER_FEED', '1'))  # ad cards in one /cards batch
+AD_PER_HOUR = float(os.getenv('AD_PER_HOUR', '4'))  # ad cards a user gets per hour...
+AD_BURST = int(os.getenv('AD_BURST', '2'))  # ...and at most this many in a row
+RANKING_REFRESH_INTERVAL = int(os.getenv('RANKING_REFRESH_INTERVAL', '600'))  # seconds between weight rebuilds
+
+# Performance
+SEEN_SET_CACHE_SIZE = int(os.getenv('SEEN_SET_CACHE_SIZE', '10000'))  # users' seen bitmaps kept in memory
+COUNTER_FLUSH_INTERVAL = float(os.getenv('COUNTER_FLUSH_INTERVAL', '5'))  # seconds between counter flushes
+COUNTER_MAX_PENDING = int(os.getenv('COUNTER_MAX_PENDING', '1000'))  # cards with pending deltas before early flush
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '50000'))  # known users (profile + last write) kept in memory
+USER_ACTIVITY_WINDOW = int(os.getenv('USER_ACTIVITY_WINDOW', '300'))  # at most one last_activity write per user per window
+CARD_CACHE_SIZE = int(os.getenv('CARD_CACHE_SIZE', '5000'))  # rendered cards (caption + keyboard) kept in memory
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))  # handlers running at once (1 = sequential)
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '256'))  # updates admitted, incl. those waiting for their user
+
+# SQL per update (utils/query_stats.py): log updates above any of these...
+QUERY_LOG_STATEMENTS = int(os.getenv('QUERY_LOG_STATEMENTS', '15'))
+QUERY_LOG_DB_MS = float(os.getenv('QUERY_LOG_DB_MS', '250'))
+QUERY_LOG_SESSIONS = int(os.getenv('QUERY_LOG_SESSIONS', '3'))  # pool checkouts, i.e. separate sessions
+# ...and flag the same statement run this many times in one update as N+1
+N_PLUS_ONE_REPEATS = int(os.getenv('N_PLUS_ONE_REPEATS', '3'))
+
+# Prometheus metrics (utils/metrics.py): GET /metrics, local only by default; port 0 disables
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# Outbound Bot API limits (utils/rate_limiter.py), after Telegram's flood limits
+RATE_LIMIT_GLOBAL_PER_SECOND = _positive('RATE_LIMIT_GLOBAL_PER_SECOND', '30')
+RATE_LIMIT_BULK_PER_SECOND = _positive('RATE_LIMIT_BULK_PER_SECOND', '20')  # broadcasts, within the global limit
+RATE_LIMIT_CHAT_PER_SECOND = _positive('RATE_LIMIT_CHAT_PER_SECOND', '1')
+RATE_LIMIT_CHAT_BURST = _positive('RATE_LIMIT_CHAT_BURST', '3', int)
+RATE_LIMIT_GROUP_PER_MINUTE = _positive('RATE_LIMIT_GROUP_PER_MINUTE', '20')
+RATE_LIMIT_GROUP_BURST = _positive('RATE_LIMIT_GROUP_BURST', '5', int)
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '3'))  # on RetryAfter (429)
+
+# New-card notifications to district/category subscribers (utils/fanout.py)
+FANOUT_BATCH_SIZE = int(os.getenv('FANOUT_BATCH_SIZE', '100'))  # subscribers per checkpoint
+FANOUT_MAX_ATTEMPTS = int(os.getenv('FANOUT_MAX_ATTEMPTS', '3'))  # per subscriber, on network errors
+FANOUT_RETRY_DELAY = float(os.getenv('FANOUT_RETRY_DELAY', '5'))  # seconds
+FANOUT_JOB_MAX_ATTEMPTS = int(os.getenv('FANOUT_JOB_MAX_ATTEMPTS', '5'))  # failed runs before a job is marked failed
+
+# Maintenance jobs (seconds between runs, rows per DELETE batch)
+CARD_EXPIRY_INTERVAL = int(os.getenv('CARD_EXPIRY_INTERVAL', '300'))
+PURGE_INTERVAL = int(os.getenv('PURGE_INTERVAL', '3600'))
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '500'))
@@ -1,12 +1,30 @@
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, update, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, scoped_session
-from database.models import Base
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database.models import Base, Card, Rating
+from database.fulltext import get_fulltext
+from database.migrations import run_migrations, stamp_all
 import config
 
 logger = logging.getLogger(__name__)
 
-# Create engine
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync DATABASE_URL onto the matching asyncio driver"""
+    if url.startswith('sqlite+aiosqlite:') or url.startswith('postgresql+asyncpg:'):
+        return url
+    if url.startswith('sqlite:'):
+        return 'sqlite+aiosqlite:' + url[len('sqlite:'):]
+    for prefix in ('postgres://', 'postgresql://', 'postgresql+psycopg2://'):
+        if url.startswith(prefix):
+            return 'postgresql+asyncpg://' + url[len(prefix):]
+    raise ValueError(f"Unsupported DATABASE_URL for async engine: {url}")
+
+
+# Create engine (used by init_db and offline tools)
 engine = create_engine(
     config.DATABASE_URL,
     pool_pre_ping=True,
@@ -18,11 +36,75 @@ engine = create_engine(
 session_factory = sessionmaker(bind=engine)
 Session = scoped_session(session_factory)
 
+# Async engine used by handlers and helpers, so queries never block the event loop
+async_engine = create_async_engine(
+    get_async_database_url(config.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    echo=False
+)
+
+# Objects are handed to handlers after the session closes, so keep them loaded
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
+
+def dialect_insert(table):
+    """INSERT construct with ON CONFLICT support for the engine's dialect"""
+    if async_engine.dialect.name == 'postgresql':
+        return postgresql_insert(table)
+    if async_engine.dialect.name == 'sqlite':
+        return sqlite_insert(table)
+    raise NotImplementedError(f"No upsert support for {async_engine.dialect.name}")
+
+
+# Database-side full-text search, chosen by dialect (None if unsupported)
+fulltext = get_fulltext(engine.dialect.name)
+
+
+def rating_aggregates_statement():
+    """UPDATE that recomputes cards.rating_sum/rating_count from ratings"""
+    return update(Card).values(
+        rating_sum=select(func.coalesce(func.sum(Rating.rating), 0))
+        .where(Rating.card_id == Card.id)
+        .scalar_subquery(),
+        rating_count=select(func.count(Rating.id))
+        .where(Rating.card_id == Card.id)
+        .scalar_subquery()
+    )
+
+
+def setup_fulltext() -> bool:
+    """Create full-text search structures for the current dialect"""
+    if fulltext is None:
+        return False
+    try:
+        with engine.begin() as conn:
+            fulltext.setup(conn)
+        fulltext.available = True
+        logger.info(f"Full-text search ready ({fulltext.name})")
+    except Exception as e:
+        # e.g. SQLite built without FTS5 or no rights to CREATE EXTENSION
+        logger.warning(f"Full-text search unavailable ({fulltext.name}): {e}")
+    return fulltext.available
+
 
 def init_db():
     """Initialize database tables"""
     try:
+        fresh = not inspect(engine).has_table('cards')
         Base.metadata.create_all(engine)
+        if fresh:
+            # create_all() already built the latest schema
+            stamp_all(engine)
+        else:
+            applied = run_migrations(engine)
+            if applied:
+                logger.info(f"Applied migrations: {applied}")
+        setup_fulltext()
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
@@ -37,3 +119,13 @@ def get_session():
 def close_session():
     """Close database session"""
     Session.remove()
+
+
+def get_async_session() -> AsyncSession:
+    """Get async database session (use as ``async with get_async_session() as session``)"""
+    return AsyncSessionLocal()
+
+
+async def dispose_async_engine():
+    """Close pooled async connections"""
+    await async_engine.dispose()
@@ -0,0 +1,155 @@
+"""
+Полнотекстовый поиск на стороне БД
+
+Postgres: генерируемая колонка tsvector + GIN индекс, pg_trgm для нечеткого поиска.
+SQLite: теневая таблица FTS5, синхронизируемая триггерами.
+Реализация выбирается по диалекту движка (см. database/database.py).
+"""
+import re
+import logging
+from typing import List, Optional
+from sqlalchemy import select, text, func, literal_column, table, column, or_
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def query_words(query: str) -> List[str]:
+    """Search words of a user query; only \\w characters reach the match syntax"""
+    return _WORD_RE.findall(query.lower())[:8]
+
+
+class PostgresFullText:
+    """tsvector (exact + prefix) and pg_trgm similarity (typos) on the cards table"""
+
+    name = 'postgresql'
+    available = False
+
+    # 'simple' config: no stemming, works for the Russian/Hungarian mix
+    SETUP = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """
+        ALTER TABLE cards ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(category, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(district, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(hashtags::jsonb::text, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+        ) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_cards_search_vector ON cards USING GIN (search_vector)",
+        """
+        CREATE INDEX IF NOT EXISTS ix_cards_search_trgm ON cards USING GIN (
+            (lower(coalesce(category, '') || ' ' || coalesce(district, ''))) gin_trgm_ops
+        )
+        """,
+    ]
+
+    def setup(self, conn):
+        for statement in self.SETUP:
+            conn.execute(text(statement))
+
+    def statement(self, query: str, limit: int) -> Optional[Select]:
+        words = query_words(query)
+        if not words:
+            return None
+
+        cards = table('cards', column('id'))
+        vector = literal_column('search_vector')
+        tsquery = func.to_tsquery('simple', ' & '.join(f"{word}:*" for word in words))
+        # Same SQL text as ix_cards_search_trgm, so the planner can use the index
+        short_text = literal_column("lower(coalesce(category, '') || ' ' || coalesce(district, ''))")
+        phrase = ' '.join(words)
+
+        return (
+            select(cards.c.id)
+            .where(or_(vector.op('@@')(tsquery), short_text.op('%')(phrase)))
+            .order_by(
+                (func.ts_rank(vector, tsquery) + func.similarity(short_text, phrase)).desc(),
+                cards.c.id
+            )
+            .limit(limit)
+        )
+
+
+class SqliteFullText:
+    """FTS5 table over cards, kept in sync by triggers"""
+
+    name = 'sqlite'
+    available = False
+
+    # Hashtags are a JSON array: index the decoded values, not the JSON text
+    _HASHTAGS = "(SELECT group_concat(value, ' ') FROM json_each({row}.hashtags))"
+    _INSERT = (
+        "INSERT INTO cards_fts(rowid, district, category, hashtags, description) "
+        "VALUES ({row}.id, {row}.district, {row}.category, " + _HASHTAGS + ", {row}.description);"
+    )
+
+    # remove_diacritics 2 folds Hungarian accents (ő -> o, á -> a)
+    SETUP = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+            district, category, hashtags, description,
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS cards_fts_ai AFTER INSERT ON cards BEGIN
+            {_INSERT.format(row='new')}
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS cards_fts_ad AFTER DELETE ON cards BEGIN
+            DELETE FROM cards_fts WHERE rowid = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS cards_fts_au
+        AFTER UPDATE OF district, category, hashtags, description ON cards BEGIN
+            DELETE FROM cards_fts WHERE rowid = old.id;
+            {_INSERT.format(row='new')}
+        END
+        """,
+    ]
+
+    def setup(self, conn):
+        created = not conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cards_fts'"
+        )).first()
+        for statement in self.SETUP:
+            conn.execute(text(statement))
+        if created:
+            # Index cards that existed before the FTS table
+            conn.execute(text(
+                "INSERT INTO cards_fts(rowid, district, category, hashtags, description) "
+                "SELECT cards.id, cards.district, cards.category, "
+                + self._HASHTAGS.format(row='cards') + ", cards.description FROM cards"
+            ))
+
+    def statement(self, query: str, limit: int) -> Optional[Select]:
+        words = query_words(query)
+        if not words:
+            return None
+
+        fts = table('cards_fts', column('rowid'))
+        # Every word as a prefix; the quotes keep FTS5 operators out of user input
+        match = ' '.join(f'"{word}"*' for word in words)
+
+        return (
+            select(fts.c.rowid)
+            .where(literal_column('cards_fts').op('MATCH')(match))
+            # bm25 column weights: district, category, hashtags, description
+            .order_by(func.bm25(literal_column('cards_fts'), 2.0, 3.0, 2.0, 1.0), fts.c.rowid)
+            .limit(limit)
+        )
+
+
+def get_fulltext(dialect_name: str):
+    """Full-text implementation for a dialect, or None if unsupported"""
+    if dialect_name == 'postgresql':
+        return PostgresFullText()
+    if dialect_name == 'sqlite':
+        return SqliteFullText()
+    return None
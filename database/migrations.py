@@ -0,0 +1,195 @@
+"""
+Версионированные миграции схемы
+
+Примененные версии хранятся в schema_migrations. При старте выполняются
+только новые миграции, каждая в своей транзакции. Новая база создается
+целиком через create_all() и сразу помечается как актуальная.
+"""
+import logging
+from collections import defaultdict
+from typing import Callable, Iterable, List, NamedTuple
+from sqlalchemy import bindparam, inspect, select, update, text
+from sqlalchemy.engine import Connection, Engine
+from database.models import Base, Card, SchemaMigration, random_sort_key
+
+logger = logging.getLogger(__name__)
+
+# Held during migrations on PostgreSQL, so parallel instances don't migrate twice
+ADVISORY_LOCK_ID = 731_000_017
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+# ============== МИГРАЦИИ ==============
+
+def _create_indexes(conn: Connection, names: Iterable[str]):
+    """Create model indexes by name, skipping those that already exist"""
+    names = set(names)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(conn, checkfirst=True)
+
+
+def _add_rating_columns(conn: Connection):
+    from database.database import rating_aggregates_statement
+
+    existing = {column['name'] for column in inspect(conn).get_columns('cards')}
+    added = False
+    for column in ('rating_sum', 'rating_count'):
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE cards ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0"))
+            added = True
+    if added:
+        # Backfill aggregates for cards created before the columns existed
+        conn.execute(rating_aggregates_statement())
+
+
+# (table, columns) that get a unique index; duplicates are removed first
+UNIQUE_KEYS = [
+    ('ratings', 'user_id, card_id'),
+    ('viewed_cards', 'user_id, card_id'),
+    ('saved_cards', 'user_id, card_id'),
+    ('district_subscriptions', 'user_id, district'),
+    ('category_subscriptions', 'user_id, category'),
+]
+
+LOOKUP_INDEXES = [
+    'uq_ratings_user_card', 'ix_ratings_card_id',
+    'uq_viewed_cards_user_card', 'ix_viewed_cards_card_id',
+    'uq_saved_cards_user_card', 'ix_saved_cards_card_id',
+    'uq_district_subscriptions_user_district', 'ix_district_subscriptions_district',
+    'uq_category_subscriptions_user_category', 'ix_category_subscriptions_category',
+    'ix_cooldowns_user_type_expires', 'ix_cooldowns_expires_at',
+    'ix_cards_expires_at',
+]
+
+
+def _add_lookup_indexes(conn: Connection):
+    from database.database import rating_aggregates_statement
+
+    for table, columns in UNIQUE_KEYS:
+        # Ratings keep the latest vote, everything else the first row
+        keep = 'MAX' if table == 'ratings' else 'MIN'
+        result = conn.execute(text(
+            f"DELETE FROM {table} WHERE id NOT IN "
+            f"(SELECT keep_id FROM (SELECT {keep}(id) AS keep_id FROM {table} GROUP BY {columns}) AS kept)"
+        ))
+        if result.rowcount:
+            logger.info(f"Removed {result.rowcount} duplicate rows from {table}")
+            if table == 'ratings':
+                conn.execute(rating_aggregates_statement())
+
+    _create_indexes(conn, LOOKUP_INDEXES)
+
+
+def _add_groups_mask(conn: Connection):
+    from utils.card_groups import groups_mask
+
+    existing = {column['name'] for column in inspect(conn).get_columns('cards')}
+    if 'groups_mask' not in existing:
+        conn.execute(text("ALTER TABLE cards ADD COLUMN groups_mask INTEGER NOT NULL DEFAULT 0"))
+
+    # Backfill from the JSON list: one UPDATE per distinct mask
+    cards_by_mask = defaultdict(list)
+    for card_id, groups in conn.execute(select(Card.id, Card.groups)):
+        cards_by_mask[groups_mask(groups)].append(card_id)
+    for mask, card_ids in cards_by_mask.items():
+        for i in range(0, len(card_ids), 5000):
+            conn.execute(
+                update(Card.__table__)
+                .where(Card.__table__.c.id.in_(card_ids[i:i + 5000]))
+                .values(groups_mask=mask)
+            )
+
+    _create_indexes(conn, ['ix_cards_groups_mask'])
+
+
+def _add_random_key(conn: Connection):
+    existing = {column['name'] for column in inspect(conn).get_columns('cards')}
+    if 'random_key' not in existing:
+        conn.execute(text("ALTER TABLE cards ADD COLUMN random_key INTEGER NOT NULL DEFAULT 0"))
+
+    cards = Card.__table__
+    set_key = (
+        update(cards)
+        .where(cards.c.id == bindparam('card_id'))
+        .values(random_key=bindparam('key'))
+    )
+    card_ids = list(conn.scalars(select(cards.c.id)))
+    for i in range(0, len(card_ids), 5000):
+        conn.execute(set_key, [
+            {'card_id': card_id, 'key': random_sort_key()} for card_id in card_ids[i:i + 5000]
+        ])
+
+    _create_indexes(conn, ['ix_cards_random_key'])
+
+
+# Single-column subscription indexes replaced by (column, user_id)
+SUBSCRIPTION_INDEXES = {
+    'ix_district_subscriptions_district': 'ix_district_subscriptions_district_user',
+    'ix_category_subscriptions_category': 'ix_category_subscriptions_category_user',
+}
+
+
+def _add_subscriber_order_indexes(conn: Connection):
+    _create_indexes(conn, SUBSCRIPTION_INDEXES.values())
+    for old in SUBSCRIPTION_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {old}"))
+
+
+def _add_fanout_attempts(conn: Connection):
+    existing = {column['name'] for column in inspect(conn).get_columns('fanout_jobs')}
+    if 'attempts' not in existing:
+        conn.execute(text("ALTER TABLE fanout_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'rating aggregate columns on cards', _add_rating_columns),
+    Migration(2, 'unique and lookup indexes for hot queries', _add_lookup_indexes),
+    Migration(3, 'groups bitmask on cards', _add_groups_mask),
+    Migration(4, 'random sampling key on cards', _add_random_key),
+    Migration(5, 'subscriber indexes in user ID order', _add_subscriber_order_indexes),
+    Migration(6, 'attempt counter on fan-out jobs', _add_fanout_attempts),
+]
+
+
+# ============== ЗАПУСК ==============
+
+def applied_versions(conn: Connection) -> set:
+    return set(conn.scalars(select(SchemaMigration.version)))
+
+
+def stamp_all(engine: Engine):
+    """Mark every migration as applied (for a database just built by create_all)"""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+        pending = [
+            {'version': migration.version, 'description': migration.description}
+            for migration in MIGRATIONS if migration.version not in done
+        ]
+        if pending:
+            conn.execute(SchemaMigration.__table__.insert(), pending)
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """Apply pending migrations in order; returns applied versions"""
+    applied = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        with engine.begin() as conn:
+            if engine.dialect.name == 'postgresql':
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {'id': ADVISORY_LOCK_ID})
+            if migration.version in applied_versions(conn):
+                continue
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            migration.apply(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=migration.version,
+                description=migration.description
+            ))
+        applied.append(migration.version)
+    return applied
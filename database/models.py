@@ -1,13 +1,21 @@
+import random
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, Text, DateTime, Boolean, 
-    ForeignKey, Float, BigInteger, JSON
+    ForeignKey, Float, BigInteger, JSON, LargeBinary, Index
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 
+RANDOM_KEY_MAX = 2 ** 31 - 1
+
+
+def random_sort_key() -> int:
+    """Random position of a card in the feed order (see utils/feed_sampler.py)"""
+    return random.randint(0, RANDOM_KEY_MAX)
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -23,6 +31,7 @@ class User(Base):
     
     # Relationships
     viewed_cards = relationship('ViewedCard', back_populates='user', cascade='all, delete-orphan')
+    seen_set = relationship('SeenSet', back_populates='user', uselist=False, cascade='all, delete-orphan')
     ratings = relationship('Rating', back_populates='user', cascade='all, delete-orphan')
     saved_cards = relationship('SavedCard', back_populates='user', cascade='all, delete-orphan')
     district_subscriptions = relationship('DistrictSubscription', back_populates='user', cascade='all, delete-orphan')
@@ -32,10 +41,17 @@ class User(Base):
 
 class Card(Base):
     __tablename__ = 'cards'
+    __table_args__ = (
+        Index('ix_cards_expires_at', 'expires_at'),
+        Index('ix_cards_groups_mask', 'groups_mask'),
+        Index('ix_cards_random_key', 'random_key', 'groups_mask'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    card_number = Column(Integer, unique=True, nullable=False)  # Random 1-9999
+    card_number = Column(Integer, unique=True, nullable=False)  # Random 1-CARD_NUMBER_MAX (see utils/card_numbers.py)
     groups = Column(JSON, nullable=False)  # List of groups ['A', 'B', 'D']
+    groups_mask = Column(Integer, nullable=False, default=0, server_default='0')  # Same groups as bits (see utils/card_groups.py)
+    random_key = Column(Integer, nullable=False, default=random_sort_key, server_default='0')  # Feed sampling order
     
     # NEW: Район вместо адреса
     district = Column(String(255), nullable=True)  # 🔥 Район
@@ -57,6 +73,10 @@ class Card(Base):
     clicks_count = Column(Integer, default=0)
     saves_count = Column(Integer, default=0)  # NEW: Сколько раз сохранили
     
+    # Rating aggregates (kept by add_or_update_rating, avg = sum / count)
+    rating_sum = Column(Integer, nullable=False, default=0, server_default='0')
+    rating_count = Column(Integer, nullable=False, default=0, server_default='0')
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, nullable=True)  # For group F (24h)
     
@@ -68,6 +88,10 @@ class Card(Base):
 
 class ViewedCard(Base):
     __tablename__ = 'viewed_cards'
+    __table_args__ = (
+        Index('uq_viewed_cards_user_card', 'user_id', 'card_id', unique=True),
+        Index('ix_viewed_cards_card_id', 'card_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -78,8 +102,24 @@ class ViewedCard(Base):
     card = relationship('Card', back_populates='viewed_by')
 
 
+class SeenSet(Base):
+    """Просмотренные карточки пользователя: сжатый битмап ID карточек (одна строка на пользователя)"""
+    __tablename__ = 'seen_sets'
+    
+    user_id = Column(BigInteger, ForeignKey('users.id'), primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)  # +1 on every reset
+    bitmap = Column(LargeBinary, nullable=False, default=b'')  # zlib-compressed bit array
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    user = relationship('User', back_populates='seen_set')
+
+
 class Rating(Base):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        Index('uq_ratings_user_card', 'user_id', 'card_id', unique=True),
+        Index('ix_ratings_card_id', 'card_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -94,6 +134,10 @@ class Rating(Base):
 class SavedCard(Base):
     """NEW: Сохраненные карточки пользователя"""
     __tablename__ = 'saved_cards'
+    __table_args__ = (
+        Index('uq_saved_cards_user_card', 'user_id', 'card_id', unique=True),
+        Index('ix_saved_cards_card_id', 'card_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -107,6 +151,11 @@ class SavedCard(Base):
 class DistrictSubscription(Base):
     """NEW: Подписки на районы"""
     __tablename__ = 'district_subscriptions'
+    __table_args__ = (
+        Index('uq_district_subscriptions_user_district', 'user_id', 'district', unique=True),
+        # Subscribers of a district in user ID order (keyset batches in utils/fanout.py)
+        Index('ix_district_subscriptions_district_user', 'district', 'user_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -119,6 +168,10 @@ class DistrictSubscription(Base):
 class CategorySubscription(Base):
     """Подписки на категории (свободные слова)"""
     __tablename__ = 'category_subscriptions'
+    __table_args__ = (
+        Index('uq_category_subscriptions_user_category', 'user_id', 'category', unique=True),
+        Index('ix_category_subscriptions_category_user', 'category', 'user_id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -128,8 +181,33 @@ class CategorySubscription(Base):
     user = relationship('User', back_populates='category_subscriptions')
 
 
+class FanoutJob(Base):
+    """Уведомление подписчиков о новой карточке (utils/fanout.py)"""
+    __tablename__ = 'fanout_jobs'
+    __table_args__ = (
+        Index('ix_fanout_jobs_status', 'status'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    card_id = Column(Integer, ForeignKey('cards.id', ondelete='CASCADE'), nullable=False)
+    district = Column(String(255), nullable=True)  # matched against subscriptions, copied at publish time
+    category = Column(String(255), nullable=True)
+    status = Column(String(20), nullable=False, default='pending')  # pending, done, cancelled, failed
+    last_user_id = Column(BigInteger, nullable=False, default=0)  # checkpoint: subscribers up to this ID are done
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)  # runs that ended in an error
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
 class Cooldown(Base):
     __tablename__ = 'cooldowns'
+    __table_args__ = (
+        Index('ix_cooldowns_user_type_expires', 'user_id', 'cooldown_type', 'expires_at'),
+        Index('ix_cooldowns_expires_at', 'expires_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey('users.id'), nullable=False)
@@ -138,3 +216,20 @@ class Cooldown(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship('User', back_populates='cooldowns')
+
+
+class CardNumberPool(Base):
+    """Free card numbers; publishing a card takes the row with the lowest position"""
+    __tablename__ = 'card_number_pool'
+    
+    card_number = Column(Integer, primary_key=True, autoincrement=False)
+    position = Column(Integer, nullable=False, index=True)  # random, so numbers come out shuffled
+
+
+class SchemaMigration(Base):
+    """Applied schema migrations (see database/migrations.py)"""
+    __tablename__ = 'schema_migrations'
+    
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
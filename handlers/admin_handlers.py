@@ -2,9 +2,18 @@ import logging
 from datetime import datetime, timedelta
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
+from sqlalchemy import select
 from database.models import Card, User, Cooldown
-from database.database import get_session
-from utils.helpers import generate_unique_card_number
+from database.database import get_async_session
+from utils.helpers import card_rating, recalculate_card_ratings, render_card
+from utils.catalog_index import catalog_index
+from utils.ranking import feed_ranking
+from utils.fanout import fanout, enqueue as enqueue_fanout
+from utils.search_index import search_index
+from utils.counters import counter_buffer
+from utils.card_cache import card_cache
+from utils.card_numbers import reserve_card_number, release_card_numbers
+from utils.card_groups import groups_mask
 from utils.telegram_parser import parse_telegram_link
 from keyboards.keyboards import get_admin_card_preview_keyboard
 import config
@@ -387,49 +396,58 @@ async def publish_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     card_data = context.user_data.get('new_card', {})
     
-    session = get_session()
-    try:
-        # Генерируем уникальный номер
-        card_number = generate_unique_card_number()
-        
-        # Создаем карточку
-        card = Card(
-            card_number=card_number,
-            groups=card_data.get('groups', ['A']),
-            district=card_data.get('district'),
-            category=card_data.get('category'),
-            hashtags=card_data.get('hashtags', []),
-            description=card_data.get('description'),
-            original_link=card_data.get('link'),
-            media_type=card_data.get('media_type'),
-            media_file_id=card_data.get('media_file_id')
-        )
-        
-        # Для группы F устанавливаем expires_at
-        if 'F' in card_data.get('groups', []):
-            card.expires_at = datetime.utcnow() + timedelta(hours=24)
-        
-        session.add(card)
-        session.commit()
-        
-        await query.edit_message_caption(
-            caption=f"✅ Карточка #{card_number} опубликована!\n\n"
-                   f"Группы: {', '.join(card.groups)}\n"
-                   f"Район: {card.district}\n"
-                   f"Категория: {card.category}"
-        )
-        
-        # Очищаем контекст
-        context.user_data.pop('new_card', None)
-        
-    except Exception as e:
-        logger.error(f"Error publishing card: {e}")
-        await query.edit_message_caption(
-            caption=f"❌ Ошибка при публикации: {str(e)}"
-        )
-        session.rollback()
-    finally:
-        session.close()
+    async with get_async_session() as session:
+        try:
+            # Берем свободный номер из пула (в этой же транзакции)
+            card_number = await reserve_card_number(session)
+            
+            # Создаем карточку
+            groups = card_data.get('groups', ['A'])
+            card = Card(
+                card_number=card_number,
+                groups=groups,
+                groups_mask=groups_mask(groups),
+                district=card_data.get('district'),
+                category=card_data.get('category'),
+                hashtags=card_data.get('hashtags', []),
+                description=card_data.get('description'),
+                original_link=card_data.get('link'),
+                media_type=card_data.get('media_type'),
+                media_file_id=card_data.get('media_file_id')
+            )
+            
+            # Для группы F устанавливаем expires_at
+            if 'F' in card_data.get('groups', []):
+                card.expires_at = datetime.utcnow() + timedelta(hours=24)
+            
+            session.add(card)
+            # Subscribers are notified in the background, the job commits with the card
+            fanout_job = await enqueue_fanout(session, card)
+            await session.commit()
+            if fanout_job is not None:
+                fanout.wake()
+            
+            catalog_index.add(card.id, card.groups)
+            feed_ranking.add(card)
+            search_index.add_card(card)
+            render_card(card)
+            
+            await query.edit_message_caption(
+                caption=f"✅ Карточка #{card_number} опубликована!\n\n"
+                       f"Группы: {', '.join(card.groups)}\n"
+                       f"Район: {card.district}\n"
+                       f"Категория: {card.category}"
+            )
+            
+            # Очищаем контекст
+            context.user_data.pop('new_card', None)
+            
+        except Exception as e:
+            logger.error(f"Error publishing card: {e}")
+            await query.edit_message_caption(
+                caption=f"❌ Ошибка при публикации: {str(e)}"
+            )
+            await session.rollback()
 
 
 async def delete_card_draft(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -457,17 +475,19 @@ async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /remove <номер карточки>")
         return
     
-    session = get_session()
-    try:
-        card = session.query(Card).filter_by(card_number=card_number).first()
+    async with get_async_session() as session:
+        card = await session.scalar(select(Card).filter_by(card_number=card_number))
         if card:
-            session.delete(card)
-            session.commit()
+            await session.delete(card)
+            await release_card_numbers(session, [card.card_number])
+            await session.commit()
+            catalog_index.remove(card.id)
+            feed_ranking.remove(card.id)
+            search_index.remove(card.id)
+            card_cache.invalidate(card.id)
             await update.message.reply_text(f"✅ Карточка #{card_number} удалена")
         else:
             await update.message.reply_text(f"❌ Карточка #{card_number} не найдена")
-    finally:
-        session.close()
 
 
 async def cardstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -481,28 +501,26 @@ async def cardstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /cardstats <номер>")
         return
     
-    session = get_session()
-    try:
-        card = session.query(Card).filter_by(card_number=card_number).first()
+    async with get_async_session() as session:
+        card = await session.scalar(select(Card).filter_by(card_number=card_number))
         if not card:
             await update.message.reply_text(f"❌ Карточка #{card_number} не найдена")
             return
         
-        # Считаем средний рейтинг
-        from sqlalchemy import func
-        from database.models import Rating
+        # Средний рейтинг из агрегатов карточки
+        avg_rating, rating_count = card_rating(card)
         
-        avg_rating = session.query(func.avg(Rating.rating)).filter_by(card_id=card.id).scalar()
-        rating_count = session.query(func.count(Rating.id)).filter_by(card_id=card.id).scalar()
+        # Счетчики с учетом еще не записанных в БД
+        pending = counter_buffer.pending(card.id)
         
         stats_text = (
             f"📊 Статистика карточки #{card_number}\n\n"
             f"🔥 Район: {card.district or 'Не указан'}\n"
             f"🪽 Категория: {card.category or 'Не указана'}\n"
             f"📊 Группы: {', '.join(card.groups)}\n"
-            f"👁 Просмотры: {card.views_count}\n"
-            f"🖱 Переходы: {card.clicks_count}\n"
-            f"♥️ Сохранения: {card.saves_count}\n"
+            f"👁 Просмотры: {(card.views_count or 0) + pending['views_count']}\n"
+            f"🖱 Переходы: {(card.clicks_count or 0) + pending['clicks_count']}\n"
+            f"♥️ Сохранения: {(card.saves_count or 0) + pending['saves_count']}\n"
             f"⭐️ Рейтинг: {avg_rating:.1f}/10 ({rating_count} оценок)\n"
             f"📅 Создана: {card.created_at.strftime('%d.%m.%Y %H:%M')}"
         )
@@ -511,6 +529,12 @@ async def cardstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             stats_text += f"\n⏰ Удалится: {card.expires_at.strftime('%d.%m.%Y %H:%M')}"
         
         await update.message.reply_text(stats_text)
-        
-    finally:
-        session.close()
+
+
+async def recalcratings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Recompute card rating aggregates from the ratings table"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    updated = await recalculate_card_ratings()
+    await update.message.reply_text(f"✅ Рейтинги пересчитаны для {updated} карточек")
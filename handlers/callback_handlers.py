@@ -5,14 +5,12 @@ import logging
 from datetime import datetime, timedelta
 from telegram import Update
 from telegram.ext import ContextTypes
-from database.models import Card
-from database.database import get_session
 from utils.helpers import (
     add_or_update_rating, increment_card_clicks,
-    check_cooldown, set_cooldown, format_card_text
+    check_cooldown, set_cooldown, get_rendered_card
 )
 from keyboards.keyboards import (
-    get_rating_keyboard, get_card_keyboard,
+    get_rating_keyboard,
     get_start_keyboard, get_text_form_keyboard,
     get_form_preview_keyboard
 )
@@ -89,20 +87,22 @@ async def handle_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE,
         await query.answer("❌ Нет карточек для навигации")
         return
     
+    edit = config.CARD_NAVIGATION_MODE == 'edit'
+    
     if data == 'nav_prev':
         if current_index > 0:
-            await show_card(update, context, current_index - 1)
+            await show_card(update, context, current_index - 1, edit=edit)
         else:
             await query.answer("Это первая карточка")
     
     elif data == 'nav_next':
         if current_index < len(card_ids) - 1:
-            await show_card(update, context, current_index + 1)
+            await show_card(update, context, current_index + 1, edit=edit)
         else:
             await query.answer("Это последняя карточка")
     
     elif data == 'nav_refresh':
-        await show_card(update, context, current_index)
+        await show_card(update, context, current_index, edit=edit, refresh=True)
     
     elif data == 'nav_info':
         await query.answer(f"Карточка {current_index + 1} из {len(card_ids)}")
@@ -160,34 +160,28 @@ async def handle_rating_selection(update: Update, context: ContextTypes.DEFAULT_
     
     # Add rating
     try:
-        add_or_update_rating(update.effective_user.id, card_id, rating)
+        await add_or_update_rating(update.effective_user.id, card_id, rating)
         
         # Set cooldown
-        set_cooldown(update.effective_user.id, 'rating', config.COOLDOWN_RATING)
+        await set_cooldown(update.effective_user.id, 'rating', config.COOLDOWN_RATING)
         
-        # Get updated card
-        session = get_session()
-        try:
-            card = session.query(Card).filter(Card.id == card_id).first()
-            if card:
-                # Get current index and cards list
-                current_index = context.user_data.get('current_index', 0)
-                card_ids = context.user_data.get('current_cards', [])
-                
-                # Update keyboard
-                keyboard = get_card_keyboard(card, current_index, len(card_ids))
-                
-                # Update caption with new rating
-                text = format_card_text(card)
-                
-                await query.edit_message_caption(
-                    caption=text,
-                    reply_markup=keyboard
-                )
-                
-                await query.answer(f"✅ Вы оценили на {rating}/10!", show_alert=True)
-        finally:
-            session.close()
+        # Re-render with the new rating (the cached render was invalidated)
+        rendered = await get_rendered_card(card_id)
+        if rendered:
+            # Локальный импорт для избежания циклических зависимостей
+            from handlers.user_handlers import update_card_page
+            update_card_page(context, rendered)
+            
+            # Get current index and cards list
+            current_index = context.user_data.get('current_index', 0)
+            card_ids = context.user_data.get('current_cards', [])
+            
+            await query.edit_message_caption(
+                caption=rendered.text,
+                reply_markup=rendered.keyboard(current_index, len(card_ids))
+            )
+            
+            await query.answer(f"✅ Вы оценили на {rating}/10!", show_alert=True)
             
     except Exception as e:
         logger.error(f"Error saving rating: {e}")
@@ -205,26 +199,22 @@ async def handle_back_to_card(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.answer("❌ Ошибка")
         return
     
-    # Get card
-    session = get_session()
-    try:
-        card = session.query(Card).filter(Card.id == card_id).first()
-        if not card:
-            await query.answer("❌ Карточка не найдена")
-            return
-        
-        # Get current index and cards list
-        current_index = context.user_data.get('current_index', 0)
-        card_ids = context.user_data.get('current_cards', [])
-        
-        # Restore keyboard
-        keyboard = get_card_keyboard(card, current_index, len(card_ids))
-        
-        await query.edit_message_reply_markup(reply_markup=keyboard)
-        await query.answer()
-        
-    finally:
-        session.close()
+    # Get card (the page snapshot has it unless the list changed)
+    page = context.user_data.get('card_page')
+    rendered = page.find(card_id) if page else None
+    if not rendered:
+        rendered = await get_rendered_card(card_id)
+    if not rendered:
+        await query.answer("❌ Карточка не найдена")
+        return
+    
+    # Get current index and cards list
+    current_index = context.user_data.get('current_index', 0)
+    card_ids = context.user_data.get('current_cards', [])
+    
+    # Restore keyboard
+    await query.edit_message_reply_markup(reply_markup=rendered.keyboard(current_index, len(card_ids)))
+    await query.answer()
 
 
 # ============== ФОРМА ЗАЯВКИ ==============
@@ -312,7 +302,7 @@ async def submit_form(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         # Set cooldown
-        set_cooldown(user_id, 'text_form', config.COOLDOWN_TEXT_FORM)
+        await set_cooldown(user_id, 'text_form', config.COOLDOWN_TEXT_FORM)
         
         # Notify user
         await query.edit_message_text(
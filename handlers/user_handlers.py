@@ -2,16 +2,20 @@
 Обработчики пользовательских команд
 """
 import logging
-from telegram import Update
+from typing import Optional
+from telegram import (
+    Update, Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument
+)
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from database.models import Card
-from database.database import get_session
 from utils.helpers import (
-    get_or_create_user, get_cards_for_user, 
-    format_card_text, mark_card_as_viewed,
-    search_cards
+    upsert_user, get_cards_for_user, 
+    get_rendered_card, render_loaded_card, mark_card_as_viewed,
+    search_cards, check_rate_limit
 )
-from keyboards.keyboards import get_start_keyboard, get_card_keyboard
+from utils.card_cache import CardPage, card_cache
+from keyboards.keyboards import get_start_keyboard
+import config
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +26,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"Start command from user {user.id} (@{user.username})")
     
     # Create or update user in database
-    get_or_create_user(
+    await upsert_user(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -52,7 +56,8 @@ async def cards_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     # Get cards for user
-    cards = get_cards_for_user(user_id, limit=5)
+    epoch = card_cache.epoch()
+    cards = await get_cards_for_user(user_id, limit=5)
     
     if not cards:
         await update.message.reply_text(
@@ -61,16 +66,38 @@ async def cards_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Store cards in context
-    context.user_data['current_cards'] = [card.id for card in cards]
-    context.user_data['current_index'] = 0
+    # Snapshot the batch in context
+    start_card_page(context, cards, epoch)
     
     # Show first card
     await show_card(update, context, 0)
 
 
-async def show_card(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int):
-    """Show card at specified index"""
+def start_card_page(context: ContextTypes.DEFAULT_TYPE, cards, epoch: int = None):
+    """
+    Render a batch of cards once and keep it as the user's page snapshot
+    epoch: card_cache.epoch() read before the cards were loaded
+    """
+    page = CardPage(tuple(render_loaded_card(card, epoch) for card in cards))
+    context.user_data['card_page'] = page
+    context.user_data['current_cards'] = page.card_ids
+    context.user_data['current_index'] = 0
+
+
+def update_card_page(context: ContextTypes.DEFAULT_TYPE, rendered):
+    """Put a re-rendered card into the page snapshot"""
+    page = context.user_data.get('card_page')
+    if page is not None:
+        context.user_data['card_page'] = page.replace(rendered)
+
+
+async def show_card(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int,
+                    edit: bool = False, refresh: bool = False):
+    """
+    Show card at specified index
+    edit: replace the card message the callback came from instead of sending a new one
+    refresh: re-read the card instead of serving it from the page snapshot
+    """
     card_ids = context.user_data.get('current_cards', [])
     
     if not card_ids or index < 0 or index >= len(card_ids):
@@ -80,83 +107,142 @@ async def show_card(update: Update, context: ContextTypes.DEFAULT_TYPE, index: i
     
     card_id = card_ids[index]
     
-    session = get_session()
-    try:
-        card = session.query(Card).filter(Card.id == card_id).first()
-        if not card:
+    page = context.user_data.get('card_page')
+    rendered = None if refresh or page is None else page.get(index, card_id)
+    if rendered is None:
+        rendered = await get_rendered_card(card_id)
+        if not rendered:
             if update.message:
                 await update.message.reply_text("❌ Карточка не найдена")
             return
-        
-        # Mark as viewed
-        mark_card_as_viewed(update.effective_user.id, card_id)
-        
-        # Format card text
-        text = format_card_text(card)
-        
-        # Get keyboard
-        keyboard = get_card_keyboard(card, index, len(card_ids))
-        
-        # Send with media
-        try:
-            if card.media_type == 'photo':
-                if update.message:
-                    await update.message.reply_photo(
-                        photo=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-                elif update.callback_query:
-                    await update.callback_query.message.reply_photo(
-                        photo=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-            elif card.media_type == 'video':
-                if update.message:
-                    await update.message.reply_video(
-                        video=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-                elif update.callback_query:
-                    await update.callback_query.message.reply_video(
-                        video=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-            elif card.media_type == 'document':
-                if update.message:
-                    await update.message.reply_document(
-                        document=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-                elif update.callback_query:
-                    await update.callback_query.message.reply_document(
-                        document=card.media_file_id,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-            else:
-                # No media - just text
-                if update.message:
-                    await update.message.reply_text(text, reply_markup=keyboard)
-                elif update.callback_query:
-                    await update.callback_query.message.reply_text(text, reply_markup=keyboard)
-        except Exception as e:
-            logger.error(f"Error sending card media: {e}")
-            # Fallback to text only
-            if update.message:
-                await update.message.reply_text(text, reply_markup=keyboard)
-            elif update.callback_query:
-                await update.callback_query.message.reply_text(text, reply_markup=keyboard)
-        
-        # Update current index
-        context.user_data['current_index'] = index
-        
-    finally:
-        session.close()
+        update_card_page(context, rendered)
+    
+    # Mark as viewed in the background, the reply doesn't depend on it
+    context.application.create_task(
+        mark_card_as_viewed(update.effective_user.id, card_id), update=update
+    )
+    
+    keyboard = rendered.keyboard(index, len(card_ids))
+    navigation_stats['steps'] += 1
+    
+    if not (edit and update.callback_query and await edit_card_message(update.callback_query, rendered, keyboard)):
+        await send_card_message(update, rendered, keyboard)
+    
+    # Update current index
+    context.user_data['current_index'] = index
+
+
+# ============== ОТПРАВКА КАРТОЧКИ ==============
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+}
+
+# Telegram API calls made to display cards
+navigation_stats = {
+    'steps': 0,         # cards displayed
+    'api_calls': 0,     # send/edit requests for those cards
+    'sends': 0,
+    'edits': 0,
+    'fallbacks': 0,     # edit impossible or failed, new message sent
+    'not_modified': 0,  # edit skipped by Telegram, content was identical
+}
+
+
+def get_navigation_stats() -> dict:
+    stats = dict(navigation_stats)
+    stats['api_calls_per_step'] = round(stats['api_calls'] / stats['steps'], 2) if stats['steps'] else 0.0
+    return stats
+
+
+def _message_card_id(message) -> Optional[int]:
+    """Card shown in a message, from its ⭐️ rate button"""
+    if not message.reply_markup:
+        return None
+    for row in message.reply_markup.inline_keyboard:
+        for button in row:
+            if button.callback_data and button.callback_data.startswith('rate_'):
+                try:
+                    return int(button.callback_data.split('_')[1])
+                except (IndexError, ValueError):
+                    return None
+    return None
+
+
+async def edit_card_message(query, rendered, keyboard) -> bool:
+    """
+    Show the card in the message the callback came from
+    Returns: False if the message can't be edited into this card
+    """
+    message = query.message
+    if not isinstance(message, Message):
+        return False
+    
+    # Text and media messages can't be converted into each other
+    has_media = bool(message.photo or message.video or message.document)
+    if has_media != (rendered.media_type in INPUT_MEDIA):
+        navigation_stats['fallbacks'] += 1
+        return False
+    
+    navigation_stats['api_calls'] += 1
+    try:
+        if not has_media:
+            await query.edit_message_text(rendered.text, reply_markup=keyboard)
+        elif _message_card_id(message) == rendered.card_id:
+            # Same card (refresh): the media stays, only caption and buttons change
+            await query.edit_message_caption(caption=rendered.text, reply_markup=keyboard)
+        else:
+            media = INPUT_MEDIA[rendered.media_type](media=rendered.media_file_id, caption=rendered.text)
+            await query.edit_message_media(media=media, reply_markup=keyboard)
+    except BadRequest as e:
+        if 'not modified' in str(e).lower():
+            navigation_stats['not_modified'] += 1
+            return True
+        logger.warning(f"Can't edit card message, sending a new one: {e}")
+        navigation_stats['fallbacks'] += 1
+        return False
+    
+    navigation_stats['edits'] += 1
+    return True
+
+
+async def send_card_message(update: Update, rendered, keyboard):
+    """Send the card as a new message"""
+    target = update.message or update.callback_query.message
+    text = rendered.text
+    
+    navigation_stats['api_calls'] += 1
+    navigation_stats['sends'] += 1
+    # Send with media
+    try:
+        if rendered.media_type == 'photo':
+            await target.reply_photo(
+                photo=rendered.media_file_id,
+                caption=text,
+                reply_markup=keyboard
+            )
+        elif rendered.media_type == 'video':
+            await target.reply_video(
+                video=rendered.media_file_id,
+                caption=text,
+                reply_markup=keyboard
+            )
+        elif rendered.media_type == 'document':
+            await target.reply_document(
+                document=rendered.media_file_id,
+                caption=text,
+                reply_markup=keyboard
+            )
+        else:
+            # No media - just text
+            await target.reply_text(text, reply_markup=keyboard)
+    except Exception as e:
+        logger.error(f"Error sending card media: {e}")
+        # Fallback to text only
+        navigation_stats['api_calls'] += 1
+        await target.reply_text(text, reply_markup=keyboard)
 
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -175,8 +261,20 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     query = ' '.join(context.args)
     
+    # Rate limit
+    wait = check_rate_limit(
+        update.effective_user.id, 'search',
+        config.SEARCH_RATE_PER_MINUTE, config.SEARCH_RATE_BURST
+    )
+    if wait:
+        await update.message.reply_text(
+            f"⏳ Слишком много запросов. Попробуйте через {int(wait) + 1} сек."
+        )
+        return
+    
     # Search
-    cards = search_cards(query, limit=10)
+    epoch = card_cache.epoch()
+    cards = await search_cards(query, limit=10)
     
     if not cards:
         await update.message.reply_text(
@@ -191,9 +289,8 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Запрос: «{query}»"
     )
     
-    # Store in context and show first
-    context.user_data['current_cards'] = [card.id for card in cards]
-    context.user_data['current_index'] = 0
+    # Snapshot in context and show first
+    start_card_page(context, cards, epoch)
     
     await show_card(update, context, 0)
 
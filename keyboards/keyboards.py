@@ -1,6 +1,7 @@
 """
 Клавиатуры для Telegram бота
 """
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 
@@ -14,29 +15,40 @@ def get_card_keyboard(card, current_index, total_cards):
     [◀️ Назад] [1/5] [Вперед ▶️]
     [🪞 Обновить]
     """
-    buttons = []
-    
-    # Первый ряд: Перейти и Оценить
-    row1 = [
+    return assemble_card_keyboard(card_action_row(card), current_index, total_cards)
+
+
+def card_action_row(card):
+    """Первый ряд: Перейти и Оценить (зависит только от карточки)"""
+    return (
         InlineKeyboardButton("👍 Перейти", url=card.original_link),
         InlineKeyboardButton("⭐️ Оценить", callback_data=f"rate_{card.id}")
-    ]
-    buttons.append(row1)
-    
-    # Второй ряд: Навигация
-    row2 = []
+    )
+
+
+@lru_cache(maxsize=1024)
+def card_navigation_row(current_index, total_cards):
+    """Второй ряд: Навигация (зависит только от позиции)"""
+    row = []
     if current_index > 0:
-        row2.append(InlineKeyboardButton("◀️ Назад", callback_data="nav_prev"))
-    row2.append(InlineKeyboardButton(f"{current_index + 1}/{total_cards}", callback_data="nav_info"))
+        row.append(InlineKeyboardButton("◀️ Назад", callback_data="nav_prev"))
+    row.append(InlineKeyboardButton(f"{current_index + 1}/{total_cards}", callback_data="nav_info"))
     if current_index < total_cards - 1:
-        row2.append(InlineKeyboardButton("Вперед ▶️", callback_data="nav_next"))
-    buttons.append(row2)
-    
-    # Третий ряд: Обновить
-    row3 = [InlineKeyboardButton("🪞 Обновить", callback_data="nav_refresh")]
-    buttons.append(row3)
-    
-    return InlineKeyboardMarkup(buttons)
+        row.append(InlineKeyboardButton("Вперед ▶️", callback_data="nav_next"))
+    return tuple(row)
+
+
+# Третий ряд: Обновить
+CARD_REFRESH_ROW = (InlineKeyboardButton("🪞 Обновить", callback_data="nav_refresh"),)
+
+
+def assemble_card_keyboard(action_row, current_index, total_cards):
+    """Клавиатура карточки из готовых рядов"""
+    return InlineKeyboardMarkup((
+        action_row,
+        card_navigation_row(current_index, total_cards),
+        CARD_REFRESH_ROW
+    ))
 
 
 def get_rating_keyboard(card_id):
@@ -14,12 +14,25 @@ from telegram.ext import (
 import config
 
 # Database
-from database.database import init_db
+from database.database import init_db, async_engine, dispose_async_engine
+from utils.counters import counter_buffer
+from utils.cooldowns import cooldown_store, load_persisted_cooldowns
+from utils.maintenance import schedule_maintenance
+from utils.webhook import run_webhook
+from utils.update_processor import PerUserUpdateProcessor, UpdateApplication
+from utils.card_cache import card_cache
+from utils.card_numbers import sync_card_number_pool
+from utils.ranking import feed_ranking
+from utils.query_stats import query_stats
+from utils.known_users import known_users
+from utils.metrics import metrics, handler_label, InstrumentedRequest
+from utils.rate_limiter import OutboundScheduler
+from utils.fanout import fanout
 
 # Handlers
 from handlers.user_handlers import (
     start_command, cards_command, search_command,
-    help_command, text_command
+    help_command, text_command, get_navigation_stats
 )
 
 from handlers.admin_handlers import (
@@ -28,7 +41,7 @@ from handlers.admin_handlers import (
     addwork_command, addhome_command,
     receive_link, receive_district, receive_category,
     receive_hashtags, receive_description,
-    remove_command, cardstats_command,
+    remove_command, cardstats_command, recalcratings_command,
     WAITING_LINK, WAITING_DISTRICT, WAITING_CATEGORY,
     WAITING_HASHTAGS, WAITING_DESCRIPTION
 )
@@ -45,6 +58,7 @@ logger = logging.getLogger(__name__)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Log errors"""
+    metrics.handler_errors.inc(handler_label(update))
     logger.error(f"Exception while handling an update: {context.error}", exc_info=context.error)
     
     # Notify user
@@ -54,17 +68,53 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def main():
-    """Start the bot"""
-    # Initialize database
-    logger.info("Initializing database...")
-    init_db()
-    logger.info("Database initialized!")
-    
-    # Create application
-    logger.info("Creating application...")
-    application = Application.builder().token(config.BOT_TOKEN).build()
-    
+async def post_init(application: Application):
+    """Start background workers once the event loop is running"""
+    counter_buffer.start()
+    await load_persisted_cooldowns(cooldown_store)
+    await sync_card_number_pool()
+    register_metrics(application)
+    await metrics.start_server()
+    # Resumes fan-out jobs interrupted by a restart
+    fanout.start(application.bot)
+
+
+def register_metrics(application: Application):
+    """Export component stats (caches, buffers, per-update SQL) on /metrics"""
+    metrics.register_stats('card_cache', card_cache.stats)
+    metrics.register_stats('known_users', known_users.stats)
+    metrics.register_stats('navigation', get_navigation_stats)
+    metrics.register_stats('counters', counter_buffer.stats)
+    metrics.register_stats('cooldowns', cooldown_store.stats)
+    metrics.register_stats('feed_ranking', feed_ranking.stats)
+    metrics.register_stats('sql', query_stats.stats)
+    metrics.register_stats('fanout', fanout.stats)
+    if isinstance(application.update_processor, PerUserUpdateProcessor):
+        metrics.register_stats('updates', application.update_processor.stats)
+    if isinstance(application.bot.rate_limiter, OutboundScheduler):
+        metrics.register_stats('rate_limiter', application.bot.rate_limiter.stats)
+
+
+async def post_shutdown(application: Application):
+    """Release resources after the bot stops"""
+    await metrics.stop_server()
+    await fanout.stop()
+    logger.info(f"Subscriber notifications: {fanout.stats()}")
+    # Write buffered view/click counters before the engine goes away
+    await counter_buffer.stop()
+    logger.info(f"Card counters flushed: {counter_buffer.stats()}")
+    logger.info(f"Card render cache: {card_cache.stats()}")
+    logger.info(f"Card navigation: {get_navigation_stats()}")
+    if feed_ranking.loaded:
+        logger.info(f"Feed ranking: {feed_ranking.stats()}")
+    if isinstance(application.update_processor, PerUserUpdateProcessor):
+        logger.info(f"Update processing: {application.update_processor.stats()}")
+    logger.info(f"SQL per update: {query_stats.stats()}")
+    await dispose_async_engine()
+
+
+def register_handlers(application: Application):
+    """Register the bot's handlers (also used by tools/loadtest.py)"""
     # ============== USER COMMANDS ==============
     logger.info("Registering user handlers...")
     application.add_handler(CommandHandler("start", start_command))
@@ -102,6 +152,7 @@ def main():
     # Simple admin commands
     application.add_handler(CommandHandler("remove", remove_command))
     application.add_handler(CommandHandler("cardstats", cardstats_command))
+    application.add_handler(CommandHandler("recalcratings", recalcratings_command))
     
     # ============== CALLBACK HANDLERS ==============
     logger.info("Registering callback handlers...")
@@ -109,6 +160,46 @@ def main():
     
     # ============== ERROR HANDLER ==============
     application.add_error_handler(error_handler)
+
+
+def main():
+    """Start the bot"""
+    # Initialize database
+    logger.info("Initializing database...")
+    init_db()
+    query_stats.install(async_engine)
+    metrics.install_pool(async_engine)
+    logger.info("Database initialized!")
+    
+    # Create application
+    logger.info("Creating application...")
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        # Background tasks of an update count towards its SQL statistics
+        .application_class(UpdateApplication)
+        # Same pool size as PTB's default request, plus Bot API latency/error metrics
+        .request(InstrumentedRequest(connection_pool_size=256))
+        # Per-chat, per-group and global send limits; replies go ahead of broadcasts
+        .rate_limiter(OutboundScheduler())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    # Different users in parallel, each user's updates in order (1 = sequential);
+    # the processor also attributes SQL statements to updates
+    builder = builder.concurrent_updates(PerUserUpdateProcessor(
+        max_running=max(config.MAX_CONCURRENT_UPDATES, 1),
+        max_pending=config.MAX_PENDING_UPDATES
+    ))
+    if config.BOT_MODE == 'webhook':
+        # Updates come from our HTTP server; a bounded queue gives back-pressure
+        builder = builder.updater(None).update_queue(asyncio.Queue(maxsize=config.WEBHOOK_QUEUE_SIZE))
+    application = builder.build()
+    
+    # Background maintenance (expired F cards, dead rows)
+    schedule_maintenance(application.job_queue)
+    
+    register_handlers(application)
     
     # ============== START BOT ==============
     logger.info("=" * 60)
@@ -117,7 +208,11 @@ def main():
     logger.info("=" * 60)
     
     # Run bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.BOT_MODE == 'webhook':
+        logger.info(f"Serving webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        run_webhook(application)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов: EXPLAIN по запросам из utils/helpers.py
+и utils/maintenance.py и поиск ожидаемого индекса в плане.
+
+Перед проверкой применяются недостающие миграции (как при старте бота).
+На PostgreSQL последовательное сканирование отключается (SET LOCAL
+enable_seqscan = off), чтобы на маленькой базе план показывал, может ли
+запрос вообще использовать индекс. Код выхода 1, если хотя бы один запрос
+индекс не использует.
+
+Usage: DATABASE_URL=... python tools/check_indexes.py [-v]
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete, func  # noqa: E402
+from database.database import engine, init_db  # noqa: E402
+from database.models import (  # noqa: E402
+    Card, Rating, ViewedCard, SavedCard, Cooldown,
+    DistrictSubscription, CategorySubscription, FanoutJob
+)
+from utils.card_groups import card_set_filter, bitwise_groups_filter  # noqa: E402
+
+
+def hot_queries():
+    """(description, statement, expected index)"""
+    now = datetime.utcnow()
+    return [
+        (
+            'rating of a user for a card',
+            select(Rating).where(Rating.user_id == 1, Rating.card_id == 1),
+            'uq_ratings_user_card',
+        ),
+        (
+            'rating aggregates of a card',
+            select(func.sum(Rating.rating), func.count(Rating.id)).where(Rating.card_id == 1),
+            'ix_ratings_card_id',
+        ),
+        (
+            'replace a persisted cooldown',
+            delete(Cooldown).where(Cooldown.user_id == 1, Cooldown.cooldown_type == 'search'),
+            'ix_cooldowns_user_type_expires',
+        ),
+        (
+            'purge expired cooldowns',
+            select(Cooldown.id).where(Cooldown.expires_at <= now).limit(500),
+            'ix_cooldowns_expires_at',
+        ),
+        (
+            'expired F cards batch',
+            select(Card.id, Card.card_number)
+            .where(Card.expires_at.isnot(None), Card.expires_at <= now)
+            .order_by(Card.expires_at).limit(500),
+            'ix_cards_expires_at',
+        ),
+        (
+            'cards of a card set',
+            select(Card.id).where(card_set_filter(1)),
+            'ix_cards_groups_mask',
+        ),
+        (
+            'feed range seek',
+            select(Card.id).where(bitwise_groups_filter(3), Card.random_key >= 12345)
+            .order_by(Card.random_key).limit(20),
+            'ix_cards_random_key',
+        ),
+        (
+            'views of deleted cards',
+            delete(ViewedCard).where(ViewedCard.card_id.in_([1, 2, 3])),
+            'ix_viewed_cards_card_id',
+        ),
+        (
+            'saves of deleted cards',
+            delete(SavedCard).where(SavedCard.card_id.in_([1, 2, 3])),
+            'ix_saved_cards_card_id',
+        ),
+        (
+            'district subscribers batch',
+            select(DistrictSubscription.user_id)
+            .where(DistrictSubscription.district == 'Pest', DistrictSubscription.user_id > 12345)
+            .order_by(DistrictSubscription.user_id).limit(100),
+            'ix_district_subscriptions_district_user',
+        ),
+        (
+            'category subscribers batch',
+            select(CategorySubscription.user_id)
+            .where(CategorySubscription.category == 'A', CategorySubscription.user_id > 12345)
+            .order_by(CategorySubscription.user_id).limit(100),
+            'ix_category_subscriptions_category_user',
+        ),
+        (
+            'unfinished fan-out jobs',
+            select(FanoutJob.id).where(FanoutJob.status == 'pending')
+            .order_by(FanoutJob.attempts, FanoutJob.id).limit(1),
+            'ix_fanout_jobs_status',
+        ),
+    ]
+
+
+def explain(conn, statement) -> str:
+    """Query plan as text, in the dialect's own EXPLAIN format"""
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = conn.exec_driver_sql(prefix + str(compiled), params).all()
+    # SQLite: (id, parent, notused, detail); PostgreSQL: one text column
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def main() -> int:
+    verbose = '-v' in sys.argv[1:]
+    init_db()
+
+    failed = 0
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            if conn.dialect.name == 'postgresql':
+                conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+            print(f"Dialect: {conn.dialect.name}")
+            for description, statement, index in hot_queries():
+                plan = explain(conn, statement)
+                ok = index in plan
+                failed += not ok
+                print(f"{'OK ' if ok else 'FAIL'} {description:<32} {index}")
+                if verbose or not ok:
+                    for line in plan.splitlines():
+                        print(f"       {line}")
+            transaction.rollback()
+
+    if failed:
+        print(f"{failed} queries don't use their index")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: синтетические обновления через настоящий граф обработчиков
+
+Запускает Application с обработчиками из main.register_handlers() на
+временной SQLite-базе с заранее созданными карточками. Вместо Telegram -
+заглушка запросов Bot API: записывает вызовы и отвечает правдоподобными
+объектами (отправленное сообщение возвращается с той же клавиатурой, так
+что следующие колбэки берут ID карточки из нее, как настоящий клиент).
+
+Каждый виртуальный пользователь проходит сценарий по кругу:
+/start, /cards, ▶️ x3, ◀️, ⭐️ Оценить, оценка, /search - и ждет обработки
+каждого шага. Отчет: пропускная способность, p50/p95/p99 по обработчикам
+(от постановки в очередь до завершения), SQL-запросы, время в базе и сессии
+на обновление (utils/query_stats.py), вызовы Bot API на обновление; запросы,
+похожие на N+1, попадают в лог. --rate-limit включает планировщик исходящих
+запросов (utils/rate_limiter.py) с его лимитами. С одинаковым --seed прогон
+воспроизводим; --dump пишет поданные обновления в JSONL для
+tools/webhook_replay.py.
+
+Usage: python tools/loadtest.py [--users 50] [--rounds 5] [--cards 2000]
+                                [--api-latency 0] [--rate-limit] [--seed 1]
+                                [--dump FILE]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+import contextvars
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'loadtest.db')}")
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+os.environ.setdefault('METRICS_PORT', '0')
+
+from sqlalchemy import insert  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+from database.database import engine, async_engine, init_db  # noqa: E402
+from utils.query_stats import query_stats  # noqa: E402
+from utils.metrics import metrics  # noqa: E402
+from utils.rate_limiter import OutboundScheduler  # noqa: E402
+from database.models import Card  # noqa: E402
+from utils.card_groups import groups_mask  # noqa: E402
+from utils.update_processor import PerUserUpdateProcessor, UpdateApplication  # noqa: E402
+import config  # noqa: E402
+import main as bot_main  # noqa: E402
+
+BOT_ID = 123456
+DISTRICTS = ['Pest', 'Buda', 'Újpest', 'Óbuda', 'Zugló', 'Центр']
+CATEGORIES = ['Барбер', 'Массаж', 'Ресторан', 'Ремонт', 'Маникюр', 'Фотограф']
+SEARCH_TERMS = ['барбер', 'массаж', 'pest', 'ремонт', 'маникюр', 'obuda']
+# ⭐️ Оценить, rating values and ⬅️ Назад all carry the card ID
+CARD_BUTTON = re.compile(r'^(?:rate|rating|back_to_card)_(\d+)')
+
+
+class UpdateRecord:
+    __slots__ = ('label', 'queued', 'finished', 'queries', 'db_ms', 'sessions', 'api_calls', 'done')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.queued = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.queries = 0
+        self.db_ms = 0.0
+        self.sessions = 0
+        self.api_calls = 0
+        self.done = asyncio.Event()
+
+
+# Update being processed by the current task (inherited by tasks it creates)
+current_update: contextvars.ContextVar[Optional[UpdateRecord]] = contextvars.ContextVar(
+    'current_update', default=None
+)
+
+
+def copy_queries(queries):
+    """query_stats listener: runs inside the update's context"""
+    record = current_update.get()
+    if record is not None:
+        record.queries = queries.statements
+        record.db_ms = queries.db_ms
+        record.sessions = queries.sessions
+
+
+class StubRequest(BaseRequest):
+    """Bot API stand-in: records calls, echoes sent messages back"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.message_ids = 0
+        self.keyboard_messages: Dict[int, dict] = {}  # chat ID -> latest message with inline buttons
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        record = current_update.get()
+        if record is not None:
+            record.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Load', 'username': 'loadtest_bot'}
+        if endpoint.startswith('send') or endpoint.startswith('editMessage'):
+            return self._message(endpoint, params)
+        return True
+
+    def _message(self, endpoint: str, params: dict) -> dict:
+        if endpoint.startswith('send'):
+            self.message_ids += 1
+            message_id = self.message_ids
+        else:
+            message_id = params.get('message_id', 0)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Load'},
+        }
+        media = params.get('media')
+        if isinstance(media, dict):
+            kind, file_id, caption = media.get('type'), media.get('media'), media.get('caption')
+        else:
+            kind = next((kind for kind in ('photo', 'video', 'document') if kind in params), None)
+            file_id, caption = params.get(kind), params.get('caption')
+        if kind == 'photo':
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': 'p', 'width': 1, 'height': 1}]
+        elif kind in ('video', 'document'):
+            message[kind] = {'file_id': file_id, 'file_unique_id': 'm', 'width': 1, 'height': 1, 'duration': 1}
+        if kind:
+            message['caption'] = caption or ''
+        else:
+            message['text'] = params.get('text', '')
+        if 'reply_markup' in params:
+            message['reply_markup'] = params['reply_markup']
+            self.keyboard_messages[message['chat']['id']] = message
+        return message
+
+
+class TimedUpdateProcessor(PerUserUpdateProcessor):
+    """Attributes queries and API calls to the update and marks it done"""
+
+    def __init__(self, records: Dict[int, UpdateRecord], **kwargs):
+        super().__init__(**kwargs)
+        self.records = records
+
+    async def do_process_update(self, update, coroutine):
+        record = self.records.get(update.update_id)
+        token = current_update.set(record)
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            current_update.reset(token)
+            if record is not None:
+                record.finished = time.perf_counter()
+                record.done.set()
+
+
+def seed_cards(count: int, rnd: random.Random):
+    groups = [['A'], ['A'], ['A'], ['B'], ['C'], ['A', 'D'], ['E']]
+    rows = []
+    for number in range(1, count + 1):
+        card_groups = rnd.choice(groups)
+        photo = rnd.random() < 0.7
+        rows.append({
+            'card_number': number,
+            'groups': card_groups,
+            'groups_mask': groups_mask(card_groups),
+            'district': rnd.choice(DISTRICTS),
+            'category': rnd.choice(CATEGORIES),
+            'hashtags': rnd.sample(['недорого', 'срочно', 'budapest', 'скидка'], 2),
+            'description': f"Карточка {number}: мастер с опытом, рядом с метро",
+            'original_link': f'https://t.me/loadtest/{number}',
+            'media_type': 'photo' if photo else None,
+            'media_file_id': f'photo-{number}' if photo else None,
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(Card), rows)
+
+
+class LoadTest:
+    def __init__(self, application: Application, request: StubRequest,
+                 records: Dict[int, UpdateRecord], rnd: random.Random, dump=None):
+        self.application = application
+        self.request = request
+        self.records = records
+        self.rnd = rnd
+        self.dump = dump
+        self.update_ids = 0
+        self.errors = 0
+
+    async def count_error(self, update, context):
+        self.errors += 1
+
+    async def feed(self, label: str, data: dict):
+        self.update_ids += 1
+        data['update_id'] = self.update_ids
+        record = self.records[self.update_ids] = UpdateRecord(label)
+        if self.dump:
+            self.dump.write(json.dumps(data, ensure_ascii=False) + '\n')
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        await record.done.wait()
+        return record
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def command(self, user_id: int, text: str) -> dict:
+        command = text.split()[0]
+        return {'message': {
+            'message_id': self.update_ids + 1,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        }}
+
+    def callback(self, user_id: int, data: str, message: dict) -> dict:
+        return {'callback_query': {
+            'id': str(self.update_ids + 1),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message,
+        }}
+
+    async def user(self, user_id: int, rounds: int):
+        for _ in range(rounds):
+            await self.feed('start', self.command(user_id, '/start'))
+            await self.feed('cards', self.command(user_id, '/cards'))
+            for step in ('nav_next', 'nav_next', 'nav_next', 'nav_prev'):
+                message = self.card_message(user_id)
+                if message is None:
+                    break
+                await self.feed('navigate', self.callback(user_id, step, message))
+
+            message = self.card_message(user_id)
+            card_id = self.card_id(message)
+            if card_id is not None:
+                await self.feed('rate_open', self.callback(user_id, f'rate_{card_id}', message))
+                value = self.rnd.randint(config.MIN_RATING, config.MAX_RATING)
+                await self.feed('rate_select', self.callback(
+                    user_id, f'rating_{card_id}_{value}', self.card_message(user_id) or message
+                ))
+            await self.feed('search', self.command(user_id, f'/search {self.rnd.choice(SEARCH_TERMS)}'))
+
+    def card_message(self, user_id: int) -> Optional[dict]:
+        """Latest message in the chat with an inline keyboard (what the user would tap)"""
+        return self.request.keyboard_messages.get(user_id)
+
+    @staticmethod
+    def card_id(message: Optional[dict]) -> Optional[int]:
+        for row in (message or {}).get('reply_markup', {}).get('inline_keyboard', []):
+            for button in row:
+                match = CARD_BUTTON.match(button.get('callback_data', ''))
+                if match:
+                    return int(match.group(1))
+        return None
+
+def report(records, elapsed: float, request: StubRequest, errors: int):
+    by_label = defaultdict(list)
+    for record in records.values():
+        if record.finished is not None:
+            by_label[record.label].append(record)
+    total = sum(len(group) for group in by_label.values())
+    print(f"\n{total} updates in {elapsed:.2f} s: {total / elapsed:.0f} updates/s, {errors} handler errors")
+    print(f"{'handler':<12} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>8} {'db ms':>7} {'sess':>5} {'api':>6}")
+    for label, group in by_label.items():
+        latencies = sorted((record.finished - record.queued) * 1000 for record in group)
+        p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+        p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+        queries = statistics.mean(record.queries for record in group)
+        db_ms = statistics.mean(record.db_ms for record in group)
+        sessions = statistics.mean(record.sessions for record in group)
+        api_calls = statistics.mean(record.api_calls for record in group)
+        print(f"{label:<12} {len(group):>6} {statistics.median(latencies):8.2f} {p95:8.2f} {p99:8.2f} "
+              f"{queries:8.1f} {db_ms:7.2f} {sessions:5.1f} {api_calls:6.1f}")
+    print(f"Bot API calls: {dict(request.calls.most_common())}")
+    print(f"SQL per update: {query_stats.stats()}")
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    random.seed(args.seed)
+    init_db()
+    seed_cards(args.cards, rnd)
+    query_stats.install(async_engine)
+    metrics.install_pool(async_engine)
+    query_stats.listeners.append(copy_queries)
+
+    records: Dict[int, UpdateRecord] = {}
+    request = StubRequest(args.api_latency / 1000)
+    builder = (
+        Application.builder()
+        .token(config.BOT_TOKEN)
+        .application_class(UpdateApplication)
+        .request(request)
+        .get_updates_request(StubRequest())
+        .updater(None)
+        .concurrent_updates(TimedUpdateProcessor(
+            records,
+            max_running=max(config.MAX_CONCURRENT_UPDATES, 1),
+            max_pending=config.MAX_PENDING_UPDATES
+        ))
+    )
+    if args.rate_limit:
+        builder = builder.rate_limiter(OutboundScheduler())
+    application = builder.build()
+    bot_main.register_handlers(application)
+
+    dump = open(args.dump, 'w', encoding='utf-8') if args.dump else None
+    test = LoadTest(application, request, records, rnd, dump)
+    application.add_error_handler(test.count_error)
+
+    await application.initialize()
+    await bot_main.post_init(application)
+    await application.start()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(test.user(10_000 + i, args.rounds) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await bot_main.post_shutdown(application)
+        if dump:
+            dump.close()
+
+    report(records, elapsed, request, test.errors)
+    if args.rate_limit:
+        print(f"Rate limiter: {application.bot.rate_limiter.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=50, help='concurrent virtual users')
+    parser.add_argument('--rounds', type=int, default=5, help='scenario rounds per user')
+    parser.add_argument('--cards', type=int, default=2000, help='cards created before the run')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='simulated Bot API latency, ms')
+    parser.add_argument('--rate-limit', action='store_true', help='send through the outbound scheduler')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dump', help='write the fed updates to this JSONL file')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
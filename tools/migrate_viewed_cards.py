@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Перенос просмотров из viewed_cards (строка на просмотр) в seen_sets (битмап на пользователя).
+
+Существующие битмапы объединяются с перенесенными просмотрами, поэтому
+скрипт можно запускать повторно.
+
+Usage: python tools/migrate_viewed_cards.py [--purge]
+    --purge   delete migrated rows from viewed_cards afterwards
+"""
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete  # noqa: E402
+from database.database import engine, init_db, get_session  # noqa: E402
+from database.models import SeenSet, ViewedCard  # noqa: E402
+from utils.seen_sets import SeenBitmap  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BATCH_USERS = 500
+
+
+def save_bitmaps(bitmaps: dict) -> int:
+    """Merge bitmaps into seen_sets; returns stored bytes"""
+    session = get_session()
+    try:
+        existing = {
+            row.user_id: row
+            for row in session.query(SeenSet).filter(SeenSet.user_id.in_(list(bitmaps)))
+        }
+        stored = 0
+        for user_id, bitmap in bitmaps.items():
+            row = existing.get(user_id)
+            if row:
+                merged = SeenBitmap.from_blob(row.bitmap)
+                merged.update(bitmap)
+                row.bitmap = merged.to_blob()
+            else:
+                row = SeenSet(user_id=user_id, generation=0, bitmap=bitmap.to_blob())
+                session.add(row)
+            stored += len(row.bitmap)
+        session.commit()
+        return stored
+    finally:
+        session.close()
+
+
+def read_page(after: int):
+    """Views of the next BATCH_USERS users above ``after`` (keyset by user_id)"""
+    with engine.connect() as conn:
+        user_ids = list(conn.scalars(
+            select(ViewedCard.user_id).where(ViewedCard.user_id > after)
+            .distinct().order_by(ViewedCard.user_id).limit(BATCH_USERS)
+        ))
+        if not user_ids:
+            return {}, 0
+        bitmaps = {}
+        rows = 0
+        for user_id, card_id in conn.execute(
+            select(ViewedCard.user_id, ViewedCard.card_id)
+            .where(ViewedCard.user_id > after, ViewedCard.user_id <= user_ids[-1])
+        ):
+            bitmaps.setdefault(user_id, SeenBitmap()).add(card_id)
+            rows += 1
+    return bitmaps, rows
+
+
+def migrate(purge: bool = False):
+    init_db()
+
+    users = rows = stored = 0
+    after = 0
+    while True:
+        # The read is closed before writing: SQLite won't commit under an open read
+        bitmaps, page_rows = read_page(after)
+        if not bitmaps:
+            break
+        stored += save_bitmaps(bitmaps)
+        users += len(bitmaps)
+        rows += page_rows
+        after = max(bitmaps)
+
+    logger.info(f"Migrated {rows} viewed_cards rows for {users} users into {stored} bytes of bitmaps")
+
+    if purge and rows:
+        with engine.begin() as conn:
+            deleted = conn.execute(delete(ViewedCard)).rowcount
+        logger.info(f"Purged {deleted} rows from viewed_cards")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    migrate(purge='--purge' in sys.argv[1:])
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанных обновлений Telegram на вебхук бота (BOT_MODE=webhook).
+
+Отправляет Update JSON (по одному на строку файла или синтетические /start)
+POST-запросами с секретным токеном и измеряет:
+- задержку подтверждения (ответ HTTP 200) - p50/p95/p99;
+- время до разбора очереди по /healthz - приближение сквозной задержки,
+  которое можно сравнить с задержкой getUpdates в режиме polling.
+
+Usage: python tools/webhook_replay.py [--url URL] [--secret S] [--file updates.jsonl]
+                                      [--count N] [--concurrency C]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+def synthetic_updates(count: int):
+    """/start messages from distinct users"""
+    now = int(time.time())
+    for i in range(count):
+        user = {'id': 10_000_000 + i, 'is_bot': False, 'first_name': f'Load{i}'}
+        yield {
+            'update_id': 900_000_000 + i,
+            'message': {
+                'message_id': i + 1,
+                'date': now,
+                'chat': {'id': user['id'], 'type': 'private', 'first_name': user['first_name']},
+                'from': user,
+                'text': '/start',
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            },
+        }
+
+
+def load_updates(path: str):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Connection:
+    """Keep-alive HTTP/1.1 client connection"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b'', headers: dict = None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+        status = int(head.split(' ', 2)[1])
+        length = 0
+        for line in head.split('\r\n')[1:]:
+            if line.lower().startswith('content-length:'):
+                length = int(line.split(':', 1)[1])
+        payload = await self.reader.readexactly(length)
+        if 'connection: close' in head.lower():
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def percentile(samples, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def replay(url: str, secret: str, updates, concurrency: int):
+    parts = urlsplit(url)
+    host, port, path = parts.hostname, parts.port or 80, parts.path or '/'
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(json.dumps(update).encode())
+    total = queue.qsize()
+
+    latencies = []
+    statuses = {}
+
+    async def worker():
+        conn = Connection(host, port)
+        try:
+            while not queue.empty():
+                body = queue.get_nowait()
+                started = time.perf_counter()
+                status, _ = await conn.request('POST', path, body, headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 503:
+                    # Queue full: retry later, as Telegram does
+                    queue.put_nowait(body)
+                    await asyncio.sleep(0.05)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    sent_s = time.perf_counter() - started
+
+    # Wait until the bot has taken every update off its queue
+    health = Connection(host, port)
+    drained_s = None
+    try:
+        for _ in range(600):
+            status, payload = await health.request('GET', '/healthz')
+            if status == 200 and json.loads(payload).get('queue_size') == 0:
+                drained_s = time.perf_counter() - started
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        health.close()
+
+    latencies.sort()
+    print(f"Updates: {total}, concurrency: {concurrency}, responses: {statuses}")
+    print(f"Sent in {sent_s:.2f} s ({total / sent_s:.0f} updates/s)")
+    if latencies:
+        print(
+            f"Ack latency: p50 {statistics.median(latencies):.2f} ms, "
+            f"p95 {percentile(latencies, 0.95):.2f} ms, p99 {percentile(latencies, 0.99):.2f} ms"
+        )
+    if drained_s is not None:
+        print(f"Queue drained after {drained_s:.2f} s ({drained_s / total * 1000:.2f} ms per update)")
+    else:
+        print("Queue did not drain within 30 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=f"http://127.0.0.1:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+    parser.add_argument('--secret', default=config.WEBHOOK_SECRET)
+    parser.add_argument('--file', help='JSONL file with recorded Update objects')
+    parser.add_argument('--count', type=int, default=1000, help='synthetic updates when no --file')
+    parser.add_argument('--concurrency', type=int, default=config.WEBHOOK_MAX_CONNECTIONS)
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else list(synthetic_updates(args.count))
+    asyncio.run(replay(args.url, args.secret, updates, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Кэш отрисованных карточек (текст подписи и части клавиатуры)
+
+Запись хранится по ID карточки вместе с версией рейтинга, из которой она
+построена. Когда строка карточки уже загружена (/cards, /search), запись
+используется только при совпадении версии. По одному ID (навигация,
+оценка, рассылка) версия неизвестна - там полагаемся на сброс: при оценке,
+публикации и удалении карточки запись сбрасывается.
+
+Каждый сброс увеличивает эпоху кэша. Тот, кто загружает карточку из БД,
+читает эпоху до загрузки и передает ее в put(): если за время загрузки
+что-то сбросили, запись не сохраняется - иначе загрузка, начатая до оценки,
+положила бы в кэш старый рейтинг уже после сброса.
+"""
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+from telegram import InlineKeyboardMarkup
+from keyboards.keyboards import card_action_row, assemble_card_keyboard
+import config
+
+
+class RenderedCard:
+    """Everything needed to send a card, without the database row"""
+
+    __slots__ = ('card_id', 'version', 'text', 'media_type', 'media_file_id', 'action_row')
+
+    def __init__(self, card, text: str):
+        self.card_id = card.id
+        self.version = rating_version(card)
+        self.text = text
+        self.media_type = card.media_type
+        self.media_file_id = card.media_file_id
+        self.action_row = card_action_row(card)
+
+    def keyboard(self, current_index: int, total_cards: int) -> InlineKeyboardMarkup:
+        return assemble_card_keyboard(self.action_row, current_index, total_cards)
+
+
+class CardPage(NamedTuple):
+    """Immutable snapshot of the cards a user pages through (one /cards or /search batch)"""
+
+    cards: Tuple[RenderedCard, ...]
+
+    @property
+    def card_ids(self) -> List[int]:
+        return [rendered.card_id for rendered in self.cards]
+
+    def get(self, index: int, card_id: int) -> Optional[RenderedCard]:
+        """Snapshot entry, if ``index`` still points at ``card_id``"""
+        if 0 <= index < len(self.cards) and self.cards[index].card_id == card_id:
+            return self.cards[index]
+        return None
+
+    def find(self, card_id: int) -> Optional[RenderedCard]:
+        for rendered in self.cards:
+            if rendered.card_id == card_id:
+                return rendered
+        return None
+
+    def replace(self, rendered: RenderedCard) -> 'CardPage':
+        """New snapshot with a re-rendered card (e.g. after a rating)"""
+        return CardPage(tuple(
+            rendered if current.card_id == rendered.card_id else current
+            for current in self.cards
+        ))
+
+
+def rating_version(card) -> Tuple[int, int]:
+    """The caption changes only when the rating aggregates do"""
+    return (card.rating_sum or 0, card.rating_count or 0)
+
+
+class CardRenderCache:
+    """Bounded LRU of RenderedCard by card ID"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[int, RenderedCard]' = OrderedDict()
+        self._epoch = 0  # bumped by every invalidation
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def get(self, card_id: int, version: Tuple[int, int] = None) -> Optional[RenderedCard]:
+        """Cached render; with ``version``, only if built from that rating version"""
+        rendered = self._entries.get(card_id)
+        if rendered is None or (version is not None and rendered.version != version):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(card_id)
+        self.hits += 1
+        return rendered
+
+    def epoch(self) -> int:
+        """Read before loading a card from the database, pass to put()"""
+        return self._epoch
+
+    def put(self, rendered: RenderedCard, epoch: int = None):
+        """Store a render; with ``epoch``, only if nothing was invalidated since"""
+        if epoch is not None and epoch != self._epoch:
+            # The row may predate a rating that has since been invalidated
+            self.stale_puts += 1
+            return
+        self._entries[rendered.card_id] = rendered
+        self._entries.move_to_end(rendered.card_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, card_id: int):
+        # Even without an entry: a load of this card may be in flight
+        self._epoch += 1
+        if self._entries.pop(card_id, None) is not None:
+            self.invalidations += 1
+
+    def invalidate_many(self, card_ids):
+        for card_id in card_ids:
+            self.invalidate(card_id)
+
+    def clear(self):
+        self._epoch += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'stale_puts': self.stale_puts,
+        }
+
+
+# Shared by all handlers in this process
+card_cache = CardRenderCache(config.CARD_CACHE_SIZE)
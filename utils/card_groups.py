@@ -0,0 +1,79 @@
+"""
+Группы карточек как битовая маска
+
+Бит i колонки cards.groups_mask означает группу config.CARD_GROUPS[i].
+Наборы карточек (config.CARD_SETS) заранее компилируются в маски, и фильтр
+по набору становится условием на индексированную целочисленную колонку,
+одинаковым для PostgreSQL и SQLite.
+"""
+from functools import lru_cache
+from typing import Iterable, Tuple
+from database.models import Card
+import config
+
+GROUP_BITS = {group: 1 << bit for bit, group in enumerate(config.CARD_GROUPS)}
+ALL_GROUPS = (1 << len(GROUP_BITS)) - 1
+
+# With more groups the list of overlapping masks gets too long for IN (...)
+MAX_ENUMERATED_GROUPS = 10
+
+
+def groups_mask(groups: Iterable[str]) -> int:
+    """Mask of the known groups in the list (unknown groups are ignored)"""
+    mask = 0
+    for group in groups or ():
+        mask |= GROUP_BITS.get(group, 0)
+    return mask
+
+
+@lru_cache(maxsize=None)
+def mask_groups(mask: int) -> Tuple[str, ...]:
+    """Group names in the mask, in CARD_GROUPS order"""
+    return tuple(group for group, bit in GROUP_BITS.items() if mask & bit)
+
+
+# Mask per card set, same order as config.CARD_SETS
+CARD_SET_MASKS = [groups_mask(card_set) for card_set in config.CARD_SETS]
+
+
+def card_set_mask(card_set_index: int) -> int:
+    """Mask of the user's card set (unknown sets fall back to the first one)"""
+    if card_set_index is None or not 0 <= card_set_index < len(CARD_SET_MASKS):
+        card_set_index = 0
+    return CARD_SET_MASKS[card_set_index]
+
+
+@lru_cache(maxsize=None)
+def overlapping_masks(mask: int) -> Tuple[int, ...]:
+    """Every groups_mask value that shares at least one group with ``mask``"""
+    return tuple(value for value in range(1, 1 << len(GROUP_BITS)) if value & mask)
+
+
+def groups_filter(mask: int):
+    """
+    SQL condition: card belongs to any group in ``mask``
+
+    ``groups_mask IN (...)`` with every overlapping value can be answered
+    from the index on groups_mask, while a bitwise AND can't. The bitwise
+    form is used only when there are too many groups to enumerate.
+    """
+    if mask & ALL_GROUPS == ALL_GROUPS:
+        return Card.groups_mask > 0
+    if len(GROUP_BITS) <= MAX_ENUMERATED_GROUPS:
+        return Card.groups_mask.in_(overlapping_masks(mask))
+    return bitwise_groups_filter(mask)
+
+
+def bitwise_groups_filter(mask: int):
+    """
+    SQL condition: card belongs to any group in ``mask``, as a bitwise AND
+
+    For queries driven by another index (e.g. the feed's random_key seek),
+    where the groups are only checked row by row.
+    """
+    return Card.groups_mask.op('&')(mask) != 0
+
+
+def card_set_filter(card_set_index: int):
+    """SQL condition: card is shown in the user's card set"""
+    return groups_filter(card_set_mask(card_set_index))
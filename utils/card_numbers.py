@@ -0,0 +1,83 @@
+"""
+Номера карточек: пул свободных номеров в БД
+
+Таблица card_number_pool хранит все свободные номера 1..CARD_NUMBER_MAX
+в случайном порядке (колонка position). Публикация забирает первый номер
+одним DELETE ... RETURNING в своей транзакции, удаление карточки
+возвращает номер в пул. При старте пул сверяется с таблицей cards.
+"""
+import random
+import logging
+from typing import Iterable, List
+from sqlalchemy import select, delete
+from database.models import Card, CardNumberPool
+from database.database import get_async_session, async_engine, dialect_insert
+import config
+
+logger = logging.getLogger(__name__)
+
+POSITION_MAX = 2 ** 31 - 1
+BATCH = 5000
+
+_pool = CardNumberPool.__table__
+
+
+class CardNumbersExhausted(Exception):
+    """Every number in 1..CARD_NUMBER_MAX is taken"""
+
+
+def _rows(numbers: Iterable[int]) -> List[dict]:
+    return [{'card_number': number, 'position': random.randint(0, POSITION_MAX)} for number in numbers]
+
+
+async def sync_card_number_pool(max_number: int = None) -> int:
+    """
+    Make the pool hold exactly the free numbers in 1..max_number
+    Returns: number of pool rows added
+    """
+    max_number = max_number or config.CARD_NUMBER_MAX
+    async with get_async_session() as session:
+        used = set(await session.scalars(select(Card.card_number)))
+        pooled = set(await session.scalars(select(_pool.c.card_number)))
+
+        stale = [number for number in pooled if number in used or number > max_number]
+        missing = [number for number in range(1, max_number + 1) if number not in used and number not in pooled]
+
+        for i in range(0, len(stale), BATCH):
+            await session.execute(delete(_pool).where(_pool.c.card_number.in_(stale[i:i + BATCH])))
+        for i in range(0, len(missing), BATCH):
+            await session.execute(_pool.insert(), _rows(missing[i:i + BATCH]))
+        await session.commit()
+
+    free = len(pooled) - len(stale) + len(missing)
+    logger.info(
+        f"Card number pool: {free} free of {max_number} "
+        f"(added {len(missing)}, dropped {len(stale)})"
+    )
+    return len(missing)
+
+
+async def reserve_card_number(session) -> int:
+    """Take a free number inside the caller's transaction (returned to the pool on rollback)"""
+    next_free = select(_pool.c.card_number).order_by(_pool.c.position).limit(1)
+    if async_engine.dialect.name == 'postgresql':
+        # Concurrent publishes take different rows instead of waiting on the same one
+        next_free = next_free.with_for_update(skip_locked=True)
+
+    number = await session.scalar(
+        delete(_pool)
+        .where(_pool.c.card_number == next_free.scalar_subquery())
+        .returning(_pool.c.card_number)
+    )
+    if number is None:
+        raise CardNumbersExhausted(
+            f"All card numbers 1-{config.CARD_NUMBER_MAX} are taken, raise CARD_NUMBER_MAX"
+        )
+    return number
+
+
+async def release_card_numbers(session, numbers: Iterable[int]):
+    """Put numbers of deleted cards back into the pool (caller commits)"""
+    rows = _rows(number for number in numbers if number <= config.CARD_NUMBER_MAX)
+    if rows:
+        await session.execute(dialect_insert(_pool).on_conflict_do_nothing(), rows)
@@ -0,0 +1,157 @@
+"""
+Индекс каталога в памяти: группа -> ID карточек
+"""
+import random
+import asyncio
+import logging
+from typing import Container, Dict, Iterable, List, Optional
+from sqlalchemy import select
+from database.models import Card
+from database.database import get_async_session
+from utils.card_groups import mask_groups
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogIndex:
+    """
+    Process-wide map of card group -> card IDs
+
+    Each group keeps a dense list of IDs plus an ID -> position map, so a
+    random pick and a removal are both O(1). The index is loaded lazily from
+    the database on first use and then kept current by publish/remove/expire.
+    """
+
+    def __init__(self):
+        self._groups: Dict[str, List[int]] = {}
+        self._positions: Dict[str, Dict[int, int]] = {}
+        self._card_groups: Dict[int, tuple] = {}
+        self._loaded = False
+        self._loading = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def ensure_loaded(self):
+        """Load card groups from the database once per process"""
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            self._loading = True
+            try:
+                async with get_async_session() as session:
+                    # Integer masks are much cheaper to read than the JSON lists
+                    rows = (await session.execute(select(Card.id, Card.groups_mask))).all()
+                self._clear()
+                for card_id, mask in rows:
+                    self._add(card_id, mask_groups(mask))
+                # Replay changes made while the snapshot was being read
+                for op, args in self._pending:
+                    op(*args)
+                self._loaded = True
+                logger.info(f"Catalog index loaded: {len(self._card_groups)} cards")
+            finally:
+                self._pending = []
+                self._loading = False
+
+    def add(self, card_id: int, groups: Iterable[str]):
+        """Register a published card"""
+        if self._loading:
+            self._pending.append((self._add, (card_id, groups)))
+        elif self._loaded:
+            self._add(card_id, groups)
+
+    def remove(self, card_id: int):
+        """Forget a removed card"""
+        if self._loading:
+            self._pending.append((self._remove, (card_id,)))
+        elif self._loaded:
+            self._remove(card_id)
+
+    def remove_many(self, card_ids: Iterable[int]):
+        for card_id in card_ids:
+            self.remove(card_id)
+
+    def count(self, groups: Iterable[str]) -> int:
+        """Number of distinct cards in any of the groups"""
+        groups = list(groups)
+        if len(groups) == 1:
+            return len(self._groups.get(groups[0], ()))
+        return len({card_id for group in groups for card_id in self._groups.get(group, ())})
+
+    def sample(self, groups: Iterable[str], k: int,
+               exclude: Optional[Container[int]] = None) -> List[int]:
+        """
+        Pick up to k random distinct card IDs from the groups, skipping excluded IDs
+
+        Draws random positions across the group lists and rejects excluded
+        ones. Only when most candidates are excluded does it fall back to
+        scanning the remaining IDs.
+        """
+        exclude = exclude if exclude is not None else ()
+        pools = [self._groups[g] for g in groups if self._groups.get(g)]
+        total = sum(len(pool) for pool in pools)
+        if total == 0 or k <= 0:
+            return []
+
+        picked = []
+        chosen = set()
+        attempts = 0
+        max_attempts = k * 8 + 32
+        while len(picked) < k and attempts < max_attempts:
+            attempts += 1
+            position = random.randrange(total)
+            for pool in pools:
+                if position < len(pool):
+                    card_id = pool[position]
+                    break
+                position -= len(pool)
+            if card_id in chosen or card_id in exclude:
+                continue
+            chosen.add(card_id)
+            picked.append(card_id)
+
+        if len(picked) < k:
+            remaining = [
+                card_id for card_id in dict.fromkeys(
+                    card_id for pool in pools for card_id in pool
+                )
+                if card_id not in chosen and card_id not in exclude
+            ]
+            picked.extend(random.sample(remaining, min(k - len(picked), len(remaining))))
+
+        return picked
+
+    def _clear(self):
+        self._groups = {}
+        self._positions = {}
+        self._card_groups = {}
+
+    def _add(self, card_id: int, groups: Iterable[str]):
+        self._remove(card_id)
+        groups = tuple(dict.fromkeys(groups))
+        self._card_groups[card_id] = groups
+        for group in groups:
+            ids = self._groups.setdefault(group, [])
+            self._positions.setdefault(group, {})[card_id] = len(ids)
+            ids.append(card_id)
+
+    def _remove(self, card_id: int):
+        groups = self._card_groups.pop(card_id, ())
+        for group in groups:
+            ids = self._groups[group]
+            positions = self._positions[group]
+            position = positions.pop(card_id)
+            last = ids.pop()
+            if last != card_id:
+                ids[position] = last
+                positions[last] = position
+
+
+# Shared by all handlers in this process
+catalog_index = CatalogIndex()
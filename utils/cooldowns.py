@@ -0,0 +1,155 @@
+"""
+Кулдауны и ограничения частоты в памяти
+
+Основное хранилище - словарь с истечением по куче (heap). В БД пишутся только
+длинные кулдауны (см. config.COOLDOWN_PERSIST_MIN_SECONDS), чтобы они пережили
+перезапуск; при старте они загружаются обратно.
+"""
+import time
+import heapq
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func
+from database.models import Cooldown
+from database.database import get_async_session
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SWEEP_INTERVAL = 60  # seconds between sweeps of idle token buckets
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, at most ``capacity`` stored"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def consume(self, amount: float = 1.0) -> bool:
+        """Take tokens if available"""
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        """Seconds until ``amount`` tokens are available"""
+        self._refill(time.monotonic())
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class CooldownStore:
+    """
+    Fixed cooldowns and token-bucket limits per (user, type)
+
+    Cooldowns live in a dict; a min-heap of expiry times drops expired
+    entries lazily, so lookups stay O(1) and memory follows active users.
+    """
+
+    def __init__(self):
+        self._expires: Dict[Tuple[int, str], datetime] = {}
+        self._heap: List[Tuple[datetime, Tuple[int, str]]] = []
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._last_sweep = time.monotonic()
+
+    def get(self, user_id: int, cooldown_type: str) -> Optional[datetime]:
+        """Active cooldown expiry or None"""
+        now = datetime.utcnow()
+        self._purge(now)
+        expires_at = self._expires.get((user_id, cooldown_type))
+        if expires_at and expires_at > now:
+            return expires_at
+        return None
+
+    def set(self, user_id: int, cooldown_type: str, expires_at: datetime):
+        key = (user_id, cooldown_type)
+        self._expires[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        if len(self._heap) > 2 * len(self._expires) + 1024:
+            # Too many superseded entries: rebuild from the live ones
+            self._heap = [(expires, key) for key, expires in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, user_id: int, cooldown_type: str = None):
+        if cooldown_type:
+            self._expires.pop((user_id, cooldown_type), None)
+        else:
+            for key in [key for key in self._expires if key[0] == user_id]:
+                del self._expires[key]
+
+    def consume(self, user_id: int, key: str, rate: float, capacity: float) -> float:
+        """
+        Take one token from the user's bucket
+        Returns: 0 if allowed, otherwise seconds to wait
+        """
+        bucket_key = (user_id, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(rate, capacity)
+        if bucket.consume():
+            return 0.0
+        return bucket.wait_time()
+
+    def load(self, rows):
+        """Fill the store from (user_id, cooldown_type, expires_at) rows"""
+        for user_id, cooldown_type, expires_at in rows:
+            current = self._expires.get((user_id, cooldown_type))
+            if current is None or expires_at > current:
+                self.set(user_id, cooldown_type, expires_at)
+
+    def stats(self) -> dict:
+        return {
+            'cooldowns': len(self._expires),
+            'heap': len(self._heap),
+            'buckets': len(self._buckets),
+        }
+
+    def _purge(self, now: datetime):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            # Skip heap entries superseded by a later set()
+            if self._expires.get(key) == expires_at:
+                del self._expires[key]
+
+        # Full buckets carry no state, drop them
+        monotonic_now = time.monotonic()
+        if monotonic_now - self._last_sweep > BUCKET_SWEEP_INTERVAL:
+            self._last_sweep = monotonic_now
+            for key in [key for key, bucket in self._buckets.items() if bucket.full]:
+                del self._buckets[key]
+
+
+async def load_persisted_cooldowns(store: 'CooldownStore') -> int:
+    """Restore long cooldowns written before a restart"""
+    async with get_async_session() as session:
+        rows = (await session.execute(
+            select(Cooldown.user_id, Cooldown.cooldown_type, func.max(Cooldown.expires_at))
+            .where(Cooldown.expires_at > datetime.utcnow())
+            .group_by(Cooldown.user_id, Cooldown.cooldown_type)
+        )).all()
+    store.load(rows)
+    logger.info(f"Restored {len(rows)} cooldowns from database")
+    return len(rows)
+
+
+# Shared by all handlers in this process
+cooldown_store = CooldownStore()
@@ -0,0 +1,144 @@
+"""
+Буфер счетчиков карточек (просмотры, переходы, сохранения) с отложенной записью
+"""
+import time
+import asyncio
+import logging
+from typing import Dict, List
+from sqlalchemy import update, func, bindparam
+from database.models import Card
+from database.database import async_engine
+import config
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('views_count', 'clicks_count', 'saves_count')
+
+_cards = Card.__table__
+
+# One statement for the whole batch, executed with a parameter set per card
+_FLUSH_STATEMENT = (
+    update(_cards)
+    .where(_cards.c.id == bindparam('b_card_id'))
+    .values({
+        field: func.coalesce(_cards.c[field], 0) + bindparam(f'b_{field}')
+        for field in COUNTER_FIELDS
+    })
+)
+
+
+class CounterBuffer:
+    """
+    Accumulates counter increments per card and writes them in batches
+
+    Increments are merged in memory and flushed every ``flush_interval``
+    seconds, or earlier once ``max_pending`` cards have pending deltas, as a
+    single ``UPDATE cards SET x = x + n`` executed for all pending cards.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[int, List[int]] = {}
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+        # Metrics
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_flushed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def add(self, card_id: int, field: str = 'views_count', amount: int = 1):
+        """Add an increment; never touches the database"""
+        deltas = self._pending.get(card_id)
+        if deltas is None:
+            deltas = self._pending[card_id] = [0] * len(COUNTER_FIELDS)
+        deltas[COUNTER_FIELDS.index(field)] += amount
+
+        if len(self._pending) >= self.max_pending:
+            self._wake.set()
+
+    def pending(self, card_id: int) -> Dict[str, int]:
+        """Deltas not yet written for a card"""
+        deltas = self._pending.get(card_id) or [0] * len(COUNTER_FIELDS)
+        return dict(zip(COUNTER_FIELDS, deltas))
+
+    async def flush(self) -> int:
+        """Write all pending deltas; returns number of cards updated"""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, {}
+            params = [
+                {'b_card_id': card_id, **{f'b_{field}': delta for field, delta in zip(COUNTER_FIELDS, deltas)}}
+                for card_id, deltas in batch.items()
+            ]
+
+            started = time.perf_counter()
+            try:
+                async with async_engine.begin() as conn:
+                    await conn.execute(_FLUSH_STATEMENT, params)
+            except Exception as e:
+                # Put the deltas back so they are retried on the next flush
+                for card_id, deltas in batch.items():
+                    for i, delta in enumerate(deltas):
+                        self.add(card_id, COUNTER_FIELDS[i], delta)
+                self.failed_flushes += 1
+                logger.error(f"Error flushing card counters: {e}")
+                return 0
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.rows_flushed += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return len(batch)
+
+    def start(self):
+        """Start periodic flushing on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop periodic flushing and write what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending_cards': len(self._pending),
+            'pending_deltas': sum(sum(deltas) for deltas in self._pending.values()),
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'rows_flushed': self.rows_flushed,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+
+counter_buffer = CounterBuffer(
+    flush_interval=config.COUNTER_FLUSH_INTERVAL,
+    max_pending=config.COUNTER_MAX_PENDING
+)
@@ -0,0 +1,278 @@
+"""
+Уведомления подписчиков района и категории о новой карточке
+
+publish_card в той же транзакции, что и карточку, создает FanoutJob с
+районом и категорией карточки. Фоновый воркер берет незавершенные задачи
+по порядку и проходит подписчиков пачками по FANOUT_BATCH_SIZE в порядке
+user_id (keyset: user_id > last_user_id по индексам (район, user_id) и
+(категория, user_id)). После каждой пачки last_user_id и счетчики
+записываются в БД, так что после перезапуска рассылка продолжается с
+места остановки; повторно может уйти только пачка, прерванная на середине.
+Задача, прерванная ошибкой (например, БД недоступна), повторяется после
+задач без ошибок; после FANOUT_JOB_MAX_ATTEMPTS ошибок она помечается
+failed, чтобы не задерживать следующие.
+
+Сообщения идут с rate_limit_args=BULK: планировщик (utils/rate_limiter.py)
+ограничивает рассылку своим лимитом и пропускает ответы пользователям
+вперед. Подписка совпадает при точном совпадении района / категории.
+Получатели определяются на момент публикации: подписки, оформленные после
+создания задачи, не учитываются (фильтр по created_at, без копирования
+списка подписчиков), а отписка до отправки своей пачки действует сразу.
+Воркер рассчитан на один экземпляр бота (как и polling).
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import or_, select, true, update
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, TelegramError
+from database.models import Card, FanoutJob, DistrictSubscription, CategorySubscription
+from database.database import get_async_session
+from utils.card_cache import RenderedCard
+from utils.helpers import get_rendered_card
+from utils.rate_limiter import BULK
+import config
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_PREFIX = "🔔 Новая карточка по вашей подписке\n\n"
+CAPTION_LIMIT = 1024  # Telegram's limit for media captions
+
+# media_type -> (bot method, media argument)
+MEDIA_SENDERS = {
+    'photo': ('send_photo', 'photo'),
+    'video': ('send_video', 'video'),
+    'document': ('send_document', 'document'),
+}
+
+
+async def enqueue(session, card: Card) -> Optional[FanoutJob]:
+    """Add a fan-out job for a card being published (commit with the card)"""
+    if not card.district and not card.category:
+        return None
+    await session.flush()  # card.id
+    job = FanoutJob(card_id=card.id, district=card.district, category=card.category)
+    session.add(job)
+    return job
+
+
+async def subscriber_batch(session, district: Optional[str], category: Optional[str],
+                           after: int, limit: int, published_at: Optional[datetime] = None) -> List[int]:
+    """
+    Next ``limit`` subscriber IDs above ``after``, in order, without duplicates
+    published_at: only subscriptions that existed at this time
+    """
+    user_ids = set()
+    # The smallest IDs of the union are among the smallest of each side
+    if district:
+        user_ids.update(await session.scalars(
+            select(DistrictSubscription.user_id)
+            .where(DistrictSubscription.district == district, DistrictSubscription.user_id > after,
+                   _subscribed_before(DistrictSubscription, published_at))
+            .order_by(DistrictSubscription.user_id).limit(limit)
+        ))
+    if category:
+        user_ids.update(await session.scalars(
+            select(CategorySubscription.user_id)
+            .where(CategorySubscription.category == category, CategorySubscription.user_id > after,
+                   _subscribed_before(CategorySubscription, published_at))
+            .order_by(CategorySubscription.user_id).limit(limit)
+        ))
+    return sorted(user_ids)[:limit]
+
+
+def _subscribed_before(model, published_at: Optional[datetime]):
+    if published_at is None:
+        return true()
+    # Rows without created_at predate the column: they count as old subscriptions
+    return or_(model.created_at.is_(None), model.created_at <= published_at)
+
+
+class FanoutWorker:
+    """Runs fan-out jobs one at a time, checkpointing after every batch"""
+
+    def __init__(self):
+        self._bot = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+        # Metrics
+        self.jobs = 0
+        self.jobs_failed = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.last_batch_ms = 0.0
+
+    def start(self, bot):
+        """Start the worker; unfinished jobs from before a restart are picked up first"""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """A job was added"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            job_id = None
+            try:
+                job_id = await self._next_job()
+                if job_id is None:
+                    await self._wakeup.wait()
+                    continue
+                await self.run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # e.g. the database is unavailable: keep the checkpoint, try again later
+                logger.error(f"Fan-out job {job_id} failed: {e}")
+                if job_id is not None:
+                    await self._record_failure(job_id)
+                await asyncio.sleep(config.FANOUT_RETRY_DELAY)
+
+    @staticmethod
+    async def _next_job() -> Optional[int]:
+        """Oldest pending job, jobs that hit an error last"""
+        async with get_async_session() as session:
+            return await session.scalar(
+                select(FanoutJob.id).where(FanoutJob.status == 'pending')
+                .order_by(FanoutJob.attempts, FanoutJob.id).limit(1)
+            )
+
+    async def _record_failure(self, job_id: int):
+        """Count a failed run; give the job up after FANOUT_JOB_MAX_ATTEMPTS"""
+        try:
+            async with get_async_session() as session:
+                job = await session.get(FanoutJob, job_id)
+                if job is None:
+                    return
+                job.attempts += 1
+                job.updated_at = datetime.utcnow()
+                if job.attempts >= config.FANOUT_JOB_MAX_ATTEMPTS:
+                    job.status = 'failed'
+                    job.finished_at = job.updated_at
+                await session.commit()
+                attempts, status = job.attempts, job.status
+        except Exception as e:
+            logger.error(f"Fan-out job {job_id}: could not record the failure: {e}")
+            return
+        if status == 'failed':
+            self.jobs_failed += 1
+            logger.error(f"Fan-out job {job_id} given up after {attempts} failed runs")
+
+    async def run_job(self, job_id: int):
+        async with get_async_session() as session:
+            job = await session.get(FanoutJob, job_id)
+        rendered = await get_rendered_card(job.card_id)
+        if rendered is None:
+            # The card was removed before everyone was notified
+            await self._finish(job_id, 'cancelled')
+            return
+
+        after = job.last_user_id
+        logger.info(f"Fan-out job {job_id} for card {job.card_id}: starting after user {after}")
+        while True:
+            async with get_async_session() as session:
+                user_ids = await subscriber_batch(
+                    session, job.district, job.category, after, config.FANOUT_BATCH_SIZE,
+                    published_at=job.created_at
+                )
+            if not user_ids:
+                break
+            started = time.perf_counter()
+            sent, failed = await self._send_batch(rendered, user_ids)
+            after = user_ids[-1]
+            async with get_async_session() as session:
+                await session.execute(
+                    update(FanoutJob).where(FanoutJob.id == job_id).values(
+                        last_user_id=after,
+                        sent=FanoutJob.sent + sent,
+                        failed=FanoutJob.failed + failed,
+                        updated_at=datetime.utcnow(),
+                    )
+                )
+                await session.commit()
+            self.batches += 1
+            self.last_batch_ms = (time.perf_counter() - started) * 1000
+
+        await self._finish(job_id, 'done')
+
+    async def _finish(self, job_id: int, status: str):
+        async with get_async_session() as session:
+            job = await session.get(FanoutJob, job_id)
+            job.status = status
+            job.finished_at = datetime.utcnow()
+            await session.commit()
+        self.jobs += 1
+        logger.info(f"Fan-out job {job_id} {status}: sent {job.sent}, failed {job.failed}")
+
+    async def _send_batch(self, rendered: RenderedCard, user_ids: List[int]) -> Tuple[int, int]:
+        """Notify a batch concurrently; the rate limiter paces the requests"""
+        results = await asyncio.gather(*(self._notify(rendered, user_id) for user_id in user_ids))
+        sent = sum(results)
+        failed = len(results) - sent
+        self.sent += sent
+        self.failed += failed
+        return sent, failed
+
+    async def _notify(self, rendered: RenderedCard, user_id: int) -> bool:
+        text = NOTIFY_PREFIX + rendered.text
+        if len(text) > CAPTION_LIMIT and rendered.media_type in MEDIA_SENDERS:
+            text = rendered.text
+        keyboard = InlineKeyboardMarkup((rendered.action_row,))
+        kwargs = {'chat_id': user_id, 'reply_markup': keyboard}
+        if getattr(self._bot, 'rate_limiter', None) is not None:
+            kwargs['rate_limit_args'] = BULK
+
+        for attempt in range(1, config.FANOUT_MAX_ATTEMPTS + 1):
+            try:
+                if rendered.media_type in MEDIA_SENDERS:
+                    method, media_arg = MEDIA_SENDERS[rendered.media_type]
+                    await getattr(self._bot, method)(
+                        **{media_arg: rendered.media_file_id}, caption=text, **kwargs
+                    )
+                else:
+                    await self._bot.send_message(text=text, **kwargs)
+                return True
+            except (Forbidden, BadRequest) as e:
+                # Blocked the bot, deleted account, ...: retrying won't help
+                logger.debug(f"Fan-out to {user_id} failed: {e}")
+                return False
+            except TelegramError as e:
+                # Network errors, or RetryAfter left over after the rate limiter's own retries
+                if attempt == config.FANOUT_MAX_ATTEMPTS:
+                    logger.warning(f"Fan-out to {user_id} failed after {attempt} attempts: {e}")
+                    return False
+                self.retried += 1
+                await asyncio.sleep(config.FANOUT_RETRY_DELAY)
+        return False
+
+    def stats(self) -> dict:
+        return {
+            'jobs': self.jobs,
+            'jobs_failed': self.jobs_failed,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'batches': self.batches,
+            'last_batch_ms': round(self.last_batch_ms, 1),
+        }
+
+
+# Shared by publish_card and the application lifecycle
+fanout = FanoutWorker()
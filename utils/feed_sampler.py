@@ -0,0 +1,112 @@
+"""
+Случайная выборка карточек ленты на стороне БД (FEED_SAMPLER=database)
+
+Каждая карточка получает при создании случайный random_key. Выборка k
+карточек - поиск по индексу ix_cards_random_key: случайная точка r, затем
+ORDER BY random_key LIMIT n начиная с r (с переходом через конец шкалы).
+Просмотренные карточки отбрасываются в Python. Если пользователь видел почти
+весь набор, ID набора читаются потоком (yield_per) с резервуарной выборкой -
+строки карточек в память не загружаются ни в одном из случаев.
+"""
+import random
+from typing import Container, List, Optional
+from sqlalchemy import select
+from database.models import Card, RANDOM_KEY_MAX
+from utils.card_groups import groups_filter, bitwise_groups_filter
+
+# Range seeks before falling back to a full pass over the set
+SEEK_ATTEMPTS = 3
+# Rows read by the first seek, per card needed. The k cards are drawn from the
+# whole window: a card right after a big gap in random_key is then not much
+# likelier to be picked than the others (bias shrinks as 1/sqrt(window))
+OVERSAMPLE = 8
+# Later seeks read needed / unseen share * 2 rows, up to this many
+MAX_SEEK_ROWS = 5000
+STREAM_BATCH = 1000
+
+
+class _Union:
+    """Membership in any of the containers (avoids copying a seen set)"""
+
+    __slots__ = ('containers',)
+
+    def __init__(self, *containers: Container[int]):
+        self.containers = containers
+
+    def __contains__(self, item: int) -> bool:
+        return any(item in container for container in self.containers)
+
+
+async def _seek(session, mask: int, start: int, count: int) -> List[int]:
+    """Up to ``count`` card IDs of the set in random_key order from ``start``, wrapping around"""
+    # Walk the random_key index; the groups are checked from the same index entries
+    in_set = bitwise_groups_filter(mask)
+    card_ids = list(await session.scalars(
+        select(Card.id)
+        .where(in_set, Card.random_key >= start)
+        .order_by(Card.random_key)
+        .limit(count)
+    ))
+    if len(card_ids) < count:
+        card_ids.extend(await session.scalars(
+            select(Card.id)
+            .where(in_set, Card.random_key < start)
+            .order_by(Card.random_key)
+            .limit(count - len(card_ids))
+        ))
+    return card_ids
+
+
+async def _reservoir(session, mask: int, k: int, exclude: Container[int]) -> List[int]:
+    """k random card IDs of the set not in ``exclude``, in one streamed pass"""
+    reservoir = []
+    candidates = 0
+    result = await session.stream_scalars(
+        select(Card.id)
+        .where(groups_filter(mask))
+        .execution_options(yield_per=STREAM_BATCH)
+    )
+    async for card_id in result:
+        if card_id in exclude:
+            continue
+        candidates += 1
+        if len(reservoir) < k:
+            reservoir.append(card_id)
+        else:
+            slot = random.randrange(candidates)
+            if slot < k:
+                reservoir[slot] = card_id
+    random.shuffle(reservoir)
+    return reservoir
+
+
+async def sample_card_ids(session, mask: int, k: int,
+                          exclude: Optional[Container[int]] = None) -> List[int]:
+    """Up to k random distinct IDs of cards in the groups of ``mask``, skipping excluded IDs"""
+    if k <= 0:
+        return []
+    exclude = exclude if exclude is not None else ()
+
+    picked = []
+    chosen = set()
+    count = k * OVERSAMPLE
+    for _ in range(SEEK_ATTEMPTS):
+        card_ids = await _seek(session, mask, random.randint(0, RANDOM_KEY_MAX), count)
+        unseen = [card_id for card_id in card_ids if card_id not in chosen and card_id not in exclude]
+        found = len(unseen)
+        for card_id in random.sample(unseen, min(k - len(picked), found)):
+            chosen.add(card_id)
+            picked.append(card_id)
+        if len(picked) >= k:
+            return picked
+        if len(card_ids) < count:
+            # The whole set fit into one seek: there is nothing more to find
+            return picked
+        # Size the next seek by the share of unseen cards in this one
+        unseen_share = max(found, 1) / len(card_ids)
+        count = min(int((k - len(picked)) / unseen_share * 2) + 1, MAX_SEEK_ROWS)
+
+    # Most of the set is already seen: one pass over the remaining IDs
+    skip = _Union(exclude, chosen)
+    return picked + await _reservoir(session, mask, k - len(picked), skip)
+
@@ -1,152 +1,156 @@
 """
 Вспомогательные функции для бота
 """
-import random
 from datetime import datetime, timedelta
 from typing import List, Optional, Tuple
-from sqlalchemy import func, and_
-from database.models import Card, User, ViewedCard, Rating, Cooldown
-from database.database import get_session
+from sqlalchemy import select, update, delete, and_, or_
+from database.models import Card, User, Rating, Cooldown, ViewedCard, SavedCard
+from database.database import get_async_session, rating_aggregates_statement, fulltext, dialect_insert
+from utils.catalog_index import catalog_index
+from utils.card_groups import card_set_mask, mask_groups
+from utils.feed_sampler import sample_card_ids
+from utils.ranking import feed_ranking
+from utils.search_index import search_index
+from utils.seen_sets import get_seen_set, mark_seen, reset_seen
+from utils.counters import counter_buffer
+from utils.cooldowns import cooldown_store
+from utils.card_cache import card_cache, RenderedCard, rating_version
+from utils.known_users import known_users
+from utils.card_numbers import release_card_numbers
 import config
 
 
 # ============== РАБОТА С ПОЛЬЗОВАТЕЛЯМИ ==============
 
-def generate_unique_card_number() -> int:
-    """Generate unique random card number between 1-9999"""
-    session = get_session()
-    try:
-        while True:
-            number = random.randint(1, 9999)
-            existing = session.query(Card).filter(Card.card_number == number).first()
-            if not existing:
-                return number
-    finally:
-        session.close()
-
-
-def get_or_create_user(user_id: int, username: str = None, 
-                       first_name: str = None, last_name: str = None) -> User:
-    """Get existing user or create new one"""
-    session = get_session()
-    try:
-        user = session.query(User).filter(User.id == user_id).first()
-        if not user:
-            user = User(
-                id=user_id,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                is_admin=user_id in config.ADMIN_IDS
-            )
-            session.add(user)
-            session.commit()
-        else:
-            # Update user info
-            user.username = username
-            user.first_name = first_name
-            user.last_name = last_name
-            user.last_activity = datetime.utcnow()
-            session.commit()
-        return user
-    finally:
-        session.close()
+async def upsert_user(user_id: int, username: str = None,
+                      first_name: str = None, last_name: str = None) -> bool:
+    """
+    Register user or refresh their profile and last_activity
+    Returns: True if anything was written
+    """
+    profile = (username, first_name, last_name)
+    now = datetime.utcnow()
+    window = timedelta(seconds=config.USER_ACTIVITY_WINDOW)
+    
+    known = known_users.get(user_id)
+    if known is not None:
+        known_profile, activity_at = known
+        if known_profile == profile:
+            if now - activity_at < window:
+                return False
+            # Only the activity timestamp is due
+            async with get_async_session() as session:
+                await session.execute(
+                    update(User).where(User.id == user_id).values(last_activity=now)
+                )
+                await session.commit()
+            known_users.put(user_id, profile, now)
+            return True
+    
+    # One statement for new and existing users; an existing row is only
+    # rewritten when the profile changed or last_activity is out of date
+    users = User.__table__
+    insert = dialect_insert(users).values(
+        id=user_id,
+        username=username,
+        first_name=first_name,
+        last_name=last_name,
+        is_admin=user_id in config.ADMIN_IDS,
+        current_card_set=0,
+        created_at=now,
+        last_activity=now
+    )
+    statement = insert.on_conflict_do_update(
+        index_elements=[users.c.id],
+        set_={
+            'username': insert.excluded.username,
+            'first_name': insert.excluded.first_name,
+            'last_name': insert.excluded.last_name,
+            'last_activity': insert.excluded.last_activity,
+        },
+        where=or_(
+            users.c.username.is_distinct_from(insert.excluded.username),
+            users.c.first_name.is_distinct_from(insert.excluded.first_name),
+            users.c.last_name.is_distinct_from(insert.excluded.last_name),
+            users.c.last_activity.is_(None),
+            users.c.last_activity < now - window,
+        )
+    )
+    
+    async with get_async_session() as session:
+        result = await session.execute(statement)
+        await session.commit()
+    
+    known_users.put(user_id, profile, now)
+    return bool(result.rowcount)
 
 
 # ============== РАБОТА С КАРТОЧКАМИ ==============
 
-def get_cards_for_user(user_id: int, limit: int = 5) -> List[Card]:
+async def _sample_feed(session, user_id: int, card_set_index: int, limit: int,
+                       exclude=None) -> Tuple[List[int], bool]:
+    """
+    Random card IDs from the card set, using the configured sampler
+    Returns: (card IDs, whether unseen cards were held back by the ad limits)
+    """
+    mask = card_set_mask(card_set_index)
+    if config.FEED_SAMPLER == 'database':
+        return await sample_card_ids(session, mask, limit, exclude=exclude), False
+    if config.FEED_SAMPLER == 'ranked':
+        await feed_ranking.ensure_loaded()
+        return feed_ranking.sample(user_id, mask_groups(mask), limit, exclude=exclude)
+    await catalog_index.ensure_loaded()
+    return catalog_index.sample(mask_groups(mask), limit, exclude=exclude), False
+
+
+async def get_cards_for_user(user_id: int, limit: int = 5) -> List[Card]:
     """
     Get random cards for user based on their card set
     Returns cards user hasn't viewed yet
     """
-    session = get_session()
-    try:
-        # Get user
-        user = session.query(User).filter(User.id == user_id).first()
-        if not user:
-            return []
-        
+    async with get_async_session() as session:
         # Get user's card set (which groups to show)
-        card_set_index = user.current_card_set
-        if card_set_index < 0 or card_set_index >= len(config.CARD_SETS):
-            card_set_index = 0
-        
-        allowed_groups = config.CARD_SETS[card_set_index]
+        card_set_index = await session.scalar(
+            select(User.current_card_set).where(User.id == user_id)
+        )
+        if card_set_index is None:
+            return []
         
-        # Get cards user has already viewed
-        viewed_card_ids = session.query(ViewedCard.card_id).filter(
-            ViewedCard.user_id == user_id
-        ).all()
-        viewed_ids = [v[0] for v in viewed_card_ids]
+        # Get cards user has already viewed (compact bitmap)
+        viewed = await get_seen_set(user_id)
         
-        # Get random cards from allowed groups that user hasn't viewed
-        query = session.query(Card).filter(
-            and_(
-                Card.groups.op('@>')(allowed_groups),  # Card belongs to allowed groups
-                Card.id.notin_(viewed_ids) if viewed_ids else True
-            )
-        )
+        # Sample unseen card IDs (card belongs to any group of the set)
+        card_ids, capped = await _sample_feed(session, user_id, card_set_index, limit, exclude=viewed)
         
         # If no unviewed cards, reset viewed cards for this user
-        if query.count() == 0:
-            session.query(ViewedCard).filter(ViewedCard.user_id == user_id).delete()
-            session.commit()
+        if not card_ids:
+            if capped:
+                # The unseen cards left are ads over the user's limit: keep the history
+                return []
+            # Try again without the viewed filter (nothing to reset if the set is empty)
+            card_ids, _ = await _sample_feed(session, user_id, card_set_index, limit)
+            if not card_ids:
+                return []
             
-            # Try again
-            query = session.query(Card).filter(
-                Card.groups.op('@>')(allowed_groups)
-            )
-        
-        # Get random cards
-        all_cards = query.all()
-        if not all_cards:
-            return []
-        
-        # Shuffle and limit
-        random.shuffle(all_cards)
-        return all_cards[:limit]
+            await reset_seen(user_id)
         
-    finally:
-        session.close()
+        # Hydrate only the picked cards, keeping the random order
+        cards = await session.scalars(select(Card).where(Card.id.in_(card_ids)))
+        cards_by_id = {card.id: card for card in cards}
+        return [cards_by_id[card_id] for card_id in card_ids if card_id in cards_by_id]
 
 
-def mark_card_as_viewed(user_id: int, card_id: int):
+async def mark_card_as_viewed(user_id: int, card_id: int):
     """Mark card as viewed by user"""
-    session = get_session()
-    try:
-        # Check if already viewed
-        existing = session.query(ViewedCard).filter(
-            and_(
-                ViewedCard.user_id == user_id,
-                ViewedCard.card_id == card_id
-            )
-        ).first()
-        
-        if not existing:
-            viewed = ViewedCard(user_id=user_id, card_id=card_id)
-            session.add(viewed)
-            
-            # Increment view counter
-            card = session.query(Card).filter(Card.id == card_id).first()
-            if card:
-                card.views_count += 1
-            
-            session.commit()
-    finally:
-        session.close()
+    # Add to user's seen set; count the view only the first time
+    if await mark_seen(user_id, card_id):
+        # Increment view counter (written in batches)
+        counter_buffer.add(card_id, 'views_count')
 
 
-def increment_card_clicks(card_id: int):
-    """Increment card click counter"""
-    session = get_session()
-    try:
-        card = session.query(Card).filter(Card.id == card_id).first()
-        if card:
-            card.clicks_count += 1
-            session.commit()
-    finally:
-        session.close()
+async def increment_card_clicks(card_id: int):
+    """Increment card click counter (written in batches)"""
+    counter_buffer.add(card_id, 'clicks_count')
 
 
 # ============== ФОРМАТИРОВАНИЕ КАРТОЧЕК ==============
@@ -164,8 +168,8 @@ def format_card_text(card: Card) -> str:
     
     Описание...
     """
-    # Получаем рейтинг
-    avg_rating, rating_count = get_card_rating(card.id)
+    # Получаем рейтинг (агрегаты хранятся в карточке)
+    avg_rating, rating_count = card_rating(card)
     
     # Формируем хештеги
     hashtags_text = ""
@@ -195,45 +199,91 @@ def format_card_text(card: Card) -> str:
 
 # ============== РАБОТА С РЕЙТИНГОМ ==============
 
-def get_card_rating(card_id: int) -> Tuple[float, int]:
+def render_card(card: Card, epoch: int = None) -> RenderedCard:
+    """
+    Render a card and keep it in the cache
+    epoch: card_cache.epoch() read before the row was loaded
+    """
+    rendered = RenderedCard(card, format_card_text(card))
+    card_cache.put(rendered, epoch)
+    return rendered
+
+
+def render_loaded_card(card: Card, epoch: int = None) -> RenderedCard:
+    """Cached render if it was built from this row's rating, else render the row"""
+    rendered = card_cache.get(card.id, rating_version(card))
+    if rendered is not None:
+        return rendered
+    return render_card(card, epoch)
+
+
+async def get_rendered_card(card_id: int) -> Optional[RenderedCard]:
+    """
+    Rendered card from the cache, loading the card on a miss
+    Without the row the rating version is unknown: relies on invalidation
+    """
+    rendered = card_cache.get(card_id)
+    if rendered is not None:
+        return rendered
+    
+    epoch = card_cache.epoch()
+    async with get_async_session() as session:
+        card = await session.get(Card, card_id)
+        if not card:
+            return None
+        return render_card(card, epoch)
+
+
+def card_rating(card: Card) -> Tuple[float, int]:
+    """
+    Get average rating and count from card's stored aggregates
+    Returns: (average_rating, count)
+    """
+    count = card.rating_count or 0
+    if count == 0:
+        return (0.0, 0)
+    return (card.rating_sum / count, count)
+
+
+async def get_card_rating(card_id: int) -> Tuple[float, int]:
     """
     Get average rating and count for card
     Returns: (average_rating, count)
     """
-    session = get_session()
-    try:
-        result = session.query(
-            func.avg(Rating.rating),
-            func.count(Rating.id)
-        ).filter(Rating.card_id == card_id).first()
+    async with get_async_session() as session:
+        result = (await session.execute(
+            select(Card.rating_sum, Card.rating_count).where(Card.id == card_id)
+        )).first()
         
-        avg = result[0] if result[0] else 0.0
-        count = result[1] if result[1] else 0
+        if not result or not result.rating_count:
+            return (0.0, 0)
         
-        return (float(avg), int(count))
-    finally:
-        session.close()
+        return (result.rating_sum / result.rating_count, int(result.rating_count))
 
 
-def add_or_update_rating(user_id: int, card_id: int, rating: int):
+async def add_or_update_rating(user_id: int, card_id: int, rating: int):
     """Add or update user's rating for card"""
     if rating < 1 or rating > 10:
         raise ValueError("Rating must be between 1 and 10")
     
-    session = get_session()
-    try:
+    async with get_async_session() as session:
         # Check if user already rated this card
-        existing = session.query(Rating).filter(
-            and_(
-                Rating.user_id == user_id,
-                Rating.card_id == card_id
+        existing = await session.scalar(
+            select(Rating).where(
+                and_(
+                    Rating.user_id == user_id,
+                    Rating.card_id == card_id
+                )
             )
-        ).first()
+        )
         
         if existing:
+            # Changed rating: shift the sum by the difference
+            sum_delta, count_delta = rating - existing.rating, 0
             existing.rating = rating
             existing.created_at = datetime.utcnow()
         else:
+            sum_delta, count_delta = rating, 1
             new_rating = Rating(
                 user_id=user_id,
                 card_id=card_id,
@@ -241,28 +291,57 @@ def add_or_update_rating(user_id: int, card_id: int, rating: int):
             )
             session.add(new_rating)
         
-        session.commit()
-    finally:
-        session.close()
+        # Keep card aggregates in the same transaction
+        await session.execute(
+            update(Card)
+            .where(Card.id == card_id)
+            .values(
+                rating_sum=Card.rating_sum + sum_delta,
+                rating_count=Card.rating_count + count_delta
+            )
+        )
+        
+        await session.commit()
+    
+    card_cache.invalidate(card_id)
+
+
+async def recalculate_card_ratings() -> int:
+    """
+    Recompute rating aggregates of all cards from the ratings table
+    Returns: number of cards updated
+    """
+    async with get_async_session() as session:
+        result = await session.execute(rating_aggregates_statement())
+        await session.commit()
+    
+    card_cache.clear()
+    return result.rowcount
 
 
 # ============== КУЛДАУНЫ ==============
 
-def set_cooldown(user_id: int, cooldown_type: str, duration_seconds: int):
+async def set_cooldown(user_id: int, cooldown_type: str, duration_seconds: int):
     """Set cooldown for user"""
-    session = get_session()
-    try:
-        expires_at = datetime.utcnow() + timedelta(seconds=duration_seconds)
-        
-        cooldown = Cooldown(
+    expires_at = datetime.utcnow() + timedelta(seconds=duration_seconds)
+    cooldown_store.set(user_id, cooldown_type, expires_at)
+
+    if duration_seconds < config.COOLDOWN_PERSIST_MIN_SECONDS:
+        return
+
+    # Long cooldowns must survive a restart: keep one row per (user, type)
+    async with get_async_session() as session:
+        await session.execute(
+            delete(Cooldown).where(
+                and_(Cooldown.user_id == user_id, Cooldown.cooldown_type == cooldown_type)
+            )
+        )
+        session.add(Cooldown(
             user_id=user_id,
             cooldown_type=cooldown_type,
             expires_at=expires_at
-        )
-        session.add(cooldown)
-        session.commit()
-    finally:
-        session.close()
+        ))
+        await session.commit()
 
 
 def check_cooldown(user_id: int, cooldown_type: str) -> Optional[datetime]:
@@ -270,86 +349,91 @@ def check_cooldown(user_id: int, cooldown_type: str) -> Optional[datetime]:
     Check if user has active cooldown
     Returns: expires_at datetime if cooldown active, None otherwise
     """
-    session = get_session()
-    try:
-        cooldown = session.query(Cooldown).filter(
-            and_(
-                Cooldown.user_id == user_id,
-                Cooldown.cooldown_type == cooldown_type,
-                Cooldown.expires_at > datetime.utcnow()
-            )
-        ).first()
-        
-        if cooldown:
-            return cooldown.expires_at
-        return None
-    finally:
-        session.close()
+    return cooldown_store.get(user_id, cooldown_type)
+
+
+def check_rate_limit(user_id: int, key: str, per_minute: float, burst: int) -> float:
+    """
+    Token-bucket limit for an action
+    Returns: 0 if allowed, otherwise seconds to wait
+    """
+    return cooldown_store.consume(user_id, key, per_minute / 60.0, burst)
 
 
-def remove_cooldown(user_id: int, cooldown_type: str = None):
+async def remove_cooldown(user_id: int, cooldown_type: str = None):
     """Remove cooldown(s) for user"""
-    session = get_session()
-    try:
-        query = session.query(Cooldown).filter(Cooldown.user_id == user_id)
+    cooldown_store.remove(user_id, cooldown_type)
+
+    async with get_async_session() as session:
+        query = delete(Cooldown).where(Cooldown.user_id == user_id)
         
         if cooldown_type:
-            query = query.filter(Cooldown.cooldown_type == cooldown_type)
+            query = query.where(Cooldown.cooldown_type == cooldown_type)
         
-        query.delete()
-        session.commit()
-    finally:
-        session.close()
+        await session.execute(query)
+        await session.commit()
 
 
 # ============== УДАЛЕНИЕ УСТАРЕВШИХ КАРТОЧЕК ==============
 
-def delete_expired_f_cards() -> int:
+async def delete_expired_f_cards(batch_size: int = 500) -> int:
     """
     Delete cards from group F that have expired
     Returns: number of deleted cards
     """
-    session = get_session()
-    try:
-        now = datetime.utcnow()
-        
-        expired_cards = session.query(Card).filter(
-            and_(
-                Card.expires_at.isnot(None),
-                Card.expires_at <= now
-            )
-        ).all()
-        
-        count = len(expired_cards)
-        
-        for card in expired_cards:
-            session.delete(card)
-        
-        session.commit()
-        return count
-    finally:
-        session.close()
+    now = datetime.utcnow()
+    total = 0
+
+    while True:
+        async with get_async_session() as session:
+            rows = (await session.execute(
+                select(Card.id, Card.card_number).where(
+                    and_(
+                        Card.expires_at.isnot(None),
+                        Card.expires_at <= now
+                    )
+                ).order_by(Card.expires_at).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            card_ids = [row.id for row in rows]
+
+            # Bulk deletes skip ORM cascades: remove dependent rows first
+            for model in (Rating, ViewedCard, SavedCard):
+                await session.execute(delete(model).where(model.card_id.in_(card_ids)))
+            await session.execute(delete(Card).where(Card.id.in_(card_ids)))
+            await release_card_numbers(session, [row.card_number for row in rows])
+            await session.commit()
+
+        catalog_index.remove_many(card_ids)
+        feed_ranking.remove_many(card_ids)
+        search_index.remove_many(card_ids)
+        card_cache.invalidate_many(card_ids)
+        total += len(card_ids)
+        if len(card_ids) < batch_size:
+            break
+
+    return total
 
 
 # ============== ПОИСК ==============
 
-def search_cards(query: str, limit: int = 10) -> List[Card]:
+async def search_cards(query: str, limit: int = 10) -> List[Card]:
     """
-    Search cards by district, category, or hashtags
+    Search cards by district, category, hashtags or description
+    Results are ranked by relevance (see utils/search_index.py, database/fulltext.py)
     """
-    session = get_session()
-    try:
-        query = query.lower().strip()
+    async with get_async_session() as session:
+        if config.SEARCH_BACKEND == 'database' and fulltext is not None and fulltext.available:
+            statement = fulltext.statement(query, limit)
+            card_ids = list(await session.scalars(statement)) if statement is not None else []
+        else:
+            await search_index.ensure_loaded()
+            card_ids = search_index.search(query, limit)
         
-        # Search in district, category, and hashtags
-        cards = session.query(Card).filter(
-            or_(
-                Card.district.ilike(f"%{query}%"),
-                Card.category.ilike(f"%{query}%"),
-                Card.hashtags.op('@>')(f'["{query}"]')  # JSON search
-            )
-        ).limit(limit).all()
+        if not card_ids:
+            return []
         
-        return cards
-    finally:
-        session.close()
+        cards = await session.scalars(select(Card).where(Card.id.in_(card_ids)))
+        cards_by_id = {card.id: card for card in cards}
+        return [cards_by_id[card_id] for card_id in card_ids if card_id in cards_by_id]
@@ -0,0 +1,146 @@
+"""
+Минимальный асинхронный HTTP/1.1 сервер на asyncio
+
+Используется для вебхука Telegram и служебных эндпоинтов (health).
+Поддерживает keep-alive, Content-Length и ограничение размера тела;
+chunked-запросы не поддерживаются (Telegram их не отправляет).
+"""
+import json
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+READ_TIMEOUT = 30  # seconds a keep-alive connection may stay idle
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class Request:
+    __slots__ = ('method', 'path', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    __slots__ = ('status', 'body', 'content_type')
+
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> 'Response':
+        return cls(status, json.dumps(data, default=str).encode(), 'application/json')
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HttpServer:
+    """Routes (method, path) to async handlers"""
+
+    def __init__(self, max_body: int = 1024 * 1024):
+        self.max_body = max_body
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self, host: str, port: int):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        logger.info(f"HTTP server listening on {host}:{port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request, error = await self._read_request(reader)
+                if request is None and error is None:
+                    break  # client closed the connection
+                response = error or await self._dispatch(request)
+                keep_alive = (
+                    error is None
+                    and request.headers.get('connection', '').lower() != 'close'
+                )
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), READ_TIMEOUT)
+        except asyncio.IncompleteReadError:
+            return None, None
+        except asyncio.LimitOverrunError:
+            return None, Response(400, b'Headers too large')
+        if len(head) > MAX_HEADER_BYTES:
+            return None, Response(400, b'Headers too large')
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, _ = lines[0].split(' ', 2)
+        except ValueError:
+            return None, Response(400, b'Bad request line')
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        body = b''
+        if method in ('POST', 'PUT'):
+            if 'content-length' not in headers:
+                return None, Response(411)
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                return None, Response(400, b'Bad Content-Length')
+            if length > self.max_body:
+                return None, Response(413)
+            body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT)
+
+        return Request(method, target.split('?', 1)[0], headers, body), None
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            known_path = any(path == request.path for _, path in self._routes)
+            return Response(405 if known_path else 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"HTTP handler error on {request.path}: {e}", exc_info=True)
+            return Response(500)
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + response.body)
+        await writer.drain()
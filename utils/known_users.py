@@ -0,0 +1,58 @@
+"""
+Кэш известных пользователей: профиль и время последней записи last_activity
+
+Позволяет не писать в БД на каждый /start: профиль пишется только при
+изменении, last_activity - не чаще раза в USER_ACTIVITY_WINDOW секунд.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+import config
+
+Profile = Tuple[Optional[str], Optional[str], Optional[str]]  # username, first_name, last_name
+
+
+class KnownUsers:
+    """LRU of user_id -> (profile, last_activity written)"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[int, Tuple[Profile, datetime]]' = OrderedDict()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Tuple[Profile, datetime]]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def put(self, user_id: int, profile: Profile, activity_at: datetime):
+        self._entries[user_id] = (profile, activity_at)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def forget(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Shared by all handlers in this process
+known_users = KnownUsers(config.USER_CACHE_SIZE)
@@ -0,0 +1,100 @@
+"""
+Фоновое обслуживание БД по расписанию (JobQueue)
+
+- удаление истекших карточек группы F
+- очистка истекших кулдаунов
+- очистка осиротевших viewed_cards / saved_cards
+- пересчет весов ранжирования ленты (FEED_SAMPLER=ranked)
+
+Все удаления - пакетные DELETE ограниченного размера, каждая задача
+пишет в лог число удаленных строк и длительность.
+"""
+import time
+import logging
+from datetime import datetime
+from sqlalchemy import select, delete, exists
+from telegram.ext import ContextTypes, JobQueue
+from database.models import Card, Cooldown, ViewedCard, SavedCard
+from database.database import get_async_session
+from utils.helpers import delete_expired_f_cards
+from utils.ranking import feed_ranking
+import config
+
+logger = logging.getLogger(__name__)
+
+# job name -> result of the last run
+maintenance_stats = {}
+
+
+async def delete_in_batches(model, condition, batch_size: int) -> int:
+    """DELETE rows of ``model`` matching ``condition``, ``batch_size`` rows per statement"""
+    total = 0
+    while True:
+        batch = select(model.id).where(condition).limit(batch_size)
+        async with get_async_session() as session:
+            result = await session.execute(delete(model).where(model.id.in_(batch)))
+            await session.commit()
+        total += result.rowcount
+        if result.rowcount < batch_size:
+            return total
+
+
+async def expire_cards() -> int:
+    return await delete_expired_f_cards(config.MAINTENANCE_BATCH_SIZE)
+
+
+async def purge_cooldowns() -> int:
+    return await delete_in_batches(
+        Cooldown, Cooldown.expires_at <= datetime.utcnow(), config.MAINTENANCE_BATCH_SIZE
+    )
+
+
+async def purge_orphans() -> int:
+    removed = 0
+    for model in (ViewedCard, SavedCard):
+        orphaned = ~exists().where(Card.id == model.card_id)
+        removed += await delete_in_batches(model, orphaned, config.MAINTENANCE_BATCH_SIZE)
+    return removed
+
+
+async def _run_job(name: str, job) -> int:
+    started = time.perf_counter()
+    try:
+        rows = await job()
+    except Exception as e:
+        logger.error(f"Maintenance job {name} failed: {e}")
+        maintenance_stats[name] = {'ok': False, 'at': datetime.utcnow()}
+        return 0
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    maintenance_stats[name] = {'ok': True, 'rows': rows, 'ms': round(elapsed_ms, 1), 'at': datetime.utcnow()}
+    logger.info(f"Maintenance job {name}: removed {rows} rows in {elapsed_ms:.1f} ms")
+    return rows
+
+
+async def expire_cards_job(context: ContextTypes.DEFAULT_TYPE):
+    """Delete expired group F cards"""
+    await _run_job('expire_cards', expire_cards)
+
+
+async def purge_job(context: ContextTypes.DEFAULT_TYPE):
+    """Remove expired cooldowns and orphaned rows"""
+    await _run_job('purge_cooldowns', purge_cooldowns)
+    await _run_job('purge_orphans', purge_orphans)
+
+
+async def ranking_job(context: ContextTypes.DEFAULT_TYPE):
+    """Rebuild feed ranking weights (freshness decays, ratings change)"""
+    try:
+        await feed_ranking.refresh()
+    except Exception as e:
+        logger.error(f"Feed ranking refresh failed: {e}")
+
+
+def schedule_maintenance(job_queue: JobQueue):
+    """Register the maintenance jobs; they start with the application"""
+    job_queue.run_repeating(expire_cards_job, interval=config.CARD_EXPIRY_INTERVAL, first=10, name='expire_cards')
+    job_queue.run_repeating(purge_job, interval=config.PURGE_INTERVAL, first=60, name='purge')
+    if config.FEED_SAMPLER == 'ranked':
+        # First run builds the tables right after start, before the first /cards
+        job_queue.run_repeating(ranking_job, interval=config.RANKING_REFRESH_INTERVAL, first=1, name='feed_ranking')
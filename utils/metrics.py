@@ -0,0 +1,280 @@
+"""
+Метрики в текстовом формате Prometheus (GET /metrics на METRICS_HOST:METRICS_PORT)
+
+Запись дешевая и включена всегда: счетчики и гистограммы с фиксированными
+корзинами - это поиск в словаре и bisect. Источники:
+- задержка обработчиков по команде / префиксу колбэка (PerUserUpdateProcessor);
+- задержка и ошибки вызовов Bot API по методу (InstrumentedRequest);
+- ожидание соединения из пула SQLAlchemy и занятые соединения;
+- stats() кэшей и компонентов (card_cache, known_users, ...) - читаются
+  только при запросе /metrics.
+"""
+import time
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from telegram import Update
+from telegram.request import HTTPXRequest
+from utils.http_server import HttpServer, Request, Response
+import config
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'bot_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+MAX_SERIES = 200  # label sets per metric; the rest go to "other"
+
+# Seconds
+HANDLER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+API_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+POOL_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# Callback data carrying IDs is reported by prefix; the rest is a fixed set of buttons
+CALLBACK_PREFIXES = ('nav_', 'rate_', 'rating_', 'form_', 'admin_', 'back_to_card_')
+
+
+def handler_label(update: object) -> str:
+    """Low-cardinality name of the handler an update goes to"""
+    if not isinstance(update, Update):
+        return type(update).__name__
+    if update.callback_query is not None:
+        data = update.callback_query.data or ''
+        for prefix in CALLBACK_PREFIXES:
+            if data.startswith(prefix):
+                return prefix
+        return data if data.isidentifier() else 'callback'
+    message = update.effective_message
+    if message is not None and message.text and message.text.startswith('/'):
+        return message.text.split()[0].split('@')[0]
+    return 'message'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+
+    def _key(self, labels: Tuple[str, ...], series: dict) -> Tuple[str, ...]:
+        if labels in series or len(series) < MAX_SERIES:
+            return labels
+        return ('other',) * len(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels, self._values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self._values[self._key(labels, self._values)] = value
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = HANDLER_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels, self._series)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Registry of the bot's metrics and of stats() sources read on scrape"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._sources: List[Tuple[str, Callable[[], dict]]] = []
+        self._pools = []
+        self._in_use = 0  # pooled connections checked out
+        self._server: Optional[HttpServer] = None
+
+        self.handler_seconds = self.histogram(
+            'handler_seconds', 'Update processing time by handler', ['handler'], HANDLER_BUCKETS
+        )
+        self.handler_errors = self.counter('handler_errors_total', 'Updates whose handler raised', ['handler'])
+        self.api_seconds = self.histogram(
+            'telegram_api_seconds', 'Bot API request time by method', ['method'], API_BUCKETS
+        )
+        self.api_errors = self.counter(
+            'telegram_api_errors_total', 'Failed Bot API requests by method and cause', ['method', 'error']
+        )
+        self.pool_wait_seconds = self.histogram(
+            'db_pool_checkout_seconds', 'Time to get a connection from the pool', (), POOL_BUCKETS
+        )
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = HANDLER_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, name: str, stats: Callable[[], dict]):
+        """Export the numeric values of ``stats()`` as gauges ``bot_<name>_<key>``"""
+        self._sources.append((name, stats))
+
+    def install_pool(self, engine):
+        """Checkout wait and connections in use of an Engine or AsyncEngine pool"""
+        pool = getattr(engine, 'sync_engine', engine).pool
+        if pool in self._pools:
+            return
+        self._pools.append(pool)
+        # The pool has no "checkout started" event: time the call that hands out connections
+        do_get = pool._do_get
+
+        def timed_do_get():
+            started = time.perf_counter()
+            try:
+                return do_get()
+            finally:
+                self.pool_wait_seconds.observe(time.perf_counter() - started)
+
+        pool._do_get = timed_do_get
+
+        @event.listens_for(pool, 'checkout')
+        def on_checkout(*args):
+            self._in_use += 1
+
+        @event.listens_for(pool, 'checkin')
+        def on_checkin(*args):
+            self._in_use -= 1
+
+        self.register_stats('db_pool', lambda: {
+            'in_use': self._in_use,
+            'size': pool.size() if hasattr(pool, 'size') else 0,
+            'overflow': max(pool.overflow(), 0) if hasattr(pool, 'overflow') else 0,
+        })
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for source, stats in self._sources:
+            try:
+                values = stats()
+            except Exception as e:
+                logger.warning(f"Metrics source {source} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{PREFIX}{source}_{key}"
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, request: Request) -> Response:
+        return Response(200, self.render().encode(), CONTENT_TYPE)
+
+    async def start_server(self):
+        """Serve /metrics on METRICS_HOST:METRICS_PORT (METRICS_PORT=0 disables it)"""
+        if not config.METRICS_PORT or self._server is not None:
+            return
+        server = HttpServer(max_body=0)
+        server.route('GET', '/metrics', self.handle)
+        try:
+            await server.start(config.METRICS_HOST, config.METRICS_PORT)
+        except OSError as e:
+            # Metrics are not worth failing the bot over (e.g. port taken by another instance)
+            logger.warning(f"Metrics server not started: {e}")
+            return
+        self._server = server
+
+    async def stop_server(self):
+        if self._server is not None:
+            await self._server.stop()
+            self._server = None
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records Bot API latency and failures by method"""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            metrics.api_errors.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            metrics.api_seconds.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            metrics.api_errors.inc(api_method, str(code))
+        return code, payload
+
+
+# Shared by the update processor, the Bot API request and the pool listeners
+metrics = Metrics()
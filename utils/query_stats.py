@@ -0,0 +1,179 @@
+"""
+Учет SQL-запросов по обновлениям Telegram
+
+PerUserUpdateProcessor обрабатывает каждое обновление внутри
+query_stats.track(update): контекстная переменная указывает на запись
+обновления, а обработчики событий SQLAlchemy относят к ней каждый запрос,
+его длительность и выдачу соединения из пула (= отдельная сессия/транзакция).
+Задачи обработчика, созданные через application.create_task(..., update=update)
+(UpdateApplication), держат запись открытой: обновление завершается, когда
+закончились и обработчик, и эти задачи. Прочие задачи тоже наследуют
+контекст, но их запросы после завершения записи идут в отдельный счетчик
+фоновых (background_*), а не в обновление.
+
+По завершении обновления оно пишется в лог, если превышен один из порогов
+(QUERY_LOG_STATEMENTS / QUERY_LOG_DB_MS / QUERY_LOG_SESSIONS), а одинаковый
+запрос, выполненный N_PLUS_ONE_REPEATS раз и больше, помечается как N+1.
+"""
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Coroutine, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from utils.metrics import handler_label
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueries:
+    """Statements, database time and pool checkouts of one update"""
+
+    __slots__ = ('label', 'statements', 'db_ms', 'sessions', 'counts', 'holders', 'finished')
+
+    def __init__(self, label: str):
+        self.label = label
+        self.statements = 0
+        self.db_ms = 0.0
+        self.sessions = 0
+        self.counts: Counter = Counter()  # SQL text -> executions
+        self.holders = 1  # the handler, plus background tasks started with update=update
+        self.finished = False
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statements executed at least ``threshold`` times (N+1 candidates)"""
+        return [(sql, count) for sql, count in self.counts.most_common() if count >= threshold]
+
+
+# Update being processed by the current task (inherited by tasks it creates)
+current_queries: ContextVar[Optional[UpdateQueries]] = ContextVar('current_queries', default=None)
+
+
+class QueryStats:
+    """Per-update attribution of SQL statements, with thresholds and N+1 detection"""
+
+    def __init__(self):
+        self._installed = set()
+        # Called with every finished UpdateQueries (e.g. by tools/loadtest.py)
+        self.listeners: List[Callable[[UpdateQueries], None]] = []
+
+        # Metrics
+        self.updates = 0
+        self.statements = 0
+        self.db_ms = 0.0
+        self.sessions = 0
+        self.flagged = 0
+        self.n_plus_one: Counter = Counter()  # label -> updates with repeated statements
+        # Statements of inherited-context tasks that outlived their update's record
+        self.background_statements = 0
+        self.background_db_ms = 0.0
+
+    def install(self, engine):
+        """Listen to an Engine or AsyncEngine"""
+        sync_engine = getattr(engine, 'sync_engine', engine)
+        if sync_engine in self._installed:
+            return
+        event.listen(sync_engine, 'before_cursor_execute', self._before_execute)
+        event.listen(sync_engine, 'after_cursor_execute', self._after_execute)
+        event.listen(sync_engine, 'checkout', self._checkout)
+        self._installed.add(sync_engine)
+
+    @contextmanager
+    def track(self, update: object):
+        record = UpdateQueries(handler_label(update))
+        token = current_queries.set(record)
+        try:
+            yield record
+        finally:
+            current_queries.reset(token)
+            self._release(record)
+
+    def hold(self, coroutine: Coroutine) -> Coroutine:
+        """Keep the current update's record open until the coroutine finishes"""
+        record = current_queries.get()
+        if record is None or record.finished:
+            return coroutine
+        # Taken now, not when the task starts: the handler may return first
+        record.holders += 1
+        return self._held(record, coroutine)
+
+    async def _held(self, record: UpdateQueries, coroutine: Coroutine):
+        try:
+            return await coroutine
+        finally:
+            self._release(record)
+
+    def _release(self, record: UpdateQueries):
+        record.holders -= 1
+        if record.holders == 0:
+            self._finish(record)
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_queries.get() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        record = current_queries.get()
+        started = conn.info.get('query_started')
+        if record is None or not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+        if record.finished:
+            self.background_statements += 1
+            self.background_db_ms += elapsed_ms
+            return
+        record.statements += 1
+        record.db_ms += elapsed_ms
+        record.counts[statement] += 1
+
+    @staticmethod
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        record = current_queries.get()
+        if record is not None and not record.finished:
+            record.sessions += 1
+
+    def _finish(self, record: UpdateQueries):
+        record.finished = True
+        self.updates += 1
+        self.statements += record.statements
+        self.db_ms += record.db_ms
+        self.sessions += record.sessions
+
+        repeated = record.repeated(config.N_PLUS_ONE_REPEATS)
+        if repeated:
+            self.n_plus_one[record.label] += 1
+            for sql, count in repeated:
+                logger.warning(f"Possible N+1 in {record.label}: {count}x {' '.join(sql.split())[:200]}")
+
+        if (
+            record.statements > config.QUERY_LOG_STATEMENTS
+            or record.db_ms > config.QUERY_LOG_DB_MS
+            or record.sessions > config.QUERY_LOG_SESSIONS
+        ):
+            self.flagged += 1
+            logger.warning(
+                f"Heavy update {record.label}: {record.statements} statements, "
+                f"{record.db_ms:.1f} ms in database, {record.sessions} sessions"
+            )
+
+        for listener in self.listeners:
+            listener(record)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'updates': self.updates,
+            'statements_per_update': round(self.statements / self.updates, 2) if self.updates else 0.0,
+            'db_ms_per_update': round(self.db_ms / self.updates, 2) if self.updates else 0.0,
+            'sessions_per_update': round(self.sessions / self.updates, 2) if self.updates else 0.0,
+            'flagged': self.flagged,
+            'n_plus_one': dict(self.n_plus_one),
+            'background_statements': self.background_statements,
+            'background_db_ms': round(self.background_db_ms, 1),
+        }
+
+
+# Shared by the update processor and the engine listeners
+query_stats = QueryStats()
@@ -0,0 +1,340 @@
+"""
+Ранжирование ленты: взвешенная выборка карточек (FEED_SAMPLER=ranked)
+
+Вес карточки в группе = вес группы (FEED_GROUP_WEIGHTS: приоритет D,
+реклама E) x буст свежести x буст рейтинга. Веса считаются заранее: при
+загрузке и затем раз в RANKING_REFRESH_INTERVAL по каждой группе строится
+alias-таблица (метод Vose), и одна выборка стоит O(1). Карточка из
+нескольких групп набора может выпасть через любую из них.
+
+Опубликованные после построения карточки лежат в небольших списках до
+следующего пересчета, удаленные отбрасываются при выборке. Рекламные
+карточки (AD_GROUPS) ограничены по частоте на пользователя - token bucket
+из utils/cooldowns.py.
+"""
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime
+from typing import Container, Dict, List, NamedTuple, Optional, Set, Tuple
+from sqlalchemy import select
+from database.models import Card
+from database.database import get_async_session
+from utils.card_groups import groups_mask, mask_groups
+from utils.cooldowns import cooldown_store
+import config
+
+logger = logging.getLogger(__name__)
+
+# Bayesian average: a card's rating starts at the middle of the scale as if
+# it had RATING_PRIOR_VOTES votes, so one 10 doesn't outrank a hundred 9s
+RATING_PRIOR = (config.MIN_RATING + config.MAX_RATING) / 2
+RATING_PRIOR_VOTES = 5
+
+AD_MASK = groups_mask(config.AD_GROUPS)
+
+
+def card_score(created_at: Optional[datetime], rating_sum: int, rating_count: int,
+               now: datetime) -> float:
+    """Freshness and rating boost of a card (multiplies its group weights)"""
+    score = 1.0
+    if created_at is not None:
+        age_hours = max(0.0, (now - created_at).total_seconds() / 3600)
+        score *= 1 + config.FRESH_BOOST * 0.5 ** (age_hours / config.FRESH_HALF_LIFE_HOURS)
+    average = (
+        ((rating_sum or 0) + RATING_PRIOR * RATING_PRIOR_VOTES)
+        / ((rating_count or 0) + RATING_PRIOR_VOTES)
+    )
+    score *= 1 + config.RATING_BOOST * (average - RATING_PRIOR) / (config.MAX_RATING - RATING_PRIOR)
+    return score
+
+
+def group_weight(group: str) -> float:
+    return config.FEED_GROUP_WEIGHTS.get(group, 1.0)
+
+
+class AliasTable:
+    """Vose's alias method: O(n) build, O(1) weighted draw"""
+
+    __slots__ = ('items', 'weights', 'total', '_prob', '_alias')
+
+    def __init__(self, items: List[int], weights: List[float]):
+        self.items = items
+        self.weights = weights
+        self.total = sum(weights)
+        n = len(items)
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+        if not n:
+            return
+
+        scaled = [weight * n / self.total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._prob[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Leftovers are 1.0 up to rounding
+
+    def draw(self) -> int:
+        i = int(random.random() * len(self.items))
+        if random.random() < self._prob[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class _Extra:
+    """Cards published since the last build: drawn by a linear scan"""
+
+    __slots__ = ('items', 'weights', 'total')
+
+    def __init__(self):
+        self.items: List[int] = []
+        self.weights: List[float] = []
+        self.total = 0.0
+
+    def add(self, card_id: int, weight: float):
+        self.items.append(card_id)
+        self.weights.append(weight)
+        self.total += weight
+
+    def draw(self) -> int:
+        return random.choices(self.items, weights=self.weights)[0]
+
+
+class FeedSample(NamedTuple):
+    """Result of FeedRanking.sample"""
+
+    card_ids: List[int]
+    # Unseen ads were held back by the ad limits: an empty sample doesn't mean
+    # the user has seen everything
+    capped: bool
+
+
+class FeedRanking:
+    """Per-group alias tables over precomputed card weights"""
+
+    def __init__(self):
+        self._tables: Dict[str, AliasTable] = {}
+        self._extra: Dict[str, _Extra] = {}
+        self._extra_ids: Set[int] = set()
+        self._ads: Set[int] = set()
+        self._removed: Set[int] = set()
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.builds = 0
+        self.build_ms = 0.0
+        self.draws = 0
+        self.rejected = 0
+        self.ads_capped = 0
+        self.fallbacks = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def ensure_loaded(self):
+        """Build the tables from the database once per process"""
+        if self._loaded:
+            return
+        async with self._lock:
+            # Concurrent first requests wait for one build instead of each running theirs
+            if self._loaded:
+                return
+            await self._rebuild()
+
+    async def refresh(self):
+        """Recompute weights from the database and rebuild the tables"""
+        async with self._lock:
+            await self._rebuild()
+
+    async def _rebuild(self):
+        async with get_async_session() as session:
+            rows = (await session.execute(select(
+                Card.id, Card.groups_mask, Card.created_at, Card.rating_sum, Card.rating_count
+            ))).all()
+        # Building 100k+ entries takes a while: keep the event loop responsive
+        started = time.perf_counter()
+        built = await asyncio.to_thread(self._build, rows, datetime.utcnow())
+        self._swap(*built, started)
+
+    def load(self, rows, now: datetime):
+        """Build the tables from (id, groups_mask, created_at, rating_sum, rating_count) rows"""
+        started = time.perf_counter()
+        self._swap(*self._build(rows, now), started)
+
+    @staticmethod
+    def _build(rows, now: datetime):
+        members: Dict[str, Tuple[List[int], List[float]]] = {}
+        ads = set()
+        card_ids = set()
+        for card_id, mask, created_at, rating_sum, rating_count in rows:
+            card_ids.add(card_id)
+            if mask & AD_MASK:
+                ads.add(card_id)
+            score = card_score(created_at, rating_sum, rating_count, now)
+            for group in mask_groups(mask):
+                weight = group_weight(group) * score
+                if weight > 0:
+                    items, weights = members.setdefault(group, ([], []))
+                    items.append(card_id)
+                    weights.append(weight)
+        tables = {group: AliasTable(items, weights) for group, (items, weights) in members.items()}
+        return tables, ads, card_ids
+
+    def _swap(self, tables: Dict[str, AliasTable], ads: Set[int], card_ids: Set[int], started: float):
+        """Install new tables, keeping changes made after the rows were read"""
+        pending = self._extra_ids - card_ids
+        for group, extra in list(self._extra.items()):
+            kept = _Extra()
+            for card_id, weight in zip(extra.items, extra.weights):
+                if card_id in pending:
+                    kept.add(card_id, weight)
+            self._extra[group] = kept
+        self._tables = tables
+        self._ads = ads | (self._ads & pending)
+        self._extra_ids = pending
+        self._removed &= card_ids
+        self._loaded = True
+
+        self.builds += 1
+        self.build_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Feed ranking built: {len(card_ids)} cards in {self.build_ms:.0f} ms")
+
+    def add(self, card):
+        """Make a published card drawable before the next rebuild"""
+        if not self._loaded and not self._lock.locked():
+            return
+        mask = card.groups_mask or groups_mask(card.groups)
+        score = card_score(card.created_at, card.rating_sum, card.rating_count, datetime.utcnow())
+        for group in mask_groups(mask):
+            weight = group_weight(group) * score
+            if weight > 0:
+                self._extra.setdefault(group, _Extra()).add(card.id, weight)
+        self._extra_ids.add(card.id)
+        if mask & AD_MASK:
+            self._ads.add(card.id)
+        self._removed.discard(card.id)
+
+    def remove(self, card_id: int):
+        """Stop drawing a removed card"""
+        if self._loaded or self._lock.locked():
+            self._removed.add(card_id)
+            self._extra_ids.discard(card_id)
+
+    def remove_many(self, card_ids):
+        for card_id in card_ids:
+            self.remove(card_id)
+
+    def sample(self, user_id: int, groups, k: int,
+               exclude: Optional[Container[int]] = None) -> FeedSample:
+        """
+        Draw up to k distinct cards of the groups by weight, skipping excluded IDs
+
+        At most AD_MAX_PER_FEED ad cards, and only while the user's ad
+        bucket has tokens. Rejection sampling from the alias tables; only if
+        most candidates are excluded, one weighted pass over the rest.
+        """
+        exclude = exclude if exclude is not None else ()
+        sources = [self._tables.get(group) for group in groups] + [self._extra.get(group) for group in groups]
+        sources = [source for source in sources if source is not None and source.total > 0]
+        total = sum(source.total for source in sources)
+        if not sources or k <= 0:
+            return FeedSample([], False)
+
+        picked = []
+        chosen = set()
+        ads_left = config.AD_MAX_PER_FEED
+        capped = False
+        attempts = 0
+        # Draws cost ~1 us: enough attempts for a user who has seen ~95% of the set
+        max_attempts = k * 32 + 64
+        while len(picked) < k and attempts < max_attempts:
+            attempts += 1
+            point = random.random() * total
+            for source in sources:
+                if point < source.total:
+                    break
+                point -= source.total
+            card_id = source.draw()
+            if card_id in chosen or card_id in exclude or card_id in self._removed:
+                self.rejected += 1
+                continue
+            if card_id in self._ads:
+                if ads_left <= 0 or not self._take_ad(user_id):
+                    ads_left = 0
+                    capped = True
+                    self.rejected += 1
+                    continue
+                ads_left -= 1
+            chosen.add(card_id)
+            picked.append(card_id)
+
+        if len(picked) < k:
+            self.fallbacks += 1
+            rest, rest_capped = self._weighted_rest(user_id, sources, k - len(picked), chosen, exclude, ads_left)
+            picked.extend(rest)
+            capped = capped or rest_capped
+        self.draws += 1
+        return FeedSample(picked, capped)
+
+    def _take_ad(self, user_id: int) -> bool:
+        wait = cooldown_store.consume(user_id, 'feed_ads', config.AD_PER_HOUR / 3600, config.AD_BURST)
+        if wait:
+            self.ads_capped += 1
+        return not wait
+
+    def _weighted_rest(self, user_id: int, sources, k: int, chosen: Set[int],
+                       exclude: Container[int], ads_left: int) -> Tuple[List[int], bool]:
+        """
+        Weighted sampling without replacement over the remaining cards (Efraimidis-Spirakis)
+        Returns: (card IDs, whether remaining ads were skipped by the ad limits)
+        """
+        keys = {}
+        for source in sources:
+            for card_id, weight in zip(source.items, source.weights):
+                if card_id in chosen or card_id in exclude or card_id in self._removed:
+                    continue
+                key = random.random() ** (1 / weight)
+                if key > keys.get(card_id, -1.0):
+                    keys[card_id] = key
+
+        rest = []
+        capped = False
+        for card_id in sorted(keys, key=keys.get, reverse=True):
+            if len(rest) == k:
+                break
+            if card_id in self._ads:
+                if ads_left <= 0 or not self._take_ad(user_id):
+                    ads_left = 0
+                    capped = True
+                    continue
+                ads_left -= 1
+            rest.append(card_id)
+        return rest, capped
+
+    def stats(self) -> dict:
+        return {
+            'cards': sum(len(table) for table in self._tables.values()),
+            'pending': len(self._extra_ids),
+            'removed': len(self._removed),
+            'builds': self.builds,
+            'build_ms': round(self.build_ms, 1),
+            'draws': self.draws,
+            'rejected': self.rejected,
+            'ads_capped': self.ads_capped,
+            'fallbacks': self.fallbacks,
+        }
+
+
+# Shared by all handlers in this process
+feed_ranking = FeedRanking()
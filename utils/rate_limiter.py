@@ -0,0 +1,225 @@
+"""
+Планировщик исходящих запросов к Bot API (rate_limiter приложения)
+
+Запросы с chat_id проходят через token bucket'ы с лимитами Telegram:
+на чат (RATE_LIMIT_CHAT_PER_SECOND), на группу/канал (RATE_LIMIT_GROUP_PER_MINUTE)
+и общий (RATE_LIMIT_GLOBAL_PER_SECOND). Общий лимит раздается по полосам
+приоритета: ответы пользователям (INTERACTIVE, по умолчанию) всегда идут
+раньше массовых рассылок (BULK - ``rate_limit_args=BULK`` в вызове бота),
+а у рассылок есть свой, меньший лимит, так что запас остается.
+
+RetryAfter (429) ставит чат на паузу на указанное время, рассылки - целиком,
+и запрос повторяется до RATE_LIMIT_MAX_RETRIES раз. Запросы без chat_id
+(answerCallbackQuery, getMe, ...) не ограничиваются.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from utils.cooldowns import TokenBucket, BUCKET_SWEEP_INTERVAL
+from utils.metrics import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, highest first
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = ('interactive', 'bulk')
+
+RETRY_AFTER_MARGIN = 0.1  # seconds added to Telegram's retry_after
+
+queue_wait_seconds = metrics.histogram(
+    'telegram_queue_wait_seconds', 'Time a Bot API request waited for rate limits, by lane',
+    ['lane'], (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+retry_after_total = metrics.counter('telegram_retry_after_total', 'RetryAfter (429) responses, by lane', ['lane'])
+
+
+class OutboundScheduler(BaseRateLimiter[int]):
+    """Per-chat, per-group and global token buckets with priority lanes for the global one"""
+
+    def __init__(self):
+        # One second's worth of burst, but at least one whole token
+        self._global = TokenBucket(config.RATE_LIMIT_GLOBAL_PER_SECOND, max(config.RATE_LIMIT_GLOBAL_PER_SECOND, 1))
+        # Extra limit per lane (None = only the global one)
+        self._lane_buckets: List[Optional[TokenBucket]] = [
+            None,
+            TokenBucket(config.RATE_LIMIT_BULK_PER_SECOND, max(config.RATE_LIMIT_BULK_PER_SECOND, 1)),
+        ]
+        self._waiting: List[Deque[asyncio.Future]] = [deque() for _ in LANE_NAMES]
+        self._paused_until = [0.0 for _ in LANE_NAMES]
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._chat_paused_until: Dict[Union[int, str], float] = {}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._last_sweep = time.monotonic()
+
+        # Metrics
+        self.requests = [0 for _ in LANE_NAMES]
+        self.delayed = [0 for _ in LANE_NAMES]
+        self.chat_waiting = 0  # requests held by their chat's bucket or pause
+        self.retry_after = 0
+        self.failed = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for waiting in self._waiting:
+            while waiting:
+                waiting.popleft().cancel()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        lane = rate_limit_args if rate_limit_args in (INTERACTIVE, BULK) else INTERACTIVE
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass  # @channelusername
+        # Negative IDs and usernames are groups and channels
+        is_group = isinstance(chat_id, str) or chat_id < 0
+
+        for attempt in range(config.RATE_LIMIT_MAX_RETRIES + 1):
+            started = time.monotonic()
+            await self._acquire_chat(chat_id, is_group)
+            await self._acquire_global(lane)
+            waited = time.monotonic() - started
+            queue_wait_seconds.observe(waited, LANE_NAMES[lane])
+            self.requests[lane] += 1
+            if waited > 0.001:
+                self.delayed[lane] += 1
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                retry_after_total.inc(LANE_NAMES[lane])
+                self._pause(chat_id, float(e.retry_after) + RETRY_AFTER_MARGIN)
+                if attempt == config.RATE_LIMIT_MAX_RETRIES:
+                    self.failed += 1
+                    raise
+                logger.info(f"{endpoint} to {chat_id}: flood control, retrying in {e.retry_after} s")
+
+    def _pause(self, chat_id: Union[int, str], seconds: float):
+        """Hold the chat, and bulk sends as a whole, until Telegram lets us send again"""
+        until = time.monotonic() + seconds
+        self._chat_paused_until[chat_id] = max(self._chat_paused_until.get(chat_id, 0.0), until)
+        self._paused_until[BULK] = max(self._paused_until[BULK], until)
+
+    async def _acquire_chat(self, chat_id: Union[int, str], is_group: bool):
+        self._sweep()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if is_group:
+                rate = config.RATE_LIMIT_GROUP_PER_MINUTE / 60
+                bucket = TokenBucket(rate, config.RATE_LIMIT_GROUP_BURST)
+            else:
+                bucket = TokenBucket(config.RATE_LIMIT_CHAT_PER_SECOND, config.RATE_LIMIT_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        waiting = False
+        try:
+            while True:
+                wait = max(bucket.wait_time(), self._chat_paused_until.get(chat_id, 0.0) - time.monotonic())
+                if wait <= 0 and bucket.consume():
+                    return
+                if not waiting:
+                    waiting = True
+                    self.chat_waiting += 1
+                await asyncio.sleep(max(wait, 0.001))
+        finally:
+            if waiting:
+                self.chat_waiting -= 1
+
+    async def _acquire_global(self, lane: int):
+        # Fast path: nothing queued at this priority or above and tokens at hand
+        if not any(self._waiting[:lane + 1]) and self._lane_ready(lane) == 0 and self._global.wait_time() == 0:
+            self._take(lane)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[lane].append(future)
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def _lane_ready(self, lane: int) -> float:
+        """Seconds until the lane may send (pause and own bucket)"""
+        wait = self._paused_until[lane] - time.monotonic()
+        bucket = self._lane_buckets[lane]
+        if bucket is not None:
+            wait = max(wait, bucket.wait_time())
+        return max(wait, 0.0)
+
+    def _take(self, lane: int):
+        self._global.consume()
+        bucket = self._lane_buckets[lane]
+        if bucket is not None:
+            bucket.consume()
+
+    async def _dispatch(self):
+        """Hand out global tokens to waiters, highest-priority lane first"""
+        while True:
+            for waiting in self._waiting:
+                while waiting and waiting[0].done():
+                    waiting.popleft()  # cancelled by the caller
+            lanes = [lane for lane, waiting in enumerate(self._waiting) if waiting]
+            if not lanes:
+                return
+
+            # Read each lane once: it may turn ready between two readings
+            lane_waits = {lane: self._lane_ready(lane) for lane in lanes}
+            ready = [lane for lane in lanes if lane_waits[lane] == 0]
+            wait = self._global.wait_time() if ready else max(min(lane_waits.values()), 0.001)
+            if wait > 0:
+                # A new interactive request may become eligible before the timeout
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            lane = ready[0]
+            self._take(lane)
+            self._waiting[lane].popleft().set_result(None)
+
+    def _sweep(self):
+        """Full buckets and expired pauses carry no state, drop them"""
+        now = time.monotonic()
+        if now - self._last_sweep < BUCKET_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.full]:
+            del self._chats[chat_id]
+        for chat_id in [chat_id for chat_id, until in self._chat_paused_until.items() if until <= now]:
+            del self._chat_paused_until[chat_id]
+
+    def stats(self) -> dict:
+        stats = {
+            'chats': len(self._chats),
+            'chat_waiting': self.chat_waiting,
+            'retry_after': self.retry_after,
+            'failed': self.failed,
+        }
+        for lane, name in enumerate(LANE_NAMES):
+            stats[f'{name}_queued'] = len(self._waiting[lane])
+            stats[f'{name}_requests'] = self.requests[lane]
+            stats[f'{name}_delayed'] = self.delayed[lane]
+        return stats
@@ -0,0 +1,355 @@
+"""
+Поисковый индекс каталога в памяти (инвертированный индекс)
+
+Поля: район, категория, хештеги, описание. Нормализация приводит регистр и
+снимает диакритику (ё -> е, ő -> o, á -> a), поэтому «Ujpest» находит «Újpest».
+Каждое слово запроса ищется точно, по префиксу и нечетко (по триграммам).
+"""
+import re
+import math
+import time
+import heapq
+import asyncio
+import logging
+import unicodedata
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from database.models import Card
+from database.database import get_async_session
+
+logger = logging.getLogger(__name__)
+
+# Field weights: a hit in the category counts more than one in the description
+FIELD_WEIGHTS = {
+    'category': 3.0,
+    'district': 2.0,
+    'hashtags': 2.0,
+    'description': 1.0,
+}
+
+# How much each kind of term match is worth
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.7
+FUZZY_MATCH = 0.5
+
+MIN_PREFIX_LEN = 2
+MIN_FUZZY_LEN = 3
+MAX_EXPANSIONS = 30  # prefix/fuzzy terms considered per query word
+FUZZY_THRESHOLD = 0.4  # minimum trigram similarity
+
+_WORD_RE = re.compile(r'\w+')
+_COMBINING_RE = re.compile('[\u0300-\u036f]')  # accents, breve (й), diaeresis (ё, ö)
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip diacritics (Russian and Hungarian aware)"""
+    return _COMBINING_RE.sub('', unicodedata.normalize('NFKD', text.casefold()))
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _WORD_RE.findall(fold(text))
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Inverted index over card text fields
+
+    postings: term -> {card_id: weighted term frequency}. A sorted term list
+    serves prefix lookups and a trigram -> terms map serves fuzzy lookups.
+    Ranking is BM25-style: idf * saturated field-weighted tf, scaled by the
+    match kind and boosted for cards matching every query word. Postings are
+    kept in score order per term, so the top results are found without
+    scoring every posting of common terms.
+    """
+
+    K1 = 1.2
+    B = 0.5
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_len: Dict[int, float] = {}
+        self._total_len = 0.0
+        self._terms: List[str] = []
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._impacts: Dict[str, List[Tuple[float, int]]] = {}
+        self._avg_len = 1.0
+        self._calibrated_docs = 0
+        self._loaded = False
+        self._loading = False
+        self._pending = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    async def ensure_loaded(self):
+        """Build the index from the database once per process"""
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            self._loading = True
+            try:
+                async with get_async_session() as session:
+                    rows = (await session.execute(select(
+                        Card.id, Card.district, Card.category,
+                        Card.hashtags, Card.description
+                    ))).all()
+                # Tokenizing 100k+ cards takes seconds: keep the event loop responsive
+                started = time.perf_counter()
+                built = await asyncio.to_thread(self._build, rows)
+                self._swap(built, started)
+            finally:
+                self._pending = []
+                self._loading = False
+
+    def load(self, rows):
+        """Build the index from (id, district, category, hashtags, description) rows"""
+        started = time.perf_counter()
+        self._swap(self._build(rows), started)
+
+    @classmethod
+    def _build(cls, rows) -> 'SearchIndex':
+        """A filled index; touches no shared state, so it may run in a thread"""
+        index = cls()
+        for row in rows:
+            index._add(*row)
+        return index
+
+    def _swap(self, built: 'SearchIndex', started: float):
+        for name in ('_postings', '_doc_terms', '_doc_len', '_total_len', '_terms', '_trigrams', '_impacts'):
+            setattr(self, name, getattr(built, name))
+        self._calibrated_docs = 0
+        # Cards published or removed while the index was being built
+        for op, args in self._pending:
+            op(*args)
+        self._pending = []
+        self._loaded = True
+        logger.info(
+            f"Search index loaded: {len(self)} cards, {len(self._postings)} terms "
+            f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+
+    def add_card(self, card: Card):
+        self.add(card.id, card.district, card.category, card.hashtags, card.description)
+
+    def add(self, card_id: int, district: Optional[str], category: Optional[str],
+            hashtags: Optional[Iterable[str]], description: Optional[str]):
+        """Index (or re-index) a card"""
+        if self._loading:
+            self._pending.append((self._add, (card_id, district, category, hashtags, description)))
+        elif self._loaded:
+            self._add(card_id, district, category, hashtags, description)
+
+    def remove(self, card_id: int):
+        if self._loading:
+            self._pending.append((self._remove, (card_id,)))
+        elif self._loaded:
+            self._remove(card_id)
+
+    def remove_many(self, card_ids: Iterable[int]):
+        for card_id in card_ids:
+            self.remove(card_id)
+
+    def search(self, query: str, limit: int = 10) -> List[int]:
+        """Card IDs ranked by relevance"""
+        return [card_id for card_id, _ in self.search_scored(query, limit)]
+
+    def search_scored(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words or not self._doc_terms or limit <= 0:
+            return []
+        self._calibrate()
+
+        # Per query word: matching index terms with their coefficient (match weight * idf)
+        word_terms = []
+        streams = []
+        for word in words:
+            coefs = {term: weight * self._idf(term) for term, weight in self._expand(word)}
+            if coefs:
+                word_terms.append(coefs)
+                streams.append(heapq.merge(*(self._stream(term, coef) for term, coef in coefs.items())))
+        if not streams:
+            return []
+
+        # Threshold algorithm: read the per-word streams in score order, score every new
+        # card fully, stop once the k-th best beats anything still unread
+        top: List[Tuple[float, int]] = []
+        scored: Set[int] = set()
+        heads = [0.0] * len(streams)
+        while True:
+            progressed = False
+            for i, stream in enumerate(streams):
+                item = next(stream, None)
+                if item is None:
+                    heads[i] = 0.0
+                    continue
+                progressed = True
+                heads[i] = -item[0]
+                card_id = item[1]
+                if card_id in scored:
+                    continue
+                scored.add(card_id)
+
+                score, matched = self._doc_score(card_id, word_terms)
+                if len(words) > 1:
+                    # Cards matching every word first
+                    score *= (1.0 + matched) / (1.0 + len(words))
+                entry = (score, -card_id)
+                if len(top) < limit:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+
+            if not progressed or (len(top) == limit and top[0][0] >= sum(heads)):
+                break
+
+        return [(-neg_id, score) for score, neg_id in sorted(top, reverse=True)]
+
+    def _doc_score(self, card_id: int, word_terms: List[Dict[str, float]]) -> Tuple[float, int]:
+        """Card score: sum over query words of the best matching term"""
+        terms = self._doc_terms[card_id]
+        doc_len = self._doc_len[card_id]
+        total = 0.0
+        matched = 0
+        for coefs in word_terms:
+            best = 0.0
+            for term, coef in coefs.items():
+                tf = terms.get(term)
+                if tf:
+                    best = max(best, coef * self._impact(tf, doc_len))
+            if best:
+                total += best
+                matched += 1
+        return total, matched
+
+    def _stream(self, term: str, coef: float):
+        """Postings of a term in descending score order, as (-score, card_id)"""
+        for impact, card_id in self._impact_list(term):
+            yield (-coef * impact, card_id)
+
+    def _impact_list(self, term: str) -> List[Tuple[float, int]]:
+        """Postings sorted by saturated tf (cached until the term changes)"""
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            impacts = sorted(
+                ((self._impact(tf, self._doc_len[card_id]), card_id)
+                 for card_id, tf in self._postings[term].items()),
+                key=lambda item: (-item[0], item[1])
+            )
+            self._impacts[term] = impacts
+        return impacts
+
+    def _impact(self, tf: float, doc_len: float) -> float:
+        norm = self.K1 * (1 - self.B + self.B * doc_len / self._avg_len)
+        return tf * (self.K1 + 1) / (tf + norm)
+
+    def _idf(self, term: str) -> float:
+        doc_count = len(self._doc_terms)
+        df = len(self._postings[term])
+        return math.log(1.0 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def _calibrate(self):
+        """Refresh the average card length once the catalog size drifts by 10%"""
+        doc_count = len(self._doc_terms)
+        if doc_count and abs(doc_count - self._calibrated_docs) > 0.1 * self._calibrated_docs:
+            self._avg_len = self._total_len / doc_count or 1.0
+            self._calibrated_docs = doc_count
+            self._impacts.clear()
+
+    def _expand(self, word: str) -> List[Tuple[str, float]]:
+        """Index terms matching a query word, with their match weight"""
+        expansions = []
+        if word in self._postings:
+            expansions.append((word, EXACT_MATCH))
+
+        if len(word) >= MIN_PREFIX_LEN:
+            position = bisect_left(self._terms, word)
+            while position < len(self._terms) and len(expansions) < MAX_EXPANSIONS:
+                term = self._terms[position]
+                if not term.startswith(word):
+                    break
+                if term != word:
+                    expansions.append((term, PREFIX_MATCH))
+                position += 1
+
+        if len(word) >= MIN_FUZZY_LEN and len(expansions) < 3:
+            known = {term for term, _ in expansions}
+            word_grams = trigrams(word)
+            overlap: Dict[str, int] = {}
+            for gram in word_grams:
+                for term in self._trigrams.get(gram, ()):
+                    overlap[term] = overlap.get(term, 0) + 1
+            fuzzy = []
+            for term, shared in overlap.items():
+                if term in known:
+                    continue
+                similarity = shared / (len(word_grams) + len(term) - shared)
+                if similarity >= FUZZY_THRESHOLD:
+                    fuzzy.append((similarity, term))
+            for similarity, term in heapq.nlargest(MAX_EXPANSIONS - len(expansions), fuzzy):
+                expansions.append((term, FUZZY_MATCH * similarity))
+
+        return expansions
+
+    def _add(self, card_id: int, district, category, hashtags, description):
+        self._remove(card_id)
+
+        fields = {
+            'district': tokenize(district),
+            'category': tokenize(category),
+            'hashtags': [t for tag in (hashtags or []) for t in tokenize(tag)],
+            'description': tokenize(description),
+        }
+        terms: Dict[str, float] = {}
+        length = 0.0
+        for field, tokens in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokens:
+                terms[token] = terms.get(token, 0.0) + weight
+                length += weight
+
+        self._doc_terms[card_id] = terms
+        self._doc_len[card_id] = length
+        self._total_len += length
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                insort(self._terms, term)
+                for gram in trigrams(term):
+                    self._trigrams.setdefault(gram, set()).add(term)
+            postings[card_id] = tf
+            self._impacts.pop(term, None)
+
+    def _remove(self, card_id: int):
+        terms = self._doc_terms.pop(card_id, None)
+        if terms is None:
+            return
+        self._total_len -= self._doc_len.pop(card_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[card_id]
+            self._impacts.pop(term, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+                for gram in trigrams(term):
+                    grams = self._trigrams[gram]
+                    grams.discard(term)
+                    if not grams:
+                        del self._trigrams[gram]
+
+
+# Shared by all handlers in this process
+search_index = SearchIndex()
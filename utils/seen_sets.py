@@ -0,0 +1,200 @@
+"""
+Просмотренные карточки: компактный битмап на пользователя
+"""
+import zlib
+import asyncio
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from database.models import SeenSet
+from database.database import get_async_session
+import config
+
+
+class SeenBitmap:
+    """Set of card IDs stored as a bit array (bit N = card N seen)"""
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, bits: Optional[bytearray] = None):
+        self._bits = bits if bits is not None else bytearray()
+
+    @classmethod
+    def from_ids(cls, card_ids: Iterable[int]) -> 'SeenBitmap':
+        bitmap = cls()
+        for card_id in card_ids:
+            bitmap.add(card_id)
+        return bitmap
+
+    @classmethod
+    def from_blob(cls, blob: Optional[bytes]) -> 'SeenBitmap':
+        """Decode a stored (zlib-compressed) bitmap"""
+        if not blob:
+            return cls()
+        return cls(bytearray(zlib.decompress(blob)))
+
+    def to_blob(self) -> bytes:
+        """Encode for storage; IDs are dense, so runs of zeros compress well"""
+        return zlib.compress(bytes(self._bits.rstrip(b'\x00')))
+
+    def copy(self) -> 'SeenBitmap':
+        return SeenBitmap(bytearray(self._bits))
+
+    def add(self, card_id: int) -> bool:
+        """Set the card's bit; returns True if it was not set before"""
+        byte, bit = card_id >> 3, 1 << (card_id & 7)
+        if byte >= len(self._bits):
+            self._bits.extend(b'\x00' * (byte + 1 - len(self._bits)))
+        elif self._bits[byte] & bit:
+            return False
+        self._bits[byte] |= bit
+        return True
+
+    def update(self, other: 'SeenBitmap'):
+        """Union with another bitmap in place"""
+        if len(other._bits) > len(self._bits):
+            self._bits.extend(b'\x00' * (len(other._bits) - len(self._bits)))
+        for i, value in enumerate(other._bits):
+            self._bits[i] |= value
+
+    def __contains__(self, card_id: int) -> bool:
+        byte = card_id >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (card_id & 7)))
+
+    def __len__(self) -> int:
+        return int.from_bytes(self._bits, 'little').bit_count()
+
+    def __iter__(self) -> Iterator[int]:
+        for byte, value in enumerate(self._bits):
+            while value:
+                low = value & -value
+                yield (byte << 3) + low.bit_length() - 1
+                value ^= low
+
+
+class _Entry:
+    __slots__ = ('bitmap', 'generation', 'stored')
+
+    def __init__(self, bitmap: SeenBitmap, generation: int, stored: bool):
+        self.bitmap = bitmap
+        self.generation = generation
+        self.stored = stored
+
+
+# Recently active users' bitmaps, so navigation does not re-read the blob
+_cache: 'OrderedDict[int, _Entry]' = OrderedDict()
+_locks: 'weakref.WeakValueDictionary[int, asyncio.Lock]' = weakref.WeakValueDictionary()
+
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    lock = _locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[user_id] = lock
+    return lock
+
+
+def _remember(user_id: int, entry: _Entry):
+    _cache[user_id] = entry
+    _cache.move_to_end(user_id)
+    while len(_cache) > config.SEEN_SET_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+async def _load(session, user_id: int) -> _Entry:
+    entry = _cache.get(user_id)
+    if entry is not None:
+        _cache.move_to_end(user_id)
+        return entry
+
+    row = (await session.execute(
+        select(SeenSet.bitmap, SeenSet.generation).where(SeenSet.user_id == user_id)
+    )).first()
+    if row:
+        entry = _Entry(SeenBitmap.from_blob(row.bitmap), row.generation, True)
+    else:
+        entry = _Entry(SeenBitmap(), 0, False)
+    _remember(user_id, entry)
+    return entry
+
+
+async def get_seen_set(user_id: int) -> SeenBitmap:
+    """Get the cards the user has seen in the current generation (do not mutate)"""
+    async with get_async_session() as session:
+        return (await _load(session, user_id)).bitmap
+
+
+async def mark_seen(user_id: int, card_id: int) -> bool:
+    """
+    Add card to user's seen set
+    Returns: True if the card was not seen before
+    """
+    async with _user_lock(user_id):
+        for _ in range(3):
+            async with get_async_session() as session:
+                entry = await _load(session, user_id)
+                if card_id in entry.bitmap:
+                    return False
+
+                bitmap = entry.bitmap.copy()
+                bitmap.add(card_id)
+
+                try:
+                    if entry.stored:
+                        # Guarded by generation: a reset elsewhere invalidates our copy
+                        result = await session.execute(
+                            update(SeenSet)
+                            .where(
+                                SeenSet.user_id == user_id,
+                                SeenSet.generation == entry.generation
+                            )
+                            .values(bitmap=bitmap.to_blob(), updated_at=datetime.utcnow())
+                        )
+                        if result.rowcount == 0:
+                            _cache.pop(user_id, None)
+                            continue
+                    else:
+                        session.add(SeenSet(
+                            user_id=user_id,
+                            generation=entry.generation,
+                            bitmap=bitmap.to_blob()
+                        ))
+                    await session.commit()
+                except IntegrityError:
+                    # Row created concurrently - reload and retry
+                    await session.rollback()
+                    _cache.pop(user_id, None)
+                    continue
+
+                entry.bitmap = bitmap
+                entry.stored = True
+                return True
+        return False
+
+
+async def reset_seen(user_id: int):
+    """Start a new generation with an empty seen set (one row write)"""
+    async with _user_lock(user_id):
+        async with get_async_session() as session:
+            entry = await _load(session, user_id)
+            empty = SeenBitmap()
+            if entry.stored:
+                await session.execute(
+                    update(SeenSet)
+                    .where(SeenSet.user_id == user_id)
+                    .values(
+                        bitmap=empty.to_blob(),
+                        generation=SeenSet.generation + 1,
+                        updated_at=datetime.utcnow()
+                    )
+                )
+                await session.commit()
+                generation = await session.scalar(
+                    select(SeenSet.generation).where(SeenSet.user_id == user_id)
+                )
+            else:
+                generation = entry.generation
+            _remember(user_id, _Entry(empty, generation, entry.stored))
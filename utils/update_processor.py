@@ -0,0 +1,104 @@
+"""
+Параллельная обработка обновлений с сохранением порядка для каждого пользователя
+
+Обновления разных пользователей обрабатываются одновременно (до
+MAX_CONCURRENT_UPDATES), обновления одного пользователя - строго по очереди:
+show_card / handle_navigation меняют context.user_data, а состояние
+ConversationHandler хранится по (chat, user).
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Optional
+from weakref import WeakValueDictionary
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+from utils.query_stats import query_stats
+from utils.metrics import metrics, handler_label
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_key(update: object) -> Optional[int]:
+    """Updates with the same key run one after another: the user, else the chat"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs up to ``max_running`` updates at once, serialized per user
+
+    PTB's own limit (``max_pending``) bounds how many updates are admitted.
+    The running limit is taken only after the per-user lock, so a user who
+    sends many updates in a row waits on their own lock without holding
+    slots that other users need.
+    """
+
+    def __init__(self, max_running: int, max_pending: int):
+        super().__init__(max(max_pending, max_running))
+        self._running = asyncio.BoundedSemaphore(max_running)
+        self._locks: 'WeakValueDictionary[int, asyncio.Lock]' = WeakValueDictionary()
+
+        # Metrics
+        self.processed = 0
+        self.serialized = 0  # updates that waited for an earlier one of the same user
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = ordering_key(update)
+        if key is None:
+            await self._run(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        if lock.locked():
+            self.serialized += 1
+        async with lock:
+            await self._run(update, coroutine)
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]):
+        async with self._running:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            started = time.perf_counter()
+            try:
+                # SQL statements of the handler (and tasks it starts with update=update,
+                # see UpdateApplication) count towards this update
+                with query_stats.track(update):
+                    await coroutine
+            finally:
+                metrics.handler_seconds.observe(time.perf_counter() - started, handler_label(update))
+                self.in_flight -= 1
+                self.processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            'processed': self.processed,
+            'serialized': self.serialized,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+        }
+
+
+class UpdateApplication(Application):
+    """Application whose create_task(..., update=update) tasks count towards the update's SQL"""
+
+    def create_task(self, coroutine, update: Optional[object] = None, *, name: Optional[str] = None):
+        if update is not None:
+            coroutine = query_stats.hold(coroutine)
+        return super().create_task(coroutine, update, name=name)
@@ -0,0 +1,131 @@
+"""
+Режим вебхука (альтернатива run_polling)
+
+Telegram присылает обновления POST-запросами на WEBHOOK_PATH. Запрос
+проверяется по секретному токену и кладется в update_queue приложения;
+если очередь заполнена, отвечаем 503 и Telegram повторит доставку позже.
+GET /healthz возвращает состояние приложения и очереди.
+"""
+import json
+import hmac
+import signal
+import asyncio
+import logging
+from typing import Tuple
+from telegram import Update
+from telegram.ext import Application
+from utils.http_server import HttpServer, Request, Response
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+
+class WebhookReceiver:
+    """Turns webhook requests into updates on the application's queue"""
+
+    def __init__(self, application: Application, secret_token: str):
+        if not secret_token:
+            # Without it anyone who finds the URL can post updates as any user
+            raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+        self.application = application
+        self.secret_token = secret_token
+        self.accepted = 0
+        self.rejected = 0
+        self.forbidden = 0
+
+    async def handle_update(self, request: Request) -> Response:
+        if not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), self.secret_token
+        ):
+            self.forbidden += 1
+            return Response(403)
+
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return Response(400, b'Invalid JSON')
+
+        queue = self.application.update_queue
+        if queue.full():
+            # Back-pressure: Telegram retries the update later
+            self.rejected += 1
+            return Response(503)
+
+        queue.put_nowait(Update.de_json(data, self.application.bot))
+        self.accepted += 1
+        return Response(200)
+
+    async def health(self, request: Request) -> Response:
+        queue = self.application.update_queue
+        return Response.json({
+            'status': 'ok' if self.application.running else 'starting',
+            'queue_size': queue.qsize(),
+            'queue_max': queue.maxsize,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'forbidden': self.forbidden,
+        }, status=200 if self.application.running else 503)
+
+
+def create_server(application: Application) -> Tuple[HttpServer, WebhookReceiver]:
+    receiver = WebhookReceiver(application, config.WEBHOOK_SECRET)
+    server = HttpServer()
+    server.route('POST', config.WEBHOOK_PATH, receiver.handle_update)
+    server.route('GET', '/healthz', receiver.health)
+    return server, receiver
+
+
+async def serve_webhook(application: Application, stop_event: asyncio.Event):
+    """Run the application behind the webhook server until ``stop_event`` is set"""
+    server, receiver = create_server(application)
+
+    # Same lifecycle as Application.run_polling
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start(config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+
+        if config.WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info(f"Webhook set to {config.WEBHOOK_URL.rstrip('/')}{config.WEBHOOK_PATH}")
+        else:
+            logger.warning("WEBHOOK_URL is not set, setWebhook skipped")
+
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(
+            f"Webhook stopped: accepted={receiver.accepted}, "
+            f"rejected={receiver.rejected}, forbidden={receiver.forbidden}"
+        )
+
+
+def run_webhook(application: Application):
+    """Blocking entry point, stops on SIGINT/SIGTERM"""
+    async def _main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+        await serve_webhook(application, stop_event)
+
+    asyncio.run(_main())